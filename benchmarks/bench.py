@@ -0,0 +1,333 @@
+#!/usr/bin/python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Benchmarks for the refresh hot paths at growing unit counts.
+
+Reports wall time, D-Bus calls, peak traced memory and the memory blocks
+still allocated after each run. The D-Bus benchmarks run against the
+stand-in systemd from tests/fakesystemd.py, so no live host is needed.
+
+    PYTHONPATH=. python3 benchmarks/bench.py --save benchmarks/baseline.json
+    PYTHONPATH=. python3 benchmarks/bench.py --compare benchmarks/baseline.json
+
+--compare exits with 1 if a benchmark is slower, uses more memory or makes
+more D-Bus calls than the baseline beyond the tolerance.
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from gi.repository import GLib
+
+from src.columns import UI_COLUMNS, DETAIL_COLUMNS, ICON_COLUMNS
+from src.dbuscaller import DBusCaller
+from src.unit import Unit
+from tests.fakesystemd import FakeSystemdProcess, make_units
+
+
+SIZES = [100, 1000, 10000]
+# wall times below this are noise, they are compared as this value
+MIN_WALL_MS = 2.0
+
+
+class Skip(Exception):
+    """Raised by a benchmark that can't run here, e.g. without GTK"""
+
+
+def synthetic_units(count, unittype):
+    """Units as list_details builds them, from the stand-in's property values"""
+    counts = {"services": 0, "timers": 0, "sockets": 0}
+    counts[unittype + "s"] = count
+    units = []
+    for fake in make_units(**counts):
+        if not fake.name.startswith("fake-"):
+            continue
+        unit = Unit(fake.name, fake.path, fake.props["Description"], fake.props["LoadState"],
+                    fake.props["ActiveState"], fake.props["SubState"])
+        DBusCaller.merge_props(unit, DETAIL_COLUMNS[unittype], fake.props, fake.typeprops)
+        units.append(unit)
+    return units
+
+
+def import_gtk_parts():
+    try:
+        from src.application import ServiceMonitor
+        from src.modelsync import ModelSync
+    except (ImportError, ValueError) as e:
+        raise Skip(f"needs GTK: {e}")
+    return ServiceMonitor, ModelSync
+
+
+def make_window(ServiceMonitor):
+    """A ServiceMonitor with just the state build_row and the filter use"""
+    window = ServiceMonitor.__new__(ServiceMonitor)
+    window.pending_actions = {}
+    window.stale_units = set()
+    window.icon_values = {"running": "emblem-ok-symbolic"}
+    return window
+
+
+# Each benchmark takes the unit count and the bench context, and returns the
+# function to time. Anything done before returning is setup and not measured
+
+def bench_getprop_fmt(size, context):
+    units = synthetic_units(size // 2, "service") + synthetic_units(size - size // 2, "timer")
+    columns = {unit['Name']: [col for col in UI_COLUMNS[unit['UnitType']] if col not in ICON_COLUMNS]
+               for unit in units}
+
+    def run():
+        for unit in units:
+            for column in columns[unit['Name']]:
+                unit.getprop_fmt(column)
+    return run
+
+
+def bench_format_column(size, context):
+    units = synthetic_units(size // 2, "service") + synthetic_units(size - size // 2, "timer")
+    services, timers = units[:size // 2], units[size // 2:]
+
+    def run():
+        for group, unittype in ((services, "service"), (timers, "timer")):
+            for column in UI_COLUMNS[unittype]:
+                if column not in ICON_COLUMNS:
+                    Unit.format_column(group, column)
+    return run
+
+
+def bench_unit_storage(size, context):
+    fakes = [fake for fake in make_units(services=size) if fake.name.startswith("fake-")]
+
+    def run():
+        units = []
+        for fake in fakes:
+            unit = Unit(fake.name, fake.path, fake.props["Description"], "loaded", fake.props["ActiveState"],
+                        fake.props["SubState"])
+            DBusCaller.merge_props(unit, DETAIL_COLUMNS["service"], fake.props, fake.typeprops)
+            units.append(unit)
+        return units
+    return run
+
+
+def bench_model_population(size, context):
+    ServiceMonitor, ModelSync = import_gtk_parts()
+    window = make_window(ServiceMonitor)
+    units = synthetic_units(size, "service")
+
+    def run():
+        sync = window.new_sync("service", lambda store: store.flush(notify=False))
+        sync.reconcile(units)
+    return run
+
+
+def bench_model_update(size, context):
+    ServiceMonitor, ModelSync = import_gtk_parts()
+    window = make_window(ServiceMonitor)
+    units = synthetic_units(size, "service")
+    sync = window.new_sync("service")
+    sync.reconcile(units)
+    # a tenth of the units changed state since the last refresh
+    changed = synthetic_units(size, "service")
+    for unit in changed[::10]:
+        unit['Substate'] = "exited"
+
+    def run():
+        sync.reconcile(changed)
+        sync.store.flush()
+        sync.reconcile(units)
+        sync.store.flush()
+    return run
+
+
+def bench_filter(size, context):
+    ServiceMonitor, ModelSync = import_gtk_parts()
+    window = make_window(ServiceMonitor)
+    uidict = {"unittype": "service", "searchterm": ""}
+    uidict["sync"] = window.new_sync("service")
+    uidict["sync"].reconcile(synthetic_units(size, "service"))
+    # typing a name one key at a time, then clearing it
+    term = "fake-service-0001"
+    terms = [term[:num] for num in range(1, len(term) + 1)] + [""]
+
+    def run():
+        for text in terms:
+            window.apply_search(uidict, text)
+        uidict["sync"].store.flush()
+    return run
+
+
+def bench_list_details(size, context):
+    caller = context.caller(size)
+
+    def run():
+        caller.clear_cache()
+        units = caller.list_details(['active'], ['*.service'], DETAIL_COLUMNS["service"])
+        assert units
+    return run
+
+
+def bench_list_details_async(size, context):
+    caller = context.caller(size)
+
+    def run():
+        caller.clear_cache()
+        loop = GLib.MainLoop()
+        caller.list_details_async(['active'], ['*.service'], DETAIL_COLUMNS["service"],
+                                  lambda units, data: loop.quit())
+        loop.run()
+    return run
+
+
+BENCHMARKS = {
+    "getprop_fmt": bench_getprop_fmt,
+    "format_column": bench_format_column,
+    "unit_storage": bench_unit_storage,
+    "model_population": bench_model_population,
+    "model_update": bench_model_update,
+    "filter": bench_filter,
+    "list_details": bench_list_details,
+    "list_details_async": bench_list_details_async,
+}
+
+
+class BenchContext:
+    """Starts one stand-in systemd per unit count, on first use"""
+    def __init__(self):
+        self.fakes = {}
+        self.callers = {}
+
+    def caller(self, size):
+        if size not in self.callers:
+            fake = FakeSystemdProcess(services=size)
+            address = fake.__enter__()
+            self.fakes[size] = fake
+            caller = DBusCaller(bus_address=address)
+            if not caller.init_dbus():
+                raise Skip("could not connect to the stand-in bus")
+            self.callers[size] = caller
+        return self.callers[size]
+
+    def close(self):
+        for caller in self.callers.values():
+            caller.close_dbus()
+        for fake in self.fakes.values():
+            fake.__exit__(None, None, None)
+
+
+def measure(run, repeat, caller=None):
+    """Best wall time of repeat runs, then one traced run for memory"""
+    run()   # warm up
+    best = None
+    for num in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    calls = caller.calls if caller else 0
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "lineno") if stat.count_diff > 0)
+    return {"wall_ms": round(best * 1000, 3),
+            "calls": (caller.calls - calls) if caller else 0,
+            "peak_kib": round(peak / 1024, 1),
+            "blocks": blocks}
+
+
+def run_benchmarks(names, sizes, repeat):
+    results = {}
+    context = BenchContext()
+    try:
+        for name in names:
+            results[name] = {}
+            for size in sizes:
+                try:
+                    run = BENCHMARKS[name](size, context)
+                except Skip as skip:
+                    print(f"{name:20} {size:>6}  skipped, {skip}", file=sys.stderr)
+                    break
+                result = measure(run, repeat, context.callers.get(size) if name.startswith("list") else None)
+                results[name][str(size)] = result
+                print(f"{name:20} {size:>6}  {result['wall_ms']:>10.2f} ms  {result['calls']:>6} calls  "
+                      f"{result['peak_kib']:>10.1f} KiB peak  {result['blocks']:>7} blocks")
+    finally:
+        context.close()
+    return results
+
+
+def compare(results, baseline, tolerance, mem_tolerance):
+    """Returns a line for every result worse than the baseline"""
+    regressions = []
+    for name, sizes in results.items():
+        for size, result in sizes.items():
+            base = baseline.get(name, {}).get(size)
+            if not base:
+                continue
+            wall = max(result["wall_ms"], MIN_WALL_MS)
+            basewall = max(base["wall_ms"], MIN_WALL_MS)
+            if wall > basewall * (1 + tolerance):
+                regressions.append(f"{name} {size}: {result['wall_ms']} ms, baseline {base['wall_ms']} ms")
+            if result["peak_kib"] > base["peak_kib"] * (1 + mem_tolerance):
+                regressions.append(f"{name} {size}: {result['peak_kib']} KiB peak, "
+                                   f"baseline {base['peak_kib']} KiB")
+            if result["calls"] > base["calls"]:
+                regressions.append(f"{name} {size}: {result['calls']} D-Bus calls, baseline {base['calls']}")
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the refresh hot paths")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in SIZES),
+                        help="comma separated unit counts (default: 100,1000,10000)")
+    parser.add_argument("--only", action="append", choices=list(BENCHMARKS), help="run only this benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs, the best is kept (default: 3)")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="fail if worse than the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown as a fraction of the baseline (default: 0.25)")
+    parser.add_argument("--mem-tolerance", type=float, default=0.10,
+                        help="allowed peak memory growth as a fraction of the baseline (default: 0.10)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.compare and not os.path.exists(args.compare):
+        print(f"No baseline at {args.compare}, save one with --save first", file=sys.stderr)
+        return 1
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    results = run_benchmarks(args.only or list(BENCHMARKS), sizes, max(1, args.repeat))
+
+    if args.save:
+        with open(args.save, "w") as output:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                       "results": results}, output, indent=2, sort_keys=True)
+            output.write("\n")
+
+    if args.compare:
+        with open(args.compare) as baselinefile:
+            baseline = json.load(baselinefile)["results"]
+        regressions = compare(results, baseline, args.tolerance, args.mem_tolerance)
+        for line in regressions:
+            print("REGRESSION", line, file=sys.stderr)
+        if regressions:
+            return 1
+        print("No regressions against", args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,6 +4,12 @@ import sys
 RUN_LIB_DIR = os.path.join(os.getcwd(), 'src')
 os.chdir(RUN_LIB_DIR)
 sys.path.append(RUN_LIB_DIR)
+if len(sys.argv) > 1 and sys.argv[1] == "--snapshot":
+    from src.snapshot import main
+    sys.exit(main(sys.argv[2:]))
+if len(sys.argv) > 1 and sys.argv[1] == "--top":
+    from src.topview import main
+    sys.exit(main(sys.argv[2:]))
 from src.application import ServiceMonitor
 sm = ServiceMonitor(os.getcwd())
 sm.run()
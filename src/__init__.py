@@ -1 +1,8 @@
-from .application import ServiceMonitor
+# The window is loaded on first use so the command line modes don't need GTK
+
+
+def __getattr__(name):
+    if name == "ServiceMonitor":
+        from .application import ServiceMonitor
+        return ServiceMonitor
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
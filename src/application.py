@@ -1,15 +1,25 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
+import functools
 import os.path
-import subprocess
 import sys
+import time
 
 import gi
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk, Gdk, GLib
+from gi.repository import Gtk, Gdk, Gio, GLib
 
 from .infodlg import InfoDialog
 from .preferences import PrefDialog, PrefStorage
 from .dbuscaller import DBusCaller
+from .modelsync import ModelSync
+from .bulkaction import BulkScheduler
+from .collector import CollectorClient
+from .columns import UI_COLUMNS, DETAIL_COLUMNS, ICON_COLUMNS, column_prop
+from .helperclient import HelperClient
+from .snapshot import TableWriter
+from .unit import Unit
+from .unitmodel import UnitModel
+from .unitquery import UnitQuery, QueryError
 
 
 ABOUT_NAME = "Service Monitor"
@@ -27,45 +37,82 @@ class ServiceMonitor:
     helper_dir = None
     dbuscaller = DBusCaller()
     dbusready = False
+    helper_client = None
+    # set to run D-Bus and the unit updates in a collector process
+    collector_env = "SERVICEMONITOR_COLLECTOR"
+    collector = None
     UI_FILE = "application.ui"
     UNIT_HELPER_CMD = 'unithelper.py'
     REFRESH_DBUS_WAIT = 1
+    # a refresh shows what has arrived by then, a busy systemd leaves stale rows
+    REFRESH_DEADLINE_MS = 8000
+    ACTION_CONCURRENCY = 4
+    SEARCH_DELAY_MS = 100
     ICON_ENABLE_ON = "gtk-add"
     ICON_ENABLE_OFF = "gtk-remove"
+    ICON_PENDING = "process-working-symbolic"
+    # rows whose values systemd did not answer for in the last refresh
+    ICON_STALE = "dialog-warning-symbolic"
+    ICON_COLUMN_WIDTH = 32
 
     window = None
     search_entry = None
     action_toolbar = None
     status_label = None
     show_inactive = None
+    live_updates_switch = None
     winmaximized = False
     winposition = None
     pending_refresh = False
+    search_timeout = 0
 
     include_all = False
+    live_updates = False
+    watched_units = {}
+    pending_actions = {}
+    stale_units = set()
+    action_concurrency = ACTION_CONCURRENCY
     current_ui = None
     service_ui = {"unittype": "service",
                   "treeview": None,
                   "datastore": None,
-                  "filter": None,
+                  "sync": None,
+                  "serial": 0,
+                  "fetch": None,
+                  "partials": [],
+                  "dirty": True,
+                  "dirty_units": set(),
                   "statuslabel": None,
                   "searchterm": "",
+                  "searchquery": False,
                   "hidden_cols": []}
 
     timer_ui = {"unittype": "timer",
                 "treeview": None,
                 "datastore": None,
-                "filter": None,
+                "sync": None,
+                "serial": 0,
+                "fetch": None,
+                "partials": [],
+                "dirty": True,
+                "dirty_units": set(),
                 "statuslabel": None,
                 "searchterm": "",
+                "searchquery": False,
                 "hidden_cols": []}
 
     socket_ui = {"unittype": "socket",
                  "treeview": None,
                  "datastore": None,
-                 "filter": None,
+                 "sync": None,
+                 "serial": 0,
+                 "fetch": None,
+                 "partials": [],
+                 "dirty": True,
+                 "dirty_units": set(),
                  "statuslabel": None,
                  "searchterm": "",
+                 "searchquery": False,
                  "hidden_cols": []}
     # mapping for the treeview index:
     # 0: Name, 3: Substate, 4: Unit File State
@@ -73,15 +120,9 @@ class ServiceMonitor:
     COL_SUBSTATE = 3
     COL_UFSTATE = 4
 
-    ui_columns = {
-        "service": ["Name", "S", "State", "Substate", "Unit File State", "Type", "Fragment Path", "Description",
-                    "Main PID"],
-        "timer": ["Name", "S", "State", "Substate", "Unit File State", "Triggers", "LastTriggerUSec",
-                  "NextElapseUSecRealtime", "Unit", "FragmentPath", "Description", "Timers Calendar", "Result"],
-        "socket": ["Name", "S", "State", "Substate", "Unit File State", "Listen", "Triggers", "FileDescriptorName",
-                   "FragmentPath", "Result", "N Accept", "N Connections", "Description"]}
+    ui_columns = UI_COLUMNS
 
-    icon_column = {"S": "Substate"}
+    icon_column = ICON_COLUMNS
     icon_values = {"running": "sm-status-green",
                    "exited": "sm-status-grey",
                    "dead": "sm-status-grey",
@@ -90,11 +131,7 @@ class ServiceMonitor:
                    "waiting": "sm-status-grey",
                    "unknown": "sm-status-black"}
 
-    ui_detail_columns = {
-        "service": ["UnitFileState", "Type", "FragmentPath", "MainPID"],
-        "timer": ["Triggers", "LastTriggerUSec", "NextElapseUSecRealtime", "Unit", "FragmentPath", "TimersCalendar",
-                  "Result"],
-        "socket": ["Listen", "Triggers", "FileDescriptorName", "FragmentPath", "Result", "NAccept", "NConnections"]}
+    ui_detail_columns = DETAIL_COLUMNS
 
     def __init__(self, rundir, helperdir=None):
         self.run_dir = os.path.abspath(rundir)
@@ -105,12 +142,24 @@ class ServiceMonitor:
 
     def _getconvert_coltypes(self, unittype):
         columns = self.ui_columns[unittype]
-        coltypes = [str for i in columns]
+        # the visible flag follows the shown columns
+        coltypes = [str for i in columns] + [bool]
         colimage = ""
         if "S" in columns:
             colimage = "S"
         return columns, coltypes, colimage
 
+    def new_sync(self, unittype, attach_cb=None, uidict=None):
+        """ModelSync of a tab, keeping the raw rows of build_row in UnitModels
+            that format the cells as they are drawn. Searches look in the
+            columns uidict doesn't hide"""
+        columns, coltypes, colimage = self._getconvert_coltypes(unittype)
+        formatters = [None if col in self.icon_column else functools.partial(Unit.format_value, col)
+                      for col in columns]
+        return ModelSync(coltypes, lambda unit: self.build_row(unittype, unit), attach_cb, len(columns),
+                         lambda: UnitModel(coltypes, formatters, len(columns), self.COL_NAME),
+                         lambda unit: self.search_key(unittype, unit, uidict["hidden_cols"] if uidict else ()))
+
     def buildui(self, unittype, uidict):
         # Get ui definition
         uicols, coltypes, colimage = self._getconvert_coltypes(unittype)
@@ -118,88 +167,319 @@ class ServiceMonitor:
             return
         # Tree selection
         select = uidict["treeview"].get_selection()
-        select.set_mode(Gtk.SelectionMode.SINGLE)
+        select.set_mode(Gtk.SelectionMode.MULTIPLE)
         select.connect("changed", self.on_tree_selection_change, unittype)
         select.unselect_all()
 
         # Build data store
-        uidict["datastore"] = Gtk.ListStore()
-        uidict["datastore"].set_column_types(coltypes)
-        uidict["filter"] = uidict["datastore"].filter_new()
-        uidict["filter"].set_visible_func(self.filter_data_func)
-        uidict["treeview"].set_model(Gtk.TreeModelSort(model=uidict["filter"]))
+        uidict["sync"] = self.new_sync(unittype, lambda store: self.attach_datastore(uidict, store), uidict)
+        self.attach_datastore(uidict, uidict["sync"].store)
         hidden_cols = uidict["hidden_cols"]
+        charwidth = uidict["treeview"].create_pango_layout("0").get_pixel_size()[0]
         for num, col in enumerate(uicols):
             if col in colimage:
                 tvcolumn = Gtk.TreeViewColumn(col, Gtk.CellRendererPixbuf(), icon_name=num)
+                width = self.ICON_COLUMN_WIDTH
             else:
                 tvcolumn = Gtk.TreeViewColumn(col, Gtk.CellRendererText(), text=num)
                 tvcolumn.set_resizable(True)
                 tvcolumn.set_sort_column_id(num)
+                width = (TableWriter.width(col) + 2) * charwidth
+            # with fixed sizes the view only measures the rows it shows, so
+            # cells are formatted as they scroll into view
+            tvcolumn.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+            tvcolumn.set_fixed_width(width)
             if col in hidden_cols:
                 tvcolumn.set_visible(False)
 
             uidict["treeview"].append_column(tvcolumn)
+        uidict["treeview"].set_fixed_height_mode(True)
         uidict["treeview"].get_model().set_sort_column_id(0, Gtk.SortType.ASCENDING)
 
+    def attach_datastore(self, uidict, store):
+        """Show store in the tree, keeping the sort order, selection and scroll
+            position of the old model"""
+        treeview = uidict["treeview"]
+        oldmodel = treeview.get_model()
+        selected = []
+        scroll = None
+        if oldmodel:
+            colid, order = oldmodel.get_sort_column_id()
+            if colid is not None:
+                store.set_sort_column_id(colid, order)
+            model, paths = treeview.get_selection().get_selected_rows()
+            selected = [model.get_value(model.get_iter(path), self.COL_NAME) for path in paths]
+            vadj = treeview.get_vadjustment()
+            if vadj:
+                scroll = vadj.get_value()
+
+        store.flush(notify=False)
+        uidict["datastore"] = store
+        treeview.set_model(store)
+
+        if selected:
+            selection = treeview.get_selection()
+            for name in selected:
+                path = store.path_of(name)
+                if path is not None:
+                    selection.select_path(path)
+        if scroll is not None:
+            GLib.idle_add(self.on_restore_scroll, treeview, scroll)
+
+    def on_restore_scroll(self, treeview, value):
+        vadj = treeview.get_vadjustment()
+        if vadj:
+            vadj.set_value(value)
+        return False
+
+    def build_row(self, unittype, u):
+        """Raw values of the shown columns, formatted by the UnitModel when drawn"""
+        line = []
+        pending = u['Name'] in self.pending_actions
+        for column in self.ui_columns[unittype]:
+            if column in self.icon_column and pending:
+                line.append(self.ICON_PENDING)
+            elif column in self.icon_column and u['Name'] in self.stale_units:
+                line.append(self.ICON_STALE)
+            elif column in self.icon_column:
+                iconfield = self.icon_column[column]
+                iconsourcevalue = u.get(iconfield, "unknown")
+                iconname = self.icon_values.get(iconsourcevalue)
+                line.append(iconname)
+            else:
+                line.append(u.get(column_prop(column)))
+        # the visible flag ModelSync fills in
+        line.append(True)
+        return line
+
+    def search_key(self, unittype, unit, hidden_cols=()):
+        """Lowercase text of the shown columns to search in, ModelSync builds
+            it for the first search after the row changed"""
+        return "\t".join(unit.getprop_fmt(column) for column in self.ui_columns[unittype]
+                          if column not in self.icon_column and column not in hidden_cols).lower()
+
+    def shown_detail_columns(self, uidict):
+        """Detail properties of a tab without those of hidden columns, which aren't fetched"""
+        hidden = [column_prop(col) for col in uidict["hidden_cols"]]
+        return [prop for prop in self.ui_detail_columns[uidict["unittype"]] if prop not in hidden]
+
     def refresh_ui(self):
         if not self.dbusready:
             return
-        # remove all data
-        self.current_ui["datastore"].clear()
-        # refresh data
-        unittype = self.current_ui["unittype"]
-        columns = self.ui_columns[unittype]
+        # request data, the rows are reconciled once all details have arrived
+        uidict = self.current_ui
+        unittype = uidict["unittype"]
         unitfilter = ["*." + unittype]
         statefilter = ['active']
         if self.include_all:
             statefilter = []
 
-        unitlist = self.dbuscaller.list_details(statefilter, unitfilter, self.ui_detail_columns[unittype])
+        uidict["dirty"] = False
+        uidict["dirty_units"] = set()
+        uidict["serial"] += 1
+        if self.collector:
+            self.collector.watch(unittype, statefilter, unitfilter, self.shown_detail_columns(uidict))
+            return
+        # a newer refresh supersedes the ones in flight, partial ones too
+        if uidict["fetch"]:
+            uidict["fetch"].cancel()
+            uidict["fetch"] = None
+        for fetch in uidict["partials"]:
+            fetch.cancel()
+        uidict["partials"] = []
+        uidict["fetch"] = self.dbuscaller.list_details_async(statefilter, unitfilter,
+                                                             self.shown_detail_columns(uidict),
+                                                             self.on_refresh_details, (uidict, uidict["serial"]),
+                                                             deadline_millis=self.REFRESH_DEADLINE_MS)
+
+    def on_refresh_details(self, unitlist, data):
+        uidict, serial = data
+        if serial != uidict["serial"]:
+            # a newer refresh of this tab was requested while this one was in flight
+            return
+        fetch = uidict["fetch"]
+        uidict["fetch"] = None
+        unittype = uidict["unittype"]
+        sync = uidict["sync"]
+        if fetch and fetch.list_error:
+            # keep the rows shown and try again on the next refresh
+            uidict["dirty"] = True
+            self.mark_rows_stale(uidict, list(sync.units))
+            if uidict is self.current_ui:
+                self.status_label.set_label(f"systemd did not answer, showing {len(sync.rows)} stale "
+                                            f"{unittype} units")
+            return
+        stale = fetch.stale if fetch else set()
+        self.keep_stale_details(uidict, unitlist, stale)
+        self.set_stale(uidict, unitlist, stale, full=True)
         totalunits = len(unitlist)
-        for u in unitlist:
-            line = []
-            for column in columns:
-                if column in self.icon_column:
-                    iconfield = self.icon_column[column]
-                    iconsourcevalue = u.get(iconfield, "unknown")
-                    iconname = self.icon_values.get(iconsourcevalue)
-                    line.append(iconname)
-                    pass
-                else:
-                    line.append(u.getprop_fmt(column))
-            # line = list(u.getprop_fmt(c) for c in columns)
-            self.current_ui["datastore"].append(line)
-        self.status_label.set_label(f"Refreshed {totalunits} {unittype} units")
+        sync.reconcile(unitlist)
+        if uidict is not self.current_ui:
+            return
+        if stale:
+            self.status_label.set_label(f"Refreshed {totalunits} {unittype} units, {len(stale)} stale")
+        else:
+            self.status_label.set_label(f"Refreshed {totalunits} {unittype} units")
+        stats = self.dbuscaller.cache_stats()
+        self.status_label.set_tooltip_text(f"Property cache: {stats['hits']} hits, {stats['misses']} misses, "
+                                           f"{stats['size']} entries")
+        self.watch_current_units()
+
+    def keep_stale_details(self, uidict, unitlist, stale):
+        """Fill the details stale units are missing from their last refresh,
+            and fetch them again with the next one"""
+        if not stale:
+            return
+        sync = uidict["sync"]
+        for unit in unitlist:
+            if unit['Name'] not in stale:
+                continue
+            old = sync.get_unit(unit['Name'])
+            if old is None:
+                continue
+            for prop in self.ui_detail_columns[uidict["unittype"]]:
+                if prop not in unit and prop in old:
+                    unit[prop] = old[prop]
+        uidict["dirty_units"].update(stale)
+
+    def set_stale(self, uidict, unitlist, stale, full=False):
+        """Mark the stale units of a refresh, before ModelSync builds their rows,
+            the others lose the mark. A full refresh also forgets units of the
+            tab it didn't list"""
+        if full:
+            suffix = "." + uidict["unittype"]
+            self.stale_units.difference_update([name for name in self.stale_units if name.endswith(suffix)])
+        for unit in unitlist:
+            if unit['Name'] in stale:
+                self.stale_units.add(unit['Name'])
+            else:
+                self.stale_units.discard(unit['Name'])
+
+    def mark_rows_stale(self, uidict, names):
+        """Mark rows already shown as stale, for names systemd did not answer for"""
+        sync = uidict["sync"]
+        for name in names:
+            unit = sync.get_unit(name)
+            if unit is not None:
+                self.stale_units.add(name)
+                sync.update(unit)
+
+    def start_collector(self):
+        """Run the collector process, with this package importable from it"""
+        packages = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        pythonpath = os.pathsep.join(path for path in (packages, os.environ.get("PYTHONPATH")) if path)
+        argv = [sys.executable, "-m", __package__ + ".collector"]
+        self.collector = CollectorClient(argv, self.on_collector_update, self.on_collector_exit,
+                                         {"PYTHONPATH": pythonpath})
+        if not self.collector.start():
+            self.collector = None
+        return self.collector is not None
+
+    def on_collector_update(self, unittype, update):
+        uidict = next(uidict for uidict in self.all_ui() if uidict["unittype"] == unittype)
+        sync = uidict["sync"]
+        if update["error"]:
+            # keep the rows shown, the collector tries again on the next signal
+            uidict["dirty"] = True
+            self.mark_rows_stale(uidict, update["stale"] or list(sync.units))
+            if uidict is self.current_ui:
+                self.status_label.set_label(f"systemd did not answer, showing {len(sync.rows)} stale "
+                                            f"{unittype} units")
+            return
+        self.set_stale(uidict, update["units"], set(update["stale"]), update["full"])
+        if update["full"]:
+            sync.reconcile(update["units"])
+        else:
+            for unit in update["units"]:
+                sync.update(unit)
+            for name in update["removed"]:
+                self.stale_units.discard(name)
+                sync.remove(name)
+            # names that came without units, e.g. a status record, keep their rows
+            self.mark_rows_stale(uidict, [name for name in update["stale"] if name not in self.stale_units])
+        if uidict is not self.current_ui:
+            return
+        stale = update["stale"]
+        if update["full"]:
+            label = f"Refreshed {len(update['units'])} {unittype} units"
+        else:
+            label = f"Updated {len(update['units']) + len(update['removed'])} {unittype} units"
+        self.status_label.set_label(f"{label}, {len(stale)} stale" if stale else label)
+        self.refresh_toolbar_state(uidict["treeview"].get_selection())
+
+    def on_collector_exit(self):
+        print("The collector exited, refreshing in the window", file=sys.stderr)
+        self.collector = None
+        self.dbuscaller.unsubscribe_signals()
+        self.dbusready = self.dbuscaller.subscribe_signals(self.refresh_manager)
+        self.mark_all_dirty()
+        if self.current_ui:
+            self.watch_current_units()
+            self.reconcile_tab(self.current_ui)
+
+    def watch_current_units(self):
+        """Follow property changes of the units loaded in the current tab if
+            live updates are on"""
+        if self.collector:
+            live = self.live_updates and self.current_ui
+            self.collector.live(self.current_ui["unittype"] if live else None)
+            return
+        if not self.live_updates or not self.current_ui:
+            self.watched_units = {}
+            self.dbuscaller.unsubscribe_properties()
+            return
+        uidict = self.current_ui
+        self.watched_units = {unit['Path']: (uidict, name) for name, unit in uidict["sync"].units.items()}
+        self.dbuscaller.subscribe_properties(self.watched_units.keys(), self.on_unit_properties)
+
+    def on_unit_properties(self, path, iface, changed):
+        watched = self.watched_units.get(path)
+        if not watched:
+            return
+        uidict, name = watched
+        sync = uidict["sync"]
+        unit = sync.get_unit(name)
+        if unit is None or not unit.apply_props(changed):
+            return
+        if sync.update(unit) and uidict is self.current_ui:
+            self.refresh_toolbar_state(uidict["treeview"].get_selection())
 
     def refresh_toolbar_state(self, select):
-        model, row = select.get_selected()
-        if not model or not row:
+        rows = self.selected_rows(select)
+        if not rows:
             self.toolbar_state()
             return
-        name, substate, unitstate = model.get(row, 0, 3, 4)
+        # wait for running actions to finish
+        rows = [row for row in rows if row[0] not in self.pending_actions]
         start = False
         stop = False
         restart = False
+        reset = False
         info = True
+        unitstates = set()
 
-        if substate == "exited" or substate == "failed" or substate == "dead":
-            start = True
+        for name, substate, unitstate in rows:
+            if substate == "exited" or substate == "failed" or substate == "dead":
+                start = True
 
-        if substate == "running":
-            stop = True
+            if substate == "running":
+                stop = True
 
-        if substate != "waiting":
-            restart = True
+            if substate != "waiting":
+                restart = True
 
-        if unitstate == "enabled":
+            if substate == "failed":
+                reset = True
+            unitstates.add(unitstate)
+
+        if unitstates == {"enabled"}:
             enable = "off"
-        elif unitstate == "disabled":
+        elif unitstates == {"disabled"}:
             enable = "on"
         else:
             enable = False
 
-        self.toolbar_state(start=start, stop=stop, restart=restart, enable=enable, info=info)
+        self.toolbar_state(start=start, stop=stop, restart=restart, reset=reset, enable=enable, info=info)
 
         # if substate == "running":
         #     self.toolbar_state(start=False, stop=True, restart=True, info=True)
@@ -224,15 +504,123 @@ class ServiceMonitor:
     def on_refresh_callback(self, *args):
         self.status_label.set_label("Refreshing list...")
         self.pending_refresh = False
-        self.refresh_ui()
+        dirty_all, dirty_units = self.dbuscaller.take_dirty()
+        # route the changes to the tab that owns each unit type
+        for uidict in self.all_ui():
+            if dirty_all:
+                uidict["dirty"] = True
+            suffix = "." + uidict["unittype"]
+            uidict["dirty_units"].update(name for name in dirty_units if name.endswith(suffix))
+        self.reconcile_tab(self.current_ui)
+        return False
 
-    def filter_data_func(self, model, iter, data):
-        if not self.current_ui or not self.current_ui["searchterm"]:
-            return True
-        row = "".join(model[iter])
-        if row.find(self.current_ui["searchterm"]) >= 0:
+    def all_ui(self):
+        return self.service_ui, self.timer_ui, self.socket_ui
+
+    def mark_all_dirty(self):
+        for uidict in self.all_ui():
+            uidict["dirty"] = True
+
+    def reconcile_tab(self, uidict):
+        """Bring the current tab up to date, re-fetching only what was marked dirty"""
+        names = uidict["dirty_units"]
+        if uidict["dirty"] or len(names) > len(uidict["sync"].rows) // 2:
+            self.refresh_ui()
+        elif names:
+            uidict["dirty_units"] = set()
+            self.refresh_units(uidict, list(names))
+        else:
+            self.status_label.set_label(f"Showing {len(uidict['sync'].rows)} {uidict['unittype']} units")
+
+    def refresh_units(self, uidict, names):
+        """Re-fetch only the named units of a tab and patch their rows"""
+        if not self.dbusready:
+            return
+        if self.collector:
+            self.collector.refresh(uidict["unittype"], names)
+            return
+        # tagged with the serial of the last full refresh, one started later drops the reply
+        request = {"serial": uidict["serial"]}
+        request["fetch"] = self.dbuscaller.unit_list_details_async(names, self.shown_detail_columns(uidict),
+                                                                   self.on_units_details, (uidict, names, request),
+                                                                   deadline_millis=self.REFRESH_DEADLINE_MS)
+        uidict["partials"] = [fetch for fetch in uidict["partials"] if not fetch.finished] + [request["fetch"]]
+
+    def on_units_details(self, unitlist, data):
+        uidict, names, request = data
+        if request["serial"] != uidict["serial"]:
+            return
+        sync = uidict["sync"]
+        fetch = request.get("fetch")
+        if fetch and fetch.list_error:
+            uidict["dirty_units"].update(names)
+            self.mark_rows_stale(uidict, names)
+            if uidict is self.current_ui:
+                self.status_label.set_label(f"systemd did not answer, {len(names)} {uidict['unittype']} "
+                                            f"units are stale")
+            return
+        if fetch:
+            self.keep_stale_details(uidict, unitlist, fetch.stale)
+            self.set_stale(uidict, unitlist, fetch.stale)
+        found = set()
+        for unit in unitlist:
+            found.add(unit['Name'])
+            if self.unit_in_view(unit):
+                sync.update(unit)
+            else:
+                sync.remove(unit['Name'])
+        for name in names:
+            if name not in found:
+                self.stale_units.discard(name)
+                sync.remove(name)
+        if uidict is self.current_ui:
+            self.status_label.set_label(f"Updated {len(names)} {uidict['unittype']} units")
+            self.watch_current_units()
+            self.refresh_toolbar_state(uidict["treeview"].get_selection())
+
+    def unit_in_view(self, unit):
+        """Matches the state filter refresh_ui passes to ListUnitsByPatterns"""
+        if unit['Load'] == 'not-found':
+            return False
+        if self.include_all:
             return True
-        return False
+        return 'active' in (unit['Load'], unit['State'], unit['Substate'])
+
+    def apply_search(self, uidict, text):
+        """Show the rows of a tab whose search key has text in it, ignoring case.
+            A longer term only re-checks the shown rows and a shorter one the
+            hidden rows. Text with fields, e.g. state:failed, is a UnitQuery
+            over the raw properties, see unitquery"""
+        term = text.lower()
+        old = uidict["searchterm"]
+        if term == old:
+            return
+        try:
+            query = UnitQuery(text)
+        except QueryError:
+            # incomplete while typing, e.g. "next<", keep the last filter
+            return
+        wasquery = uidict.get("searchquery", False)
+        uidict["searchterm"] = term
+        uidict["searchquery"] = not query.is_plain
+        sync = uidict["sync"]
+        if uidict["searchquery"]:
+            sync.filter(lambda unit, row: query.matches(unit, sync.key(unit)),
+                        ModelSync.FILTER_ALL, query.candidates(sync.index))
+            return
+        # narrower and wider only hold between two plain terms
+        if wasquery:
+            scope = ModelSync.FILTER_ALL
+        elif old and old in term:
+            scope = ModelSync.FILTER_SHOWN
+        elif term in old:
+            scope = ModelSync.FILTER_HIDDEN
+        else:
+            scope = ModelSync.FILTER_ALL
+        if not term:
+            sync.filter(None, scope)
+            return
+        sync.filter(lambda unit, row: term in sync.key(unit), scope)
 
     # Tree Selection
     def on_tree_selection_change(self, select, data):
@@ -241,15 +629,31 @@ class ServiceMonitor:
     # Header bar actions
     def on_show_inactive_state_set(self, widget, data):
         self.include_all = data
+        self.mark_all_dirty()
         self.refresh_ui()
 
+    def on_live_updates_state_set(self, widget, data):
+        self.live_updates = data
+        self.watch_current_units()
+
     def on_toprefresh_clicked(self, widget):
+        self.dbuscaller.clear_cache()
+        if self.collector:
+            self.collector.clear_cache()
+        self.mark_all_dirty()
         self.refresh_ui()
 
     # Search events
     def on_main_search_search_changed(self, widget):
-        self.current_ui["searchterm"] = widget.get_text()
-        self.current_ui["filter"].refilter()
+        # typing restarts the wait, only the last term is applied
+        if self.search_timeout:
+            GLib.source_remove(self.search_timeout)
+        self.search_timeout = GLib.timeout_add(self.SEARCH_DELAY_MS, self.on_search_timeout)
+
+    def on_search_timeout(self):
+        self.search_timeout = 0
+        self.apply_search(self.current_ui, self.search_entry.get_text())
+        return False
 
     def on_mainstack_set_focus_child(self, widget, data):
         boxname = widget.get_visible_child_name()
@@ -264,9 +668,11 @@ class ServiceMonitor:
         else:
             return
 
-        self.refresh_ui()
-        self.current_ui["searchterm"] = self.search_entry.get_text()
-        self.current_ui["filter"].refilter()
+        # show the rows kept for this tab straight away, then catch up on changes
+        self.apply_search(self.current_ui, self.search_entry.get_text())
+        self.watch_current_units()
+        self.refresh_toolbar_state(self.current_ui["treeview"].get_selection())
+        self.reconcile_tab(self.current_ui)
 
     def on_unitaction_clicked(self, widget):
         action = widget.get_name()
@@ -284,6 +690,8 @@ class ServiceMonitor:
             unitmethod = "Stop"
         elif action == "restart-btn":
             unitmethod = "Restart"
+        elif action == "reset-btn":
+            unitmethod = "ResetFailed"
         if not unitmethod:
             return
         self.call_unit_method(unitmethod)
@@ -293,10 +701,17 @@ class ServiceMonitor:
                                  self.socket_ui["treeview"])
         pref_dialog.run()
         pref_dialog.destroy()
-        # record hidden columns
+        # record hidden columns, the shown ones decide what a refresh fetches
+        hidden = [uidict["hidden_cols"] for uidict in self.all_ui()]
         self.store_hidden_columns(self.service_ui)
         self.store_hidden_columns(self.timer_ui)
         self.store_hidden_columns(self.socket_ui)
+        if hidden != [uidict["hidden_cols"] for uidict in self.all_ui()]:
+            # searches look in the shown columns only
+            for uidict in self.all_ui():
+                uidict["sync"].clear_keys()
+            self.mark_all_dirty()
+            self.reconcile_tab(self.current_ui)
 
     def on_about_clicked(self, *args):
         about = Gtk.AboutDialog(program_name=ABOUT_NAME, version=ABOUT_VERSION,
@@ -317,8 +732,13 @@ class ServiceMonitor:
 
     def on_main_window_destroy(self, *args):
         self.dbuscaller.close_dbus()
+        if self.helper_client:
+            self.helper_client.close()
+        if self.collector:
+            self.collector.close()
         # save user settings
         PrefStorage.set(PrefStorage.SHOW_INACTIVE, self.include_all)
+        PrefStorage.set(PrefStorage.LIVE_UPDATES, self.live_updates)
         PrefStorage.set(PrefStorage.WIN_MAXIMIZED, self.winmaximized)
         PrefStorage.set(PrefStorage.WIN_POSITION, self.winposition)
         PrefStorage.set(PrefStorage.HIDE_SERVICE_COL, self.service_ui["hidden_cols"])
@@ -327,13 +747,20 @@ class ServiceMonitor:
         # End it all
         Gtk.main_quit()
 
+    def selected_rows(self, selection):
+        """Name, substate and unit file state of each selected row"""
+        model, paths = selection.get_selected_rows()
+        if not model:
+            return []
+        return [model.get(model.get_iter(path), self.COL_NAME, self.COL_SUBSTATE, self.COL_UFSTATE)
+                for path in paths]
+
     def show_info_dialog(self):
         treeview = self.current_ui["treeview"]
-        selection = treeview.get_selection()
-        model, row = selection.get_selected()
-        if not model or not row:
+        rows = self.selected_rows(treeview.get_selection())
+        if not rows:
             return
-        name, *k = model.get(row, 0)
+        name, *k = rows[0]
         if not name:
             return
         unit = self.dbuscaller.unit_details(name)
@@ -343,61 +770,120 @@ class ServiceMonitor:
 
     def call_unit_method(self, method):
         treeview = self.current_ui["treeview"]
-        selection = treeview.get_selection()
-        model, row = selection.get_selected()
-        if not model or not row:
-            return
-        name, *k = model.get(row, self.COL_NAME)
-        if not name:
-            return
+        rows = self.selected_rows(treeview.get_selection())
+        names = [name for name, *k in rows if name and name not in self.pending_actions]
+        self.run_bulk(method, names, self.run_unit_method)
 
-        response = False
-        try:
-            response = self.dbuscaller.unit_method(name, method)
-        except gi.repository.GLib.GError as ge:
-            print(f"Could not perform {method} on unit {name}, likely a permission issue", ge.message)
+    def run_unit_method(self, name, method, finish):
+        def on_done(unitname, unitmethod, result, message, data):
+            finish(unitname, result, message)
 
-        if not response:
-            msgdlg = Gtk.MessageDialog(transient_for=self.window, message_type=Gtk.MessageType.ERROR,
-                                       buttons=Gtk.ButtonsType.OK, text=f"Could not perform {method}")
-            msgdlg.format_secondary_text(f"Could not perform {method} on unit {name}")
-            msgdlg.run()
-            msgdlg.destroy()
+        if not self.dbuscaller.unit_method_async(name, method, on_done):
+            finish(name, "error", "Could not send the request")
 
-    def call_manager_helper(self):
-        treeview = self.current_ui["treeview"]
-        selection = treeview.get_selection()
-        model, row = selection.get_selected()
-        if not model or not row:
-            return
-        name, unitfilestate, *k = model.get(row, self.COL_NAME, self.COL_UFSTATE)
-        if not name:
+    def run_bulk(self, action, names, run_cb, uidict=None):
+        """Run action on every named unit of the tab, the current one by default,
+            at most action_concurrency at a time"""
+        if not names:
             return
-        if unitfilestate != "enabled" and unitfilestate != "disabled":
+        if uidict is None:
+            uidict = self.current_ui
+        for name in names:
+            self.set_action_pending(uidict, name, action)
+        scheduler = BulkScheduler(action, run_cb, self.on_bulk_done, self.on_bulk_unit_done,
+                                  self.action_concurrency, uidict)
+        scheduler.start(names)
+
+    def on_bulk_unit_done(self, scheduler, name):
+        self.set_action_pending(scheduler.userdata, name, None)
+        total = len(scheduler.results) + len(scheduler.running) + len(scheduler.queue)
+        self.status_label.set_label(f"{scheduler.action} {len(scheduler.results)} of {total} units...")
+
+    def on_bulk_done(self, scheduler):
+        action = scheduler.action
+        failed = scheduler.failed()
+        done = len(scheduler.results) - len(failed)
+        self.status_label.set_label(f"{action} {done} of {len(scheduler.results)} units "
+                                    f"in {scheduler.elapsed():.2f}s")
+        if action == "enable" or action == "disable":
+            for name in scheduler.succeeded():
+                self.dbuscaller.mark_dirty(name)
+            self.refresh_manager()
+        if not failed:
             return
+        for name, (result, message) in failed.items():
+            print(f"Could not perform {action} on unit {name}, result {result}", message, file=sys.stderr)
+        details = "\n".join(f"{name}: {result} {message}".rstrip() for name, (result, message) in failed.items())
+        self.show_error(f"Could not perform {action}", f"Failed on {len(failed)} units\n{details}")
+
+    def set_action_pending(self, uidict, name, action):
+        """Mark the unit row as busy while an action runs, action None clears it"""
+        if action:
+            self.pending_actions[name] = action
+            self.status_label.set_label(f"{action} {name}...")
+        else:
+            self.pending_actions.pop(name, None)
+        unit = uidict["sync"].get_unit(name)
+        if unit is not None:
+            uidict["sync"].update(unit)
+        if uidict is self.current_ui:
+            self.refresh_toolbar_state(uidict["treeview"].get_selection())
+
+    def show_error(self, text, secondary):
+        msgdlg = Gtk.MessageDialog(transient_for=self.window, message_type=Gtk.MessageType.ERROR,
+                                   buttons=Gtk.ButtonsType.OK, text=text)
+        msgdlg.format_secondary_text(secondary)
+        msgdlg.connect("response", lambda dialog, response: dialog.destroy())
+        msgdlg.show()
 
-        response = False
-        if unitfilestate == "enabled":
+    def call_manager_helper(self):
+        treeview = self.current_ui["treeview"]
+        rows = self.selected_rows(treeview.get_selection())
+        rows = [row for row in rows if row[0] and row[0] not in self.pending_actions]
+        unitstates = set(unitstate for name, substate, unitstate in rows)
+        if unitstates == {"enabled"}:
             action = "disable"
-        elif unitfilestate == "disabled":
+        elif unitstates == {"disabled"}:
             action = "enable"
+        else:
+            return
+
+        names = [name for name, *k in rows]
+        uidict = self.current_ui
+        for name in names:
+            self.set_action_pending(uidict, name, action)
+        started = time.monotonic()
+        if not self.dbuscaller.unit_files_method_async(names, action, self.on_unit_files_done,
+                                                       (uidict, action, started)):
+            self.on_unit_files_done(names, "error", "", (uidict, action, started))
+
+    def on_unit_files_done(self, names, result, message, data):
+        uidict, action, started = data
+        if result == "error":
+            # the manager can't handle these, e.g. SysV scripts, let systemctl do it
+            print(f"Could not {action} unit files over DBus, using helper", message, file=sys.stderr)
+            self.run_bulk(action, names, self.run_manager_helper, uidict)
+            return
 
-        argslist = ['pkexec', '--disable-internal-agent',
-                    os.path.join(self.helper_dir, self.UNIT_HELPER_CMD), name, action]
-        ps = subprocess.run(argslist, capture_output=True)
-        if ps.returncode == 0:
+        for name in names:
+            self.set_action_pending(uidict, name, None)
+        if result == "done":
+            self.status_label.set_label(f"{action} {len(names)} units in {time.monotonic() - started:.2f}s")
+            for name in names:
+                self.dbuscaller.mark_dirty(name)
             self.refresh_manager()
         else:
-            output = ps.stdout.decode('utf-8')
-            output += ps.stderr.decode('utf-8')
-            msgdlg = Gtk.MessageDialog(transient_for=self.window, message_type=Gtk.MessageType.ERROR,
-                                       buttons=Gtk.ButtonsType.OK,
-                                       text=f"Could not change unit file state {name}")
-            msgdlg.format_secondary_text(output)
-            msgdlg.run()
-            msgdlg.destroy()
-
-    def toolbar_state(self, start=False, stop=False, restart=False, enable=False, info=False):
+            self.status_label.set_label(f"{action} {len(names)} units {result}")
+            self.show_error("Could not change unit file state", message)
+
+    def run_manager_helper(self, name, action, finish):
+        if not self.helper_client:
+            argslist = ['pkexec', '--disable-internal-agent',
+                        os.path.join(self.helper_dir, self.UNIT_HELPER_CMD), '--session']
+            self.helper_client = HelperClient(argslist)
+        self.helper_client.request(action, name, finish)
+
+    def toolbar_state(self, start=False, stop=False, restart=False, reset=False, enable=False, info=False):
         action_buttons = self.action_toolbar.get_children()
         # self.action_toolbar.foreach(lambda widget, data: widget.set_sensitive(False), None)
         for btn in action_buttons:
@@ -410,6 +896,8 @@ class ServiceMonitor:
                 btn.set_sensitive(stop)
             elif name == "restart-btn":
                 btn.set_sensitive(restart)
+            elif name == "reset-btn":
+                btn.set_sensitive(reset)
             elif name == "enable-btn":
                 if enable == "on":
                     btn.set_icon_name(self.ICON_ENABLE_ON)
@@ -449,6 +937,7 @@ class ServiceMonitor:
         self.action_toolbar = builder.get_object("unitaction_toolbar")
         self.status_label = builder.get_object("status_label")
         self.show_inactive = builder.get_object("show_inactive")
+        self.live_updates_switch = builder.get_object("live_updates")
 
         # load hidden columns and build the tree view
         self.service_ui["hidden_cols"] = PrefStorage.get(PrefStorage.HIDE_SERVICE_COL)
@@ -464,6 +953,12 @@ class ServiceMonitor:
         isshowinactive = PrefStorage.get(PrefStorage.SHOW_INACTIVE)
         self.show_inactive.set_state(isshowinactive)
         self.include_all = isshowinactive
+        concurrency = PrefStorage.get(PrefStorage.ACTION_CONCURRENCY)
+        if concurrency:
+            self.action_concurrency = concurrency
+        islive = bool(PrefStorage.get(PrefStorage.LIVE_UPDATES))
+        self.live_updates_switch.set_state(islive)
+        self.live_updates = islive
         winposition = PrefStorage.get(PrefStorage.WIN_POSITION)
         if winposition and len(winposition) == 4:
             winx, winy, winw, winh = winposition
@@ -482,7 +977,13 @@ class ServiceMonitor:
                 self.window.set_default_size(neww, newh)
 
         self.dbusready = self.dbuscaller.init_dbus()
-        self.dbusready = self.dbuscaller.subscribe_signals(self.refresh_manager)
+        if self.dbusready and os.environ.get(self.collector_env):
+            self.start_collector()
+        if self.collector:
+            # the collector refreshes the units, the window's own signals only finish its jobs
+            self.dbusready = self.dbuscaller.subscribe_signals(None, jobs_only=True)
+        else:
+            self.dbusready = self.dbuscaller.subscribe_signals(self.refresh_manager)
 
         self.toolbar_state()
         self.window.show_all()
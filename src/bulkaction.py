@@ -0,0 +1,74 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import time
+from collections import deque
+
+
+class BulkScheduler:
+    """Runs one action over a list of units with at most max_running in progress.
+        run_cb(unitname, action, finish) starts the action for a unit and must call
+        finish(unitname, result, message) once it completes, "done" is success.
+        unit_done_cb(scheduler, unitname) runs after every unit and
+        done_cb(scheduler) once they have all finished
+    """
+    RESULT_DONE = "done"
+
+    def __init__(self, action, run_cb, done_cb=None, unit_done_cb=None, max_running=4, userdata=None):
+        self.action = action
+        self.run_cb = run_cb
+        self.done_cb = done_cb
+        self.unit_done_cb = unit_done_cb
+        self.max_running = max(1, max_running)
+        self.userdata = userdata
+        self.queue = deque()
+        self.running = set()
+        self.results = {}
+        self.started = None
+        self.finished = None
+        self._pumping = False
+
+    def start(self, unitnames):
+        self.queue.extend(unitnames)
+        self.started = time.monotonic()
+        self._pump()
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        end = self.finished if self.finished is not None else time.monotonic()
+        return end - self.started
+
+    def succeeded(self):
+        return [name for name, (result, k) in self.results.items() if result == self.RESULT_DONE]
+
+    def failed(self):
+        return {name: result for name, result in self.results.items() if result[0] != self.RESULT_DONE}
+
+    def _pump(self):
+        # run_cb may finish synchronously, the outer loop then starts the next one
+        if self._pumping:
+            return
+        self._pumping = True
+        try:
+            while self.queue and len(self.running) < self.max_running:
+                name = self.queue.popleft()
+                if name in self.running or name in self.results:
+                    continue
+                self.running.add(name)
+                self.run_cb(name, self.action, self._finish)
+        finally:
+            self._pumping = False
+
+        if not self.queue and not self.running and self.finished is None:
+            self.finished = time.monotonic()
+            if callable(self.done_cb):
+                self.done_cb(self)
+
+    def _finish(self, unitname, result, message=""):
+        if unitname not in self.running:
+            return
+        self.running.discard(unitname)
+        self.results[unitname] = (result, message)
+        if callable(self.unit_done_cb):
+            self.unit_done_cb(self, unitname)
+        self._pump()
@@ -0,0 +1,678 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Collector process for the window.
+
+Owns the D-Bus connection and the Manager signals, keeps the units of every
+tab the window watches up to date and publishes what changed through a
+SnapshotRing, so D-Bus traffic and unpacking run on another core than the
+window. The window starts it with CollectorClient and talks to it with one
+JSON command per line on stdin:
+
+    {"watch": "service", "states": ["active"], "patterns": ["*.service"], "columns": ["Type"]}
+    {"refresh": "service", "names": ["cups.service"]}
+    {"live": "service"}
+    {"resync": "service"}
+    {"read": 4096}
+    {"clear_cache": true}
+
+Each batch of records is announced with a line holding the ring's head.
+"""
+
+import argparse
+import fnmatch
+import json
+import marshal
+import mmap
+import os
+import signal
+import struct
+import sys
+
+from gi.repository import Gio, GLib
+
+from .dbuscaller import DBusCaller
+from .unit import Unit
+
+
+class RingOverrun(Exception):
+    """The writer came round over records the reader had not read yet"""
+
+
+class SnapshotRing:
+    """Records in a memory mapped file, written by one process and read by
+        another. The header holds the total bytes written, the head, and the
+        total bytes read, the tail, so write() refuses a record that would
+        overwrite unread ones. Records never wrap, one that doesn't fit before
+        the end of the buffer starts over at the beginning.
+    """
+    MAGIC = b"SMRING01"
+    # magic, capacity, head, tail
+    HEADER = struct.Struct("<8sQQQ")
+    HEAD = struct.Struct("<Q")
+    HEAD_OFFSET = 16
+    TAIL_OFFSET = 24
+    DATA_OFFSET = 64
+    LENGTH = struct.Struct("<I")
+    WRAP = 0xFFFFFFFF
+    DEFAULT_CAPACITY = 8 * 2 ** 20
+
+    def __init__(self, fd, capacity=None, create=False):
+        if create:
+            # records are kept 8 byte aligned, so a wrap marker always fits
+            capacity = (capacity or self.DEFAULT_CAPACITY) // 8 * 8
+            os.ftruncate(fd, self.DATA_OFFSET + capacity)
+        self.map = mmap.mmap(fd, 0)
+        if create:
+            self.map[:self.HEADER.size] = self.HEADER.pack(self.MAGIC, capacity, 0, 0)
+        magic, self.capacity, head, tail = self.HEADER.unpack_from(self.map)
+        if magic != self.MAGIC or len(self.map) < self.DATA_OFFSET + self.capacity:
+            raise ValueError("not a snapshot ring")
+        # the reader creates the ring and reads from the tail, the writer opens
+        # it and writes at the head
+        self.position = tail if create else head
+
+    @classmethod
+    def open(cls, path):
+        fd = os.open(path, os.O_RDWR)
+        try:
+            return cls(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        self.map.close()
+
+    @property
+    def head(self):
+        return self.HEAD.unpack_from(self.map, self.HEAD_OFFSET)[0]
+
+    @property
+    def tail(self):
+        return self.HEAD.unpack_from(self.map, self.TAIL_OFFSET)[0]
+
+    @staticmethod
+    def _aligned(size):
+        return (size + 7) // 8 * 8
+
+    def fits(self, size):
+        """Whether a record of size bytes can be written, up to half the ring
+            so that it finds room at either end once the reader caught up"""
+        return self._aligned(self.LENGTH.size + size) <= self.capacity // 2
+
+    def write(self, payload):
+        """Append a record, False if the reader has yet to make room for it"""
+        need = self._aligned(self.LENGTH.size + len(payload))
+        if not self.fits(len(payload)):
+            raise ValueError(f"record of {len(payload)} bytes is larger than half the ring")
+        offset = self.position % self.capacity
+        skip = self.capacity - offset if offset + need > self.capacity else 0
+        if self.position + skip + need - self.tail > self.capacity:
+            return False
+        if skip:
+            self.LENGTH.pack_into(self.map, self.DATA_OFFSET + offset, self.WRAP)
+            self.position += skip
+            offset = 0
+        start = self.DATA_OFFSET + offset + self.LENGTH.size
+        self.map[start:start + len(payload)] = payload
+        self.LENGTH.pack_into(self.map, start - self.LENGTH.size, len(payload))
+        self.position += need
+        # the reader may take the record once the head moves past it
+        self.HEAD.pack_into(self.map, self.HEAD_OFFSET, self.position)
+        return True
+
+    def read(self):
+        """Records written since the last read, in order. Raises RingOverrun
+            and skips to the head if the writer overwrote any of them"""
+        start = self.position
+        head = self.head
+        records = []
+        pos = start
+        while pos < head and head - start <= self.capacity:
+            offset = pos % self.capacity
+            base = self.DATA_OFFSET + offset
+            length = self.LENGTH.unpack_from(self.map, base)[0]
+            if length == self.WRAP:
+                pos += self.capacity - offset
+                continue
+            if length > self.capacity - offset:
+                break
+            records.append(self.map[base + self.LENGTH.size:base + self.LENGTH.size + length])
+            pos += self._aligned(self.LENGTH.size + length)
+        if pos != head or self.head - start > self.capacity:
+            self.position = self.head
+            self.HEAD.pack_into(self.map, self.TAIL_OFFSET, self.position)
+            raise RingOverrun(f"lost records between {start} and {self.position}")
+        self.position = pos
+        self.HEAD.pack_into(self.map, self.TAIL_OFFSET, pos)
+        return records
+
+
+def unit_record(unit, columns):
+    """A unit as the tuple the collector publishes, the list keys then a dict
+        of the detail columns it has"""
+    return (unit['Name'], unit['Path'], unit['Description'], unit['Load'], unit['State'], unit['Substate'],
+            {prop: unit[prop] for prop in columns if prop in unit})
+
+
+def record_unit(record):
+    unit = Unit(*record[:6])
+    unit.update(record[6])
+    return unit
+
+
+def encode_record(version, unittype, kind, data):
+    # both ends run the same interpreter, marshal keeps tuples apart from lists
+    return marshal.dumps((version, unittype, kind, data))
+
+
+def decode_record(payload):
+    return marshal.loads(payload)
+
+
+class Collector:
+    """Keeps the units of the watched tabs and publishes them to a SnapshotRing:
+        a tab's first refresh as reset, units and end records, later ones as
+        the units that changed and the names removed. Records that don't fit
+        wait until the reader reports its position with a read command.
+    """
+    REFRESH_DELAY_MS = 500
+    DEADLINE_MS = 8000
+    # units per record, a full snapshot is split so it can go through the
+    # ring while the reader catches up
+    CHUNK_UNITS = 256
+
+    def __init__(self, caller, ring, infd, outstream):
+        self.caller = caller
+        self.ring = ring
+        self.infd = infd
+        self.outstream = outstream
+        self.tabs = {}
+        self.version = 0
+        self.backlog = []
+        self.announced = 0
+        self.live = None
+        self.pending = b""
+        self.pending_refresh = False
+        self.loop = None
+
+    def run(self):
+        self.loop = GLib.MainLoop()
+        sources = [GLib.io_add_watch(self.infd, GLib.PRIORITY_DEFAULT, GLib.IO_IN | GLib.IO_HUP, self.on_input),
+                   GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGINT, self.quit),
+                   GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGTERM, self.quit)]
+        self.caller.subscribe_signals(self.on_signal)
+        self.write({"ready": True, "capacity": self.ring.capacity})
+        try:
+            self.loop.run()
+        finally:
+            context = self.loop.get_context()
+            for source in sources:
+                # the input watch is gone once the window closed its end
+                if context.find_source_by_id(source):
+                    GLib.source_remove(source)
+            self.caller.unsubscribe_properties()
+            self.caller.unsubscribe_signals()
+        return 0
+
+    def quit(self, *args):
+        if self.loop and self.loop.is_running():
+            self.loop.quit()
+        return False
+
+    def on_input(self, fd, condition):
+        data = os.read(fd, 65536)
+        if not data:
+            # the window went away
+            self.quit()
+            return False
+        self.pending += data
+        *lines, self.pending = self.pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                self.handle(line)
+        return True
+
+    def handle(self, line):
+        try:
+            command = json.loads(line)
+        except ValueError:
+            command = None
+        if not isinstance(command, dict):
+            print("Collector: invalid command", line, file=sys.stderr)
+            return
+        if "watch" in command:
+            self.watch(command["watch"], command.get("states") or [], command.get("patterns") or [],
+                       command.get("columns") or [])
+        elif "refresh" in command:
+            tab = self.tabs.get(command["refresh"])
+            if tab:
+                self.refresh_units(tab, command.get("names") or [])
+        elif "live" in command:
+            self.set_live(command["live"])
+        elif "resync" in command:
+            self.resync(command["resync"])
+        elif "read" in command:
+            self.flush_backlog()
+        elif "clear_cache" in command:
+            self.caller.clear_cache()
+
+    # tabs
+
+    def watch(self, unittype, states, patterns, columns):
+        """Select the units of a tab and refresh it, a changed selection starts
+            over with a full snapshot"""
+        tab = self.tabs.get(unittype)
+        selection = (states, patterns, columns)
+        if tab is None or tab["selection"] != selection:
+            if tab and tab["fetch"]:
+                tab["fetch"].cancel()
+            tab = self.tabs[unittype] = {"unittype": unittype, "selection": selection, "states": states,
+                                         "patterns": patterns, "columns": columns, "units": {}, "records": {},
+                                         "paths": {}, "fetch": None, "serial": 0, "full": True, "partials": [],
+                                         "stale_names": set()}
+        self.refresh(tab)
+
+    def refresh(self, tab):
+        if tab["fetch"]:
+            tab["fetch"].cancel()
+        for fetch in tab["partials"]:
+            fetch.cancel()
+        tab["partials"] = []
+        tab["stale_names"] = set()
+        tab["serial"] += 1
+        tab["fetch"] = self.caller.list_details_async(tab["states"], tab["patterns"], tab["columns"],
+                                                      self.on_units, (tab, tab["serial"]),
+                                                      deadline_millis=self.DEADLINE_MS)
+
+    def on_units(self, units, data):
+        tab, serial = data
+        if serial != tab["serial"]:
+            return
+        fetch = tab["fetch"]
+        tab["fetch"] = None
+        if fetch and fetch.list_error:
+            self.publish(tab["unittype"], "status", {"error": fetch.list_error.message, "stale": []})
+            self.announce()
+            return
+        stale = fetch.stale if fetch else set()
+        tab["stale_names"].update(stale)
+        records = {}
+        for unit in units:
+            record = unit_record(unit, tab["columns"])
+            old = tab["records"].get(unit['Name'])
+            if unit['Name'] in stale and old:
+                # keep what the last refresh got for the details that are missing
+                record = record[:6] + ({**old[6], **record[6]},)
+            records[unit['Name']] = record
+        tab["units"] = {unit['Name']: unit for unit in units}
+        tab["paths"] = {unit['Path']: unit['Name'] for unit in units}
+        self.publish_records(tab, records, [name for name in tab["records"] if name not in records])
+        if stale:
+            self.publish(tab["unittype"], "status", {"error": "", "stale": sorted(stale)})
+        self.announce()
+        if self.live is tab:
+            self.watch_live()
+
+    def refresh_units(self, tab, names):
+        names = [name for name in names if any(fnmatch.fnmatchcase(name, pattern) for pattern in tab["patterns"])]
+        if names:
+            # tagged with the serial of the last full refresh, one started later drops the reply
+            request = {"serial": tab["serial"], "names": names}
+            request["fetch"] = self.caller.unit_list_details_async(names, tab["columns"], self.on_units_details,
+                                                                   (tab, request), deadline_millis=self.DEADLINE_MS)
+            tab["partials"] = [fetch for fetch in tab["partials"] if not fetch.finished] + [request["fetch"]]
+
+    def on_units_details(self, units, data):
+        tab, request = data
+        if self.tabs.get(tab["unittype"]) is not tab or tab["full"] or request["serial"] != tab["serial"]:
+            # the refresh on its way covers these
+            return
+        names = request["names"]
+        fetch = request["fetch"]
+        if fetch.list_error:
+            # keep the records, the names are asked for again with the next refresh
+            tab["stale_names"].update(names)
+            self.publish(tab["unittype"], "status", {"error": fetch.list_error.message, "stale": sorted(names)})
+            self.announce()
+            return
+        tab["stale_names"].update(fetch.stale)
+        records = {}
+        for unit in units:
+            if self.unit_in_view(tab, unit):
+                record = unit_record(unit, tab["columns"])
+                old = tab["records"].get(unit['Name'])
+                if unit['Name'] in fetch.stale and old:
+                    record = record[:6] + ({**old[6], **record[6]},)
+                records[unit['Name']] = record
+                tab["units"][unit['Name']] = unit
+                tab["paths"][unit['Path']] = unit['Name']
+        removed = [name for name in names if name not in records and name in tab["records"]]
+        for name in removed:
+            unit = tab["units"].pop(name, None)
+            if unit:
+                tab["paths"].pop(unit['Path'], None)
+        self.publish_records(tab, {**tab["records"], **records}, removed, names)
+        if fetch.stale:
+            self.publish(tab["unittype"], "status", {"error": "", "stale": sorted(fetch.stale)})
+        self.announce()
+
+    @staticmethod
+    def unit_in_view(tab, unit):
+        """Matches the state filter passed to ListUnitsByPatterns"""
+        if unit['Load'] == 'not-found':
+            return False
+        if not tab["states"]:
+            return True
+        return any(state in tab["states"] for state in (unit['Load'], unit['State'], unit['Substate']))
+
+    def resync(self, unittype):
+        """Publish a tab in full again, for a reader that lost records"""
+        tab = self.tabs.get(unittype)
+        if tab:
+            tab["full"] = True
+            self.publish_records(tab, tab["records"], [])
+            self.flush_backlog()
+
+    def publish_records(self, tab, records, removed, names=None):
+        """Publish the records that differ from the last ones published, of the
+            named units only if names is given"""
+        unittype = tab["unittype"]
+        old = tab["records"]
+        for name in removed:
+            records.pop(name, None)
+        if tab["full"]:
+            tab["full"] = False
+            changed = list(records.values())
+            removed = []
+            self.publish(unittype, "reset", None)
+        else:
+            candidates = records if names is None else [name for name in names if name in records]
+            changed = [records[name] for name in candidates if old.get(name) != records[name]]
+        self.publish_units(unittype, changed)
+        if removed:
+            self.publish(unittype, "removed", removed)
+        self.publish(unittype, "end", None)
+        tab["records"] = records
+
+    # live updates
+
+    def set_live(self, unittype):
+        self.live = self.tabs.get(unittype) if unittype else None
+        self.watch_live()
+
+    def watch_live(self):
+        if self.live is None:
+            self.caller.unsubscribe_properties()
+            return
+        self.caller.subscribe_properties(list(self.live["paths"]), self.on_unit_properties)
+
+    def on_unit_properties(self, path, iface, changed):
+        tab = self.live
+        name = tab["paths"].get(path) if tab else None
+        unit = tab["units"].get(name) if name else None
+        if unit is None or not unit.apply_props(changed):
+            return
+        if self.unit_in_view(tab, unit):
+            self.publish_records(tab, {**tab["records"], name: unit_record(unit, tab["columns"])}, [], [name])
+        else:
+            self.publish_records(tab, dict(tab["records"]), [name], [])
+        self.announce()
+
+    # signals
+
+    def on_signal(self):
+        # fold a burst of signals into one refresh
+        if self.pending_refresh:
+            return
+        self.pending_refresh = True
+        GLib.timeout_add(self.REFRESH_DELAY_MS, self.on_refresh)
+
+    def on_refresh(self):
+        self.pending_refresh = False
+        dirty_all, dirty_units = self.caller.take_dirty()
+        for tab in self.tabs.values():
+            names = [name for name in dirty_units if name.endswith("." + tab["unittype"])]
+            names += [name for name in tab["stale_names"] if name not in dirty_units]
+            tab["stale_names"] = set()
+            if dirty_all or len(names) > len(tab["records"]) // 2:
+                self.refresh(tab)
+            elif names:
+                self.refresh_units(tab, names)
+        return False
+
+    # output
+
+    def publish(self, unittype, kind, data):
+        self.version += 1
+        self.push(encode_record(self.version, unittype, kind, data))
+
+    def publish_units(self, unittype, records):
+        """Publish records in chunks of CHUNK_UNITS, or smaller ones where a
+            chunk would not fit in the ring"""
+        chunk = self.CHUNK_UNITS
+        start = 0
+        while start < len(records):
+            payload = encode_record(self.version + 1, unittype, "units", records[start:start + chunk])
+            if chunk > 1 and not self.ring.fits(len(payload)):
+                chunk //= 2
+                continue
+            self.version += 1
+            self.push(payload)
+            start += chunk
+
+    def push(self, payload):
+        if self.backlog or not self.ring.write(payload):
+            self.backlog.append(payload)
+
+    def flush_backlog(self):
+        while self.backlog and self.ring.write(self.backlog[0]):
+            del self.backlog[0]
+        self.announce()
+
+    def announce(self):
+        if self.ring.position != self.announced:
+            self.announced = self.ring.position
+            self.write({"head": self.ring.position, "version": self.version})
+
+    def write(self, message):
+        self.outstream.write(json.dumps(message) + "\n")
+        self.outstream.flush()
+
+
+class CollectorClient:
+    """Window side of the collector: starts the process on a fresh ring, sends
+        it commands and reads the records it announces. update_cb(unittype,
+        update) gets a dict per tab and batch: units, a list of Units, and
+        removed names to apply, full if the units replace the whole tab,
+        stale names and an error if systemd did not answer. If the process
+        goes away, exit_cb() is called.
+    """
+    def __init__(self, argv, update_cb, exit_cb=None, environ=None, capacity=None):
+        self.argv = argv
+        self.update_cb = update_cb
+        self.exit_cb = exit_cb
+        self.environ = environ or {}
+        self.capacity = capacity
+        self.proc = None
+        self.stdin = None
+        self.ring = None
+        self.path = None
+        self.version = 0
+        self.fulls = {}
+        self.watched = set()
+
+    def start(self):
+        fd, self.path = GLib.file_open_tmp("servicemonitor-XXXXXX.ring")
+        try:
+            self.ring = SnapshotRing(fd, self.capacity, create=True)
+        finally:
+            os.close(fd)
+        launcher = Gio.SubprocessLauncher.new(Gio.SubprocessFlags.STDIN_PIPE | Gio.SubprocessFlags.STDOUT_PIPE)
+        for name, value in self.environ.items():
+            launcher.setenv(name, value, True)
+        try:
+            self.proc = launcher.spawnv(self.argv + ["--ring", self.path])
+        except GLib.GError as ge:
+            print("CollectorClient: Could not start the collector", ge.message, file=sys.stderr)
+            self._remove_file()
+            self.proc = None
+            return False
+        self.stdin = self.proc.get_stdin_pipe()
+        reader = Gio.DataInputStream.new(self.proc.get_stdout_pipe())
+        reader.read_line_async(GLib.PRIORITY_DEFAULT, None, self._on_line, self.proc)
+        return True
+
+    def is_running(self):
+        return self.proc is not None
+
+    def watch(self, unittype, states, patterns, columns):
+        self.watched.add(unittype)
+        return self.send({"watch": unittype, "states": states, "patterns": patterns, "columns": columns})
+
+    def refresh(self, unittype, names):
+        return self.send({"refresh": unittype, "names": list(names)})
+
+    def live(self, unittype):
+        return self.send({"live": unittype})
+
+    def clear_cache(self):
+        """Read every property from systemd again on the next refresh"""
+        return self.send({"clear_cache": True})
+
+    def close(self):
+        self.exit_cb = None
+        if self.stdin:
+            # end of input makes the collector exit
+            self.stdin.close(None)
+            self.stdin = None
+        self._remove_file()
+
+    def send(self, command):
+        if not self.stdin:
+            return False
+        try:
+            self.stdin.write_all((json.dumps(command) + "\n").encode("utf-8"), None)
+        except GLib.GError as ge:
+            print("CollectorClient: Could not send to the collector", ge.message, file=sys.stderr)
+            return False
+        return True
+
+    def _remove_file(self):
+        # both ends keep their mapping, the name is only needed to open it
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+    def _on_line(self, reader, res, proc):
+        try:
+            line, length = reader.read_line_finish_utf8(res)
+        except GLib.GError:
+            line = None
+        if line is None:
+            self._on_exit(proc)
+            return
+        try:
+            message = json.loads(line)
+        except ValueError:
+            message = None
+        if isinstance(message, dict):
+            if message.get("ready"):
+                self._remove_file()
+            elif "head" in message:
+                self.drain()
+        if proc is self.proc:
+            reader.read_line_async(GLib.PRIORITY_DEFAULT, None, self._on_line, proc)
+
+    def _on_exit(self, proc):
+        if proc is not self.proc:
+            return
+        self.proc = None
+        self.stdin = None
+        self._remove_file()
+        if self.exit_cb:
+            self.exit_cb()
+
+    def drain(self):
+        """Apply the records published since the last drain"""
+        try:
+            payloads = self.ring.read()
+        except RingOverrun as e:
+            print("CollectorClient:", e, file=sys.stderr)
+            # the next record read starts the count again
+            self.version = 0
+            self._resync()
+            return
+        updates = {}
+        for payload in payloads:
+            version, unittype, kind, data = decode_record(payload)
+            if version != self.version + 1 and self.version:
+                print(f"CollectorClient: missed records {self.version + 1} to {version - 1}", file=sys.stderr)
+                self.version = decode_record(payloads[-1])[0]
+                self._resync()
+                return
+            self.version = version
+            self._apply(updates, unittype, kind, data)
+        self.send({"read": self.ring.position})
+        for unittype, update in updates.items():
+            self.update_cb(unittype, update)
+
+    def _apply(self, updates, unittype, kind, data):
+        if kind == "reset":
+            self.fulls[unittype] = []
+            return
+        full = self.fulls.get(unittype)
+        if kind == "units" and full is not None:
+            full.extend(record_unit(record) for record in data)
+            return
+        update = updates.get(unittype)
+        if update is None:
+            update = updates[unittype] = {"units": [], "removed": [], "full": False, "stale": [], "error": ""}
+        if kind == "units":
+            update["units"].extend(record_unit(record) for record in data)
+        elif kind == "removed":
+            update["removed"].extend(data)
+        elif kind == "status":
+            update["stale"] = data["stale"]
+            update["error"] = data["error"]
+        elif kind == "end" and full is not None:
+            del self.fulls[unittype]
+            update.update(units=full, removed=[], full=True)
+
+    def _resync(self):
+        # the read lets a collector with a backlog write again, the full tabs
+        # would wait behind it otherwise
+        self.send({"read": self.ring.position})
+        self.fulls = {}
+        for unittype in self.watched:
+            self.send({"resync": unittype})
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="servicemonitor --collector",
+                                     description="Collect units for the window in a process of their own")
+    parser.add_argument("--ring", required=True, help="ring file created by the window")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    try:
+        ring = SnapshotRing.open(args.ring)
+    except (OSError, ValueError) as e:
+        print("Error, could not open the ring", e, file=sys.stderr)
+        return 1
+    caller = DBusCaller()
+    if not caller.init_dbus():
+        print("Error, could not connect to DBus", file=sys.stderr)
+        return 1
+    try:
+        return Collector(caller, ring, sys.stdin.fileno(), sys.stdout).run()
+    finally:
+        caller.close_dbus()
+        ring.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
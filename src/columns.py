@@ -0,0 +1,68 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Columns shown for each unit type, multi word names map to the property
+# without spaces, e.g. "Unit File State" is UnitFileState
+UI_COLUMNS = {
+    "service": ["Name", "S", "State", "Substate", "Unit File State", "Type", "Fragment Path", "Description",
+                "Main PID"],
+    "timer": ["Name", "S", "State", "Substate", "Unit File State", "Triggers", "LastTriggerUSec",
+              "NextElapseUSecRealtime", "Unit", "FragmentPath", "Description", "Timers Calendar", "Result"],
+    "socket": ["Name", "S", "State", "Substate", "Unit File State", "Listen", "Triggers", "FileDescriptorName",
+               "FragmentPath", "Result", "N Accept", "N Connections", "Description"]}
+
+# Properties fetched from the Unit and type interfaces for the columns above
+DETAIL_COLUMNS = {
+    "service": ["UnitFileState", "Type", "FragmentPath", "MainPID"],
+    "timer": ["Triggers", "LastTriggerUSec", "NextElapseUSecRealtime", "Unit", "FragmentPath", "TimersCalendar",
+              "Result"],
+    "socket": ["Listen", "Triggers", "FileDescriptorName", "FragmentPath", "Result", "NAccept", "NConnections"]}
+
+# Columns drawn as an icon in the window, and the property they show
+ICON_COLUMNS = {"S": "Substate"}
+
+# Properties of the org.freedesktop.systemd1.Unit interface, any other detail
+# property is read from the interface of the unit's type, e.g. Service
+UNIT_IFACE_PROPS = frozenset([
+    "Id", "Names", "Following", "Requires", "Requisite", "Wants", "BindsTo", "PartOf", "Upholds", "RequiredBy",
+    "RequisiteOf", "WantedBy", "BoundBy", "UpheldBy", "ConsistsOf", "Conflicts", "ConflictedBy", "Before",
+    "After", "OnSuccess", "OnSuccessOf", "OnFailure", "OnFailureOf", "Triggers", "TriggeredBy",
+    "PropagatesReloadTo", "ReloadPropagatedFrom", "PropagatesStopTo", "StopPropagatedFrom", "JoinsNamespaceOf",
+    "SliceOf", "RequiresMountsFor", "Documentation", "Description", "AccessSELinuxContext", "LoadState",
+    "ActiveState", "FreezerState", "SubState", "FragmentPath", "SourcePath", "DropInPaths", "UnitFileState",
+    "UnitFilePreset", "StateChangeTimestamp", "StateChangeTimestampMonotonic", "InactiveExitTimestamp",
+    "InactiveExitTimestampMonotonic", "ActiveEnterTimestamp", "ActiveEnterTimestampMonotonic",
+    "ActiveExitTimestamp", "ActiveExitTimestampMonotonic", "InactiveEnterTimestamp",
+    "InactiveEnterTimestampMonotonic", "CanStart", "CanStop", "CanReload", "CanIsolate", "CanClean", "CanFreeze",
+    "Job", "StopWhenUnneeded", "RefuseManualStart", "RefuseManualStop", "AllowIsolate", "DefaultDependencies",
+    "OnSuccessJobMode", "OnFailureJobMode", "IgnoreOnIsolate", "NeedDaemonReload", "Markers", "JobTimeoutUSec",
+    "JobRunningTimeoutUSec", "JobTimeoutAction", "JobTimeoutRebootArgument", "ConditionResult", "AssertResult",
+    "ConditionTimestamp", "ConditionTimestampMonotonic", "AssertTimestamp", "AssertTimestampMonotonic",
+    "Conditions", "Asserts", "LoadError", "Transient", "Perpetual", "StartLimitIntervalUSec", "StartLimitBurst",
+    "StartLimitAction", "FailureAction", "FailureActionExitStatus", "SuccessAction", "SuccessActionExitStatus",
+    "RebootArgument", "InvocationID", "CollectMode", "Refs", "ActivationDetails"])
+
+# Properties systemd doesn't send PropertiesChanged for (EmitsChangedSignal
+# false), counters that a cached value would keep showing as they were
+UNCACHED_PROPS = frozenset([
+    "NConnections", "NAccept", "NRefused", "MemoryCurrent", "MemoryAvailable", "MemoryPeak", "MemorySwapCurrent",
+    "MemorySwapPeak", "MemoryZSwapCurrent", "CPUUsageNSec", "EffectiveCPUs", "EffectiveMemoryNodes",
+    "TasksCurrent", "IPIngressBytes", "IPIngressPackets", "IPEgressBytes", "IPEgressPackets", "IOReadBytes",
+    "IOReadOperations", "IOWriteBytes", "IOWriteOperations"])
+
+# Keys every Unit gets from the unit list, they need no detail properties
+LIST_KEYS = ["Name", "Path", "Description", "Load", "State", "Substate", "UnitType"]
+
+
+def column_prop(column):
+    return column.replace(' ', '')
+
+
+def detail_props(columns):
+    """Detail properties needed to show the given columns"""
+    props = []
+    for column in columns:
+        prop = column_prop(column)
+        if column in ICON_COLUMNS or prop in LIST_KEYS or prop in props:
+            continue
+        props.append(prop)
+    return props
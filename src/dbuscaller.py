@@ -1,19 +1,54 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import os
+import sys
+from collections import deque
+from collections.abc import Mapping
+
 from gi.repository import Gio, GLib
+from .columns import UNCACHED_PROPS, UNIT_IFACE_PROPS
+from .propcache import PropCache
 from .unit import Unit
 
 
 class DBusCaller:
     _LIVE_CALLS = True
     _CALL_TIMEOUT_MILLIS = 30000
-    _ALLOWED_UNIT_METHODS = ['Start', 'Stop', 'Restart']
-    _ALLOWED_MGR_METHODS = ['EnableUnitFiles', 'DisableUnitFiles']
+    # deadline of a single list or property read, a busy systemd fails the
+    # read instead of holding up the refresh
+    _READ_TIMEOUT_MILLIS = 5000
+    _MAX_INFLIGHT_CALLS = 32
+    # an interface needing at most this many properties is read with a
+    # Properties.Get for each instead of a GetAll of all its properties
+    _GET_MAX_PROPS = 1
+    # read for all units of a list with one ListUnitFilesByPatterns call
+    _FILE_STATE = "UnitFileState"
+    _PROP_CACHE_SIZE = 4096
+    # backstop for values that change without a signal, seconds
+    _PROP_CACHE_TTL = 60
+    # pseudo interface for caching unit name to object path lookups
+    _CACHE_UNIT_PATH = "GetUnit"
+    _JOB_TIMEOUT_MILLIS = 90000
+    _ALLOWED_UNIT_METHODS = ['Start', 'Stop', 'Restart', 'ResetFailed']
+    # methods that queue a job and take the job mode argument
+    _JOB_UNIT_METHODS = ['Start', 'Stop', 'Restart']
+    _ALLOWED_MGR_METHODS = ['EnableUnitFiles', 'DisableUnitFiles', 'Reload']
+    _UNIT_FILE_METHODS = {"enable": ("EnableUnitFiles", "(asbb)"),
+                          "disable": ("DisableUnitFiles", "(asb)")}
+    _AUTH_ERRORS = ["org.freedesktop.DBus.Error.AccessDenied",
+                    "org.freedesktop.DBus.Error.InteractiveAuthorizationRequired"]
+    # unit types shown in the UI, signals about other types are dropped
+    watch_types = ('service', 'timer', 'socket')
     dbusconn = None
     mgrproxy = None
-    pathproxies = {}
+    propcache = None
     signalsubs = None
     signal_refresh_cb = None
+    dirty_all = False
+    dirty_units = None
+    propsubs = None
+    props_cb = None
+    watched_paths = frozenset()
 
     dbus_prop = "org.freedesktop.DBus.Properties"
     msg_destination = "org.freedesktop.systemd1"
@@ -25,6 +60,17 @@ class DBusCaller:
     iface_timer = "org.freedesktop.systemd1.Timer"
     iface_socket = "org.freedesktop.systemd1.Socket"
 
+    # connect to this bus instead of the system bus, e.g. a test stand-in for systemd
+    bus_address_env = "SERVICEMONITOR_BUS_ADDRESS"
+
+    def __init__(self, bus_address=None):
+        self.bus_address = bus_address or os.environ.get(self.bus_address_env)
+        self.dirty_units = set()
+        self.jobs = {}
+        # calls sent on the bus, for benchmarks and tests
+        self.calls = 0
+        self.propcache = PropCache(self._PROP_CACHE_SIZE, self._PROP_CACHE_TTL)
+
     def _is_connected(self):
         if self._LIVE_CALLS and self.dbusconn and not self.dbusconn.is_closed():
             return True
@@ -34,11 +80,15 @@ class DBusCaller:
         if self._is_connected() or not self._LIVE_CALLS:
             return True
         try:
-            self.dbusconn = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
-            print("init_dbus: Connected to dbus", self.dbusconn.get_guid())
+            if self.bus_address:
+                flags = Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION
+                self.dbusconn = Gio.DBusConnection.new_for_address_sync(self.bus_address, flags, None, None)
+            else:
+                self.dbusconn = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+            print("init_dbus: Connected to dbus", self.dbusconn.get_guid(), file=sys.stderr)
             return True
         except Exception as e:
-            print("init_dbus: Error connecting to DBus", e)
+            print("init_dbus: Error connecting to DBus", e, file=sys.stderr)
             return False
 
     def close_dbus(self):
@@ -46,22 +96,27 @@ class DBusCaller:
             try:
                 if self.signalsubs:
                     self.unsubscribe_signals()
+                if self.propsubs:
+                    self._unsubscribe_props_signal()
                 self.dbusconn.close_sync()
                 self.dbusconn = None
                 return True
             except Exception as e:
-                print("_close_bus: Error closing DBus", e)
+                print("_close_bus: Error closing DBus", e, file=sys.stderr)
 
         return False
 
-    def send_message(self, path, iface, method, argtype, args, reply_first_child=True):
+    def send_message(self, path, iface, method, argtype, args, reply_first_child=True, timeout=None):
+        """Blocking call, raises GLib.GError if there is no reply within
+            timeout milliseconds, _CALL_TIMEOUT_MILLIS by default"""
         if not self._is_connected() or not self._LIVE_CALLS:
             return []
 
+        self.calls += 1
         result = self.dbusconn.call_sync(self.msg_destination, path, iface, method,
                                          GLib.Variant(argtype, args), None,
                                          Gio.DBusCallFlags.ALLOW_INTERACTIVE_AUTHORIZATION,
-                                         -1, None)
+                                         timeout or self._CALL_TIMEOUT_MILLIS, None)
         if result:
             if reply_first_child:
                 return result[0]
@@ -69,39 +124,159 @@ class DBusCaller:
                 return result
         return []
 
+    def send_message_async(self, path, iface, method, argtype, args, callback, userdata=None,
+                           flags=Gio.DBusCallFlags.NONE, timeout=None, cancellable=None):
+        """Queue a call on the bus and return straight away.
+            callback(connection, result, userdata) runs from the main loop, use
+            connection.call_finish(result) to get the reply. It raises
+            GLib.GError once timeout milliseconds pass or cancellable is cancelled"""
+        if not self._is_connected() or not self._LIVE_CALLS:
+            return False
+
+        self.calls += 1
+        self.dbusconn.call(self.msg_destination, path, iface, method, GLib.Variant(argtype, args), None,
+                           flags, timeout or self._CALL_TIMEOUT_MILLIS, cancellable, callback, userdata)
+        return True
+
     def getunitpath(self, unitname):
         """TODO: Should probably change to raising an exception instead of
             quietly suppressing it. Same for bad unitname arg"""
         if not unitname:
             return None
+        path = self.propcache.get(unitname, self._CACHE_UNIT_PATH)
+        if path:
+            return path
         try:
-            path = self.send_message(self.mgr_path, self.mgr_interface, "GetUnit", "(s)", [unitname])
+            path = self.send_message(self.mgr_path, self.mgr_interface, "GetUnit", "(s)", [unitname],
+                                     timeout=self._READ_TIMEOUT_MILLIS)
+            self.propcache.put(unitname, self._CACHE_UNIT_PATH, path)
             return path
         except GLib.GError as ge:
             return None
 
-    def getprops(self, unitpath, t="unit"):
-        if not unitpath:
-            return {}
+    @staticmethod
+    def unit_object_path(unitname):
+        """Object path systemd uses for a unit name, escaped like sd_bus_path_encode"""
+        escaped = []
+        for num, c in enumerate(unitname):
+            if c.isascii() and (c.isalpha() or (c.isdigit() and num > 0)):
+                escaped.append(c)
+            else:
+                escaped.extend(f"_{b:02x}" for b in c.encode("utf-8"))
+        return "/org/freedesktop/systemd1/unit/" + "".join(escaped)
 
+    def iface_for_type(self, t):
         if t == "service":
-            ifname = self.iface_service
+            return self.iface_service
         elif t == "timer":
-            ifname = self.iface_timer
+            return self.iface_timer
         elif t == "socket":
-            ifname = self.iface_socket
-        else:
-            ifname = self.iface_unit
+            return self.iface_socket
+        return self.iface_unit
+
+    def getprops(self, unitpath, t="unit", cached=True):
+        props = self.getprops_view(unitpath, t, cached)
+        if not props:
+            return {}
+        return props.unpack()
+
+    def getprops_view(self, unitpath, t="unit", cached=True):
+        """Like getprops, as a PropsView that only unpacks the properties read.
+            cached=False reads them from systemd even if they are cached"""
+        if not unitpath:
+            return {}
+        ifname = self.iface_for_type(t)
+        props = self.cached_props(unitpath, ifname) if cached else None
+        if props is not None:
+            return props
+        return self._getall_view(unitpath, ifname)
 
+    def _getall_view(self, unitpath, ifname):
         try:
-            return self.send_message(unitpath, self.dbus_prop, "GetAll", "(s)", [ifname])
+            reply = self.send_message(unitpath, self.dbus_prop, "GetAll", "(s)", [ifname], False,
+                                      self._READ_TIMEOUT_MILLIS)
         except GLib.GError as ge:
             return {}
+        if not reply:
+            return {}
+        props = PropsView(reply.get_child_value(0))
+        if props:
+            self.propcache.put(unitpath, ifname, props)
+        return props
+
+    def cached_props(self, unitpath, ifname, props=None):
+        """Cached properties of an interface if they have props, or every
+            property of the interface for props None. Counters that change
+            without a signal are never answered from the cache"""
+        if props and not UNCACHED_PROPS.isdisjoint(props):
+            return None
+        cached = self.propcache.get(unitpath, ifname)
+        if cached is None or isinstance(cached, PropsView):
+            return cached
+        if props is not None and all(prop in cached for prop in props):
+            return cached
+        return None
+
+    def fetch_plan(self, unittype, detail_columns):
+        """Calls reading detail_columns of a unit type, a list of (iface,
+            props, getall). Interfaces without a needed property are left out,
+            and ones with only a few are read with a Get for each property"""
+        typeiface = self.iface_for_type(unittype)
+        byiface = {}
+        for prop in detail_columns:
+            iface = self.iface_unit if prop in UNIT_IFACE_PROPS else typeiface
+            byiface.setdefault(iface, []).append(prop)
+        plan = []
+        for iface, props in byiface.items():
+            if len(props) > self._GET_MAX_PROPS:
+                plan.append((iface, props, True))
+            else:
+                plan += [(iface, [prop], False) for prop in props]
+        return plan
+
+    def fetch_props(self, unitpath, ifname, props, getall):
+        """Properties for one step of a fetch_plan, from the cache or the bus"""
+        cached = self.cached_props(unitpath, ifname, props)
+        if cached is not None:
+            return cached
+        if getall:
+            return self._getall_view(unitpath, ifname)
+        values = {}
+        for prop in props:
+            try:
+                values[prop] = self.send_message(unitpath, self.dbus_prop, "Get", "(ss)", [ifname, prop],
+                                                 timeout=self._READ_TIMEOUT_MILLIS)
+            except GLib.GError:
+                pass
+        self.propcache.merge(unitpath, ifname, values)
+        return values
+
+    def clear_cache(self):
+        self.propcache.clear()
+
+    def cache_stats(self):
+        return self.propcache.stats()
+
+    def invalidate_for_signal(self, signal, params):
+        """Drop cached properties a Manager signal says are out of date"""
+        if signal == "Reloading":
+            self.propcache.clear()
+        elif signal == "UnitFilesChanged":
+            self.propcache.invalidate_iface(self.iface_unit)
+        elif signal == "JobRemoved" and params and len(params) > 2:
+            self.propcache.invalidate(self.unit_object_path(params[2]))
+        elif signal == "UnitRemoved" and params and len(params) > 1:
+            self.propcache.invalidate(params[0], self._CACHE_UNIT_PATH)
+            self.propcache.invalidate(params[1])
 
     def list_units(self, statelist=['active'], unitlist=['*.service']):
-        units = []
         result = self.send_message(self.mgr_path, self.mgr_interface, "ListUnitsByPatterns",
-                                   "(asas)", [GLib.Variant("as", statelist), GLib.Variant("as", unitlist)])
+                                   "(asas)", [GLib.Variant("as", statelist), GLib.Variant("as", unitlist)],
+                                   timeout=self._READ_TIMEOUT_MILLIS)
+        return self._parse_unit_list(result)
+
+    def _parse_unit_list(self, result):
+        units = []
         for r in result:
             name, desc, load, status, sub, e1, path, num, *k = r
             # result format: [('cups.service', 'CUPS Scheduler',
@@ -110,21 +285,149 @@ class DBusCaller:
             units.append(u)
         return units
 
+    def list_unit_files(self, patterns, states=[]):
+        """State of the unit files matching patterns by unit name, None if the call fails"""
+        try:
+            result = self.send_message(self.mgr_path, self.mgr_interface, "ListUnitFilesByPatterns", "(asas)",
+                                       [GLib.Variant("as", states), GLib.Variant("as", patterns)],
+                                       timeout=self._READ_TIMEOUT_MILLIS)
+        except GLib.GError as ge:
+            print("list_unit_files: Error calling ListUnitFilesByPatterns", ge.message, file=sys.stderr)
+            return None
+        return self._parse_unit_files(result)
+
+    def list_unit_files_async(self, patterns, done_cb, userdata=None, cancellable=None):
+        """Async version of list_unit_files, done_cb(filestates, userdata)"""
+        def on_reply(conn, res, data):
+            try:
+                filestates = self._parse_unit_files(conn.call_finish(res)[0])
+            except GLib.GError as ge:
+                if not self.is_cancelled(ge):
+                    print("list_unit_files_async: Error calling ListUnitFilesByPatterns", ge.message,
+                          file=sys.stderr)
+                filestates = None
+            done_cb(filestates, data)
+
+        sent = self.send_message_async(self.mgr_path, self.mgr_interface, "ListUnitFilesByPatterns", "(asas)",
+                                       [GLib.Variant("as", []), GLib.Variant("as", patterns)], on_reply, userdata,
+                                       timeout=self._READ_TIMEOUT_MILLIS, cancellable=cancellable)
+        if not sent:
+            done_cb(None, userdata)
+        return sent
+
+    @staticmethod
+    def _parse_unit_files(result):
+        # result format: [('/usr/lib/systemd/system/cups.service', 'enabled')]
+        return {os.path.basename(path): state for path, state in result}
+
     def list_details(self, request_state, request_unit, detail_columns=[]):
         units = self.list_units(request_state, request_unit)
         if not detail_columns:
             return units
 
+        filestates = None
+        if self._FILE_STATE in detail_columns and request_unit:
+            filestates = self.list_unit_files(request_unit)
+        plans = {}
         for unit in units:
-            unitprops = self.getprops(unit['Path'])
-            serviceprops = self.getprops(unit['Path'], unit['UnitType'])
-            for col in detail_columns:
-                if col in unitprops:
-                    unit[col] = unitprops[col]
-                elif col in serviceprops:
-                    unit[col] = serviceprops[col]
+            # units without a unit file, e.g. template instances, ask for it themselves
+            known = filestates is not None and unit['Name'] in filestates
+            if known:
+                unit[self._FILE_STATE] = filestates[unit['Name']]
+            plankey = (unit['UnitType'], known)
+            if plankey not in plans:
+                columns = self.without_file_state(detail_columns) if known else detail_columns
+                plans[plankey] = self.fetch_plan(unit['UnitType'], columns)
+            for iface, props, getall in plans[plankey]:
+                self.merge_props(unit, props, self.fetch_props(unit['Path'], iface, props, getall), {})
         return units
 
+    def without_file_state(self, detail_columns):
+        return [col for col in detail_columns if col != self._FILE_STATE]
+
+    @staticmethod
+    def merge_props(unit, detail_columns, unitprops, typeprops):
+        for col in detail_columns:
+            # one lookup per reply, a PropsView searches its Variant for each
+            value = unitprops.get(col)
+            if value is None:
+                value = typeprops.get(col)
+            if value is not None:
+                unit[col] = value
+
+    def list_units_async(self, statelist, unitlist, done_cb, userdata=None, error_cb=None, cancellable=None):
+        """Async version of list_units, done_cb(units, userdata) gets an empty
+            list if the call fails, unless error_cb(error, userdata) is given"""
+        return self._list_async("ListUnitsByPatterns", "(asas)",
+                                [GLib.Variant("as", statelist or []), GLib.Variant("as", unitlist or [])],
+                                done_cb, userdata, error_cb, cancellable)
+
+    def list_units_by_names(self, names):
+        result = self.send_message(self.mgr_path, self.mgr_interface, "ListUnitsByNames", "(as)", [list(names)],
+                                   timeout=self._READ_TIMEOUT_MILLIS)
+        return self._parse_unit_list(result)
+
+    def list_units_by_names_async(self, names, done_cb, userdata=None, error_cb=None, cancellable=None):
+        return self._list_async("ListUnitsByNames", "(as)", [list(names)], done_cb, userdata, error_cb, cancellable)
+
+    def _list_async(self, method, argtype, args, done_cb, userdata, error_cb=None, cancellable=None):
+        def on_reply(conn, res, data):
+            try:
+                result = conn.call_finish(res)[0]
+            except GLib.GError as ge:
+                if error_cb:
+                    error_cb(ge, data)
+                    return
+                print(f"_list_async: Error calling {method}", ge.message, file=sys.stderr)
+                result = []
+            done_cb(self._parse_unit_list(result), data)
+
+        sent = self.send_message_async(self.mgr_path, self.mgr_interface, method, argtype, args, on_reply, userdata,
+                                       timeout=self._READ_TIMEOUT_MILLIS, cancellable=cancellable)
+        if not sent:
+            done_cb([], userdata)
+        return sent
+
+    @staticmethod
+    def is_cancelled(error):
+        return error.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED)
+
+    @staticmethod
+    def is_timeout(error):
+        return error.matches(Gio.io_error_quark(), Gio.IOErrorEnum.TIMED_OUT)
+
+    def list_details_async(self, request_state, request_unit, detail_columns, done_cb, userdata=None,
+                           max_inflight=None, unit_cb=None, deadline_millis=None):
+        """Non-blocking list_details. Lists the units then pipelines the GetAll
+            calls, keeping up to max_inflight of them on the bus at once.
+            done_cb(units, userdata) runs from the main loop once every unit has its details.
+            With unit_cb(unit, userdata) each unit is handed over as soon as it is
+            complete instead of being collected. After deadline_millis the calls
+            still pending are given up, see DetailsFetch. Returns the DetailsFetch"""
+        if max_inflight is None:
+            max_inflight = self._MAX_INFLIGHT_CALLS
+        fetch = DetailsFetch(self, detail_columns, done_cb, userdata, max_inflight, unit_cb, deadline_millis)
+        if self._FILE_STATE in fetch.detail_columns and request_unit:
+            fetch.wait_file_states()
+            self.list_unit_files_async(request_unit, fetch.file_states_done, cancellable=fetch.cancellable)
+        self.list_units_async(request_state, request_unit, lambda units, data: fetch.start(units),
+                              error_cb=fetch.list_failed, cancellable=fetch.cancellable)
+        return fetch
+
+    def unit_list_details_async(self, unitnames, detail_columns, done_cb, userdata=None, max_inflight=None,
+                                deadline_millis=None):
+        """Like list_details_async for the named units only, fetched with a
+            single ListUnitsByNames call"""
+        if max_inflight is None:
+            max_inflight = self._MAX_INFLIGHT_CALLS
+        fetch = DetailsFetch(self, detail_columns, done_cb, userdata, max_inflight, deadline_millis=deadline_millis)
+        if self._FILE_STATE in fetch.detail_columns and unitnames:
+            fetch.wait_file_states()
+            self.list_unit_files_async(list(unitnames), fetch.file_states_done, cancellable=fetch.cancellable)
+        self.list_units_by_names_async(unitnames, lambda units, data: fetch.start(units),
+                                       error_cb=fetch.list_failed, cancellable=fetch.cancellable)
+        return fetch
+
     def unit_details(self, unitname):
         if not unitname:
             return None
@@ -134,19 +437,24 @@ class DBusCaller:
             return None
         unit, *others = unitlist
         if others:
-            print("ERROR, Received other units with same name: ", len(others))
+            print("ERROR, Received other units with same name: ", len(others), file=sys.stderr)
 
         unitprops = self.getprops(unit['Path'])
         unit.update(unitprops)
-        serviceprops = self.getprops(unit['Path'], unit['UnitType'])
+        # the type's interface has the counters, e.g. MemoryCurrent, that change without a signal
+        serviceprops = self.getprops(unit['Path'], unit['UnitType'], cached=False)
         unit.update(serviceprops)
         return unit
 
-    def subscribe_signals(self, refresh_cb):
+    def subscribe_signals(self, refresh_cb, jobs_only=False):
+        """Follow the Manager signals, refresh_cb() is called when units need a
+            refresh. With jobs_only, only JobRemoved is matched, to finish the
+            jobs of unit_method_async in a process that doesn't refresh units"""
         if not self._is_connected() or not self._LIVE_CALLS:
             return False
 
-        self.signalsubs = self.dbusconn.signal_subscribe(None, "org.freedesktop.systemd1.Manager", None, None, None,
+        member = "JobRemoved" if jobs_only else None
+        self.signalsubs = self.dbusconn.signal_subscribe(None, "org.freedesktop.systemd1.Manager", member, None, None,
                                                          Gio.DBusSignalFlags.NONE, self.on_manager_signal, "DBCMgr")
         if self.signalsubs:
             if callable(refresh_cb):
@@ -159,12 +467,16 @@ class DBusCaller:
     def unsubscribe_signals(self):
         if self.signalsubs:
             self.dbusconn.signal_unsubscribe(self.signalsubs)
+            self.signalsubs = None
             return True
         return False
 
     def on_manager_signal(self, connection, sender, path, iface, signal, params, userdata):
         if userdata and userdata == "DBCMgr" and path == self.mgr_path:
             # print("DBusCaller: Manager signal being processed...")
+            self.invalidate_for_signal(signal, params)
+            if signal == "JobRemoved" and params and len(params) > 3:
+                self.finish_job(params[1], params[3])
             self.process_signal(signal, params)
         # else:
         #    print("DBusCaller: ignoring manager signal on iface", iface, "and path", path)
@@ -176,15 +488,89 @@ class DBusCaller:
             if params:
                 value, *k = params
                 if not value:
+                    self.dirty_all = True
                     self.signal_refresh_cb()
         elif signal == "JobRemoved":
-            self.signal_refresh_cb()
+            # (u id, o job, s unit, s result)
+            if params and len(params) > 2:
+                self.mark_dirty(params[2])
         elif signal == "UnitFilesChanged":
+            self.dirty_all = True
             self.signal_refresh_cb()
-        elif signal == "UnitNew":
-            self.signal_refresh_cb()
-        elif signal == "UnitRemoved":
-            self.signal_refresh_cb()
+        elif signal == "UnitNew" or signal == "UnitRemoved":
+            # (s id, o path)
+            if params:
+                self.mark_dirty(params[0])
+
+    def mark_dirty(self, unitname):
+        """Collect a unit named in a signal for the next refresh, units of types
+            without a tab are dropped. Without a refresh callback nothing takes
+            them, so nothing is collected"""
+        if not self.signal_refresh_cb or not unitname or '.' not in unitname:
+            return
+        if unitname.rsplit('.', 1)[1] not in self.watch_types:
+            return
+        self.dirty_units.add(unitname)
+        self.signal_refresh_cb()
+
+    def take_dirty(self):
+        """Returns (dirty_all, unitnames) collected since the last call and resets them"""
+        dirty = (self.dirty_all, self.dirty_units)
+        self.dirty_all = False
+        self.dirty_units = set()
+        return dirty
+
+    def subscribe_properties(self, paths, props_cb):
+        """Opt-in PropertiesChanged updates for the unit object paths given, calling
+            again replaces the watched paths. props_cb(path, iface, changed) gets
+            the changed properties unpacked"""
+        if not self._is_connected() or not self._LIVE_CALLS:
+            return False
+
+        self.watched_paths = frozenset(paths)
+        self.props_cb = props_cb if callable(props_cb) else None
+        return self._subscribe_props_signal()
+
+    def unsubscribe_properties(self):
+        self.watched_paths = frozenset()
+        self.props_cb = None
+        self._unsubscribe_props_signal()
+        return True
+
+    def _subscribe_props_signal(self):
+        if self.propsubs:
+            return True
+        # systemd only emits unit signals while a client is subscribed
+        try:
+            self.send_message(self.mgr_path, self.mgr_interface, "Subscribe", "()", ())
+        except GLib.GError as ge:
+            print("_subscribe_props_signal: Subscribe failed", ge.message, file=sys.stderr)
+        self.propsubs = self.dbusconn.signal_subscribe(self.msg_destination, self.dbus_prop, "PropertiesChanged",
+                                                       None, None, Gio.DBusSignalFlags.NONE,
+                                                       self.on_properties_signal, "DBCProps")
+        return bool(self.propsubs)
+
+    def _unsubscribe_props_signal(self):
+        if not self.propsubs:
+            return False
+        self.dbusconn.signal_unsubscribe(self.propsubs)
+        self.propsubs = None
+        try:
+            self.send_message(self.mgr_path, self.mgr_interface, "Unsubscribe", "()", ())
+        except GLib.GError:
+            pass
+        return True
+
+    def on_properties_signal(self, connection, sender, path, iface, signal, params, userdata):
+        if userdata != "DBCProps":
+            return
+        # the match covers every unit, skip the ones not shown or cached before unpacking
+        if path not in self.watched_paths and (path, params.get_child_value(0).get_string()) not in self.propcache:
+            return
+        propiface, changed, invalidated = params.unpack()
+        self.propcache.update(path, propiface, changed, invalidated)
+        if changed and self.props_cb and path in self.watched_paths:
+            self.props_cb(path, propiface, changed)
 
     def unit_method(self, unitname, method):
         if not unitname or not method:
@@ -194,9 +580,353 @@ class DBusCaller:
         if not unitpath:
             return False
         if method not in self._ALLOWED_UNIT_METHODS:
-            print("ERROR, method not allowed", method)
+            print("ERROR, method not allowed", method, file=sys.stderr)
+            return False
+
+        if method in self._JOB_UNIT_METHODS:
+            jobid = self.send_message(unitpath, self.iface_unit, method, "(s)", ["fail"])
+        else:
+            self.send_message(unitpath, self.iface_unit, method, "()", ())
+        return True
+
+    def unit_method_async(self, unitname, method, done_cb, userdata=None):
+        """Non-blocking unit_method that follows the queued job until its JobRemoved
+            signal. done_cb(unitname, method, result, message, userdata) gets the job
+            result: done, failed, canceled, timeout, dependency, skipped or error if
+            the call itself failed. Needs subscribe_signals for the job results"""
+        if not unitname or not method:
             return False
+        if method not in self._ALLOWED_UNIT_METHODS:
+            print("ERROR, method not allowed", method, file=sys.stderr)
+            return False
+
+        job = {"unit": unitname, "method": method, "done_cb": done_cb, "userdata": userdata, "timeout": 0}
+        if method in self._JOB_UNIT_METHODS:
+            argtype, args = "(s)", ["fail"]
+        else:
+            argtype, args = "()", ()
+        return self.send_message_async(self.unit_object_path(unitname), self.iface_unit, method, argtype, args,
+                                       self._on_job_queued, job, Gio.DBusCallFlags.ALLOW_INTERACTIVE_AUTHORIZATION)
+
+    def _on_job_queued(self, conn, res, job):
+        try:
+            reply = conn.call_finish(res)
+        except GLib.GError as ge:
+            self._report_job(job, "error", ge.message)
+            return
+        if job["method"] not in self._JOB_UNIT_METHODS:
+            # no job queued, the call is complete
+            self._report_job(job, "done", "")
+            return
+        jobpath = reply[0]
+        self.jobs[jobpath] = job
+        job["timeout"] = GLib.timeout_add(self._JOB_TIMEOUT_MILLIS, self._on_job_timeout, jobpath)
 
-        jobid = self.send_message(unitpath, self.iface_unit, method, "(s)", ["fail"])
+    def _on_job_timeout(self, jobpath):
+        job = self.jobs.pop(jobpath, None)
+        if job:
+            job["timeout"] = 0
+            self._report_job(job, "timeout", f"No result after {self._JOB_TIMEOUT_MILLIS // 1000}s")
+        return False
+
+    def finish_job(self, jobpath, result):
+        """Match a JobRemoved signal to a job started by unit_method_async"""
+        job = self.jobs.pop(jobpath, None)
+        if not job:
+            return False
+        if job["timeout"]:
+            GLib.source_remove(job["timeout"])
+        self._report_job(job, result, "")
         return True
 
+    def unit_files_method_async(self, unitnames, action, done_cb, userdata=None):
+        """Enable or disable many unit files with one Manager call followed by a
+            single daemon Reload. done_cb(unitnames, result, message, userdata) gets
+            result done, denied if authorization failed, or error for anything
+            the Manager could not handle, like SysV scripts"""
+        if not unitnames or action not in self._UNIT_FILE_METHODS:
+            return False
+        method, argtype = self._UNIT_FILE_METHODS[action]
+        if method not in self._ALLOWED_MGR_METHODS:
+            print("ERROR, method not allowed", method, file=sys.stderr)
+            return False
+
+        files = list(unitnames)
+        args = [files, False, False] if action == "enable" else [files, False]
+        request = (files, done_cb, userdata)
+        return self.send_message_async(self.mgr_path, self.mgr_interface, method, argtype, args,
+                                       self._on_unit_files_changed, request,
+                                       Gio.DBusCallFlags.ALLOW_INTERACTIVE_AUTHORIZATION)
+
+    def _on_unit_files_changed(self, conn, res, request):
+        try:
+            conn.call_finish(res)
+        except GLib.GError as ge:
+            self._report_unit_files(request, ge)
+            return
+        sent = self.send_message_async(self.mgr_path, self.mgr_interface, "Reload", "()", (),
+                                       self._on_unit_files_reloaded, request,
+                                       Gio.DBusCallFlags.ALLOW_INTERACTIVE_AUTHORIZATION)
+        if not sent:
+            self._report_unit_files(request, None)
+
+    def _on_unit_files_reloaded(self, conn, res, request):
+        try:
+            conn.call_finish(res)
+        except GLib.GError as ge:
+            self._report_unit_files(request, ge)
+            return
+        self._report_unit_files(request, None)
+
+    def _report_unit_files(self, request, error):
+        files, done_cb, userdata = request
+        if error is None:
+            result, message = "done", ""
+        else:
+            remote = Gio.DBusError.get_remote_error(error) if Gio.DBusError.is_remote_error(error) else None
+            result = "denied" if remote in self._AUTH_ERRORS else "error"
+            message = error.message
+        if callable(done_cb):
+            done_cb(files, result, message, userdata)
+
+    def pending_jobs(self):
+        return len(self.jobs)
+
+    @staticmethod
+    def _report_job(job, result, message):
+        if callable(job["done_cb"]):
+            job["done_cb"](job["unit"], job["method"], result, message, job["userdata"])
+
+
+class PropsView(Mapping):
+    """Read-only dict of a GetAll reply kept as its a{sv} GLib.Variant. A
+        property is only unpacked when it is read, then kept, so the hundreds
+        of properties of an interface that are never shown cost no Python
+        objects. Values from PropertiesChanged signals are applied with update"""
+    __slots__ = ("variant", "values")
+
+    def __init__(self, variant):
+        self.variant = variant
+        self.values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+        child = self.variant.lookup_value(key, None)
+        if child is None:
+            raise KeyError(key)
+        value = self.values[key] = child.unpack()
+        return value
+
+    def __contains__(self, key):
+        return key in self.values or self.variant.lookup_value(key, None) is not None
+
+    def __iter__(self):
+        for num in range(self.variant.n_children()):
+            yield self.variant.get_child_value(num).get_child_value(0).get_string()
+
+    def __len__(self):
+        return self.variant.n_children()
+
+    def update(self, changed):
+        self.values.update(changed)
+
+    def unpack(self):
+        """Every property as a plain dict"""
+        props = self.variant.unpack()
+        props.update(self.values)
+        return props
+
+
+class DetailsFetch:
+    """Fetches detail properties for a list of units with a bounded number of
+        calls in flight, following DBusCaller.fetch_plan, and calls
+        done_cb(units, userdata) once all replies are merged. If
+        unit_cb(unit, userdata) is given each unit goes to it once complete and
+        is dropped, so done_cb gets an empty list. With wait_file_states the
+        fetch also waits for file_states_done, and units found in its unit file
+        states aren't asked for UnitFileState.
+
+        cancel() drops a fetch that is no longer wanted, done_cb is not called.
+        Once deadline_millis pass the calls still pending are cancelled and
+        done_cb gets the units as they are, the ones missing details are named
+        in stale. If listing the units failed, list_error holds the GLib.GError
+        and done_cb gets no units.
+    """
+    def __init__(self, caller, detail_columns, done_cb, userdata=None, max_inflight=32, unit_cb=None,
+                 deadline_millis=None):
+        self.caller = caller
+        self.detail_columns = detail_columns or []
+        self.done_cb = done_cb
+        self.unit_cb = unit_cb
+        self.userdata = userdata
+        self.max_inflight = max(1, max_inflight)
+        self.units = None
+        self.filestates = None
+        self.waiting_files = False
+        self.plans = {}
+        self.queue = deque()
+        self.replies = {}
+        self.inflight = 0
+        self.finished = False
+        self.cancelled = False
+        self.cancellable = Gio.Cancellable()
+        self.stale = set()
+        self.list_error = None
+        self.deadline_source = 0
+        if deadline_millis:
+            self.deadline_source = GLib.timeout_add(deadline_millis, self._on_deadline)
+
+    def cancel(self):
+        if self.finished:
+            return
+        self.cancelled = True
+        self.finished = True
+        self.queue.clear()
+        self._remove_deadline()
+        self.cancellable.cancel()
+
+    def _on_deadline(self):
+        self.deadline_source = 0
+        # what is still queued is given up, the calls in flight fail as cancelled
+        while self.queue:
+            index, step, expected = self.queue.popleft()
+            self.stale.add(self.units[index]['Name'])
+            self._store_reply(index, step, expected, {})
+        self.cancellable.cancel()
+        if self.units is not None and not self.waiting_files:
+            self._pump()
+        return False
+
+    def _remove_deadline(self):
+        if self.deadline_source:
+            GLib.source_remove(self.deadline_source)
+            self.deadline_source = 0
+
+    def list_failed(self, error, data=None):
+        if self.cancelled:
+            return
+        if not self.caller.is_cancelled(error):
+            print("DetailsFetch: Error listing units", error.message, file=sys.stderr)
+        self.list_error = error
+        self.waiting_files = False
+        self.start([])
+
+    def wait_file_states(self):
+        self.waiting_files = True
+
+    def file_states_done(self, filestates, data=None):
+        if self.finished or not self.waiting_files:
+            return
+        self.filestates = filestates
+        self.waiting_files = False
+        if self.units is not None:
+            self._begin()
+
+    def start(self, units):
+        if self.cancelled:
+            return
+        self.units = units
+        if not self.waiting_files:
+            self._begin()
+
+    def _begin(self):
+        units = self.units
+        filestates = self.filestates or {}
+        filestate = self.caller._FILE_STATE
+        if self.detail_columns:
+            for index, unit in enumerate(units):
+                known = unit['Name'] in filestates
+                if known:
+                    unit[filestate] = filestates[unit['Name']]
+                plankey = (unit.get('UnitType'), known)
+                plan = self.plans.get(plankey)
+                if plan is None:
+                    columns = self.caller.without_file_state(self.detail_columns) if known else self.detail_columns
+                    plan = self.plans[plankey] = self.caller.fetch_plan(unit.get('UnitType'), columns)
+                if not plan:
+                    self._unit_complete(index)
+                    continue
+                self.replies[index] = []
+                for step in plan:
+                    self.queue.append((index, step, len(plan)))
+        elif self.unit_cb:
+            for index in range(len(units)):
+                self._unit_complete(index)
+        self._pump()
+
+    def _pump(self):
+        while self.queue and self.inflight < self.max_inflight:
+            index, step, expected = self.queue.popleft()
+            iface, props, getall = step
+            path = self.units[index]['Path']
+            cached = self.caller.cached_props(path, iface, props)
+            if cached is not None:
+                self._store_reply(index, step, expected, cached)
+                continue
+            if getall:
+                method, argtype, args = "GetAll", "(s)", [iface]
+            else:
+                method, argtype, args = "Get", "(ss)", [iface, props[0]]
+            sent = self.caller.send_message_async(path, self.caller.dbus_prop, method, argtype, args,
+                                                  self._on_reply, (index, step, expected),
+                                                  timeout=self.caller._READ_TIMEOUT_MILLIS,
+                                                  cancellable=self.cancellable)
+            if sent:
+                self.inflight += 1
+            else:
+                self._store_reply(index, step, expected, {})
+
+        if not self.queue and self.inflight == 0 and not self.finished:
+            self.finished = True
+            self._remove_deadline()
+            if self.unit_cb:
+                self.units = []
+            if callable(self.done_cb):
+                self.done_cb(self.units, self.userdata)
+
+    def _on_reply(self, conn, res, data):
+        if self.cancelled:
+            return
+        index, step, expected = data
+        iface, props, getall = step
+        path = self.units[index]['Path']
+        try:
+            reply = conn.call_finish(res)
+        except GLib.GError as ge:
+            if self.caller.is_cancelled(ge) or self.caller.is_timeout(ge):
+                self.stale.add(self.units[index]['Name'])
+            reply = None
+        if reply is None:
+            values = {}
+        elif getall:
+            values = PropsView(reply.get_child_value(0))
+            if values:
+                self.caller.propcache.put(path, iface, values)
+        else:
+            values = {props[0]: reply.get_child_value(0).unpack()}
+            self.caller.propcache.merge(path, iface, values)
+        self.inflight -= 1
+        self._store_reply(index, step, expected, values)
+        self._pump()
+
+    def _store_reply(self, index, step, expected, values):
+        # merge once every call for the unit has replied, each property comes
+        # from a single interface
+        replies = self.replies[index]
+        replies.append((step[1], values))
+        if len(replies) < expected:
+            return
+        unit = self.units[index]
+        for props, values in replies:
+            DBusCaller.merge_props(unit, props, values, {})
+        del self.replies[index]
+        self._unit_complete(index)
+
+    def _unit_complete(self, index):
+        if self.unit_cb:
+            unit = self.units[index]
+            self.units[index] = None
+            self.unit_cb(unit, self.userdata)
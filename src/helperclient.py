@@ -0,0 +1,102 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+import sys
+
+from gi.repository import Gio, GLib
+
+
+class HelperClient:
+    """Talks to a privileged 'unithelper.py --session' process, started through
+        pkexec on the first request and kept for the following ones, so polkit
+        and the interpreter start once per burst of actions. The helper exits
+        by itself when idle and is started again on the next request.
+    """
+    def __init__(self, argv):
+        self.argv = argv
+        self.proc = None
+        self.stdin = None
+        self.reader = None
+        self.pending = {}
+        self.lastid = 0
+
+    def is_running(self):
+        return self.proc is not None
+
+    def request(self, action, unitname, done_cb):
+        """Queue an action, done_cb(unitname, result, output) gets result done,
+            failed or error if the helper could not run"""
+        if not self.proc and not self._start():
+            done_cb(unitname, "error", "Could not start the helper")
+            return False
+
+        self.lastid += 1
+        self.pending[self.lastid] = (unitname, done_cb)
+        line = json.dumps({"id": self.lastid, "action": action, "unit": unitname}) + "\n"
+        try:
+            self.stdin.write_all(line.encode("utf-8"), None)
+        except GLib.GError as ge:
+            del self.pending[self.lastid]
+            done_cb(unitname, "error", ge.message)
+            return False
+        return True
+
+    def close(self):
+        if self.stdin:
+            # end of input makes the helper exit
+            self.stdin.close(None)
+            self.stdin = None
+
+    def _start(self):
+        try:
+            self.proc = Gio.Subprocess.new(self.argv,
+                                           Gio.SubprocessFlags.STDIN_PIPE | Gio.SubprocessFlags.STDOUT_PIPE)
+        except GLib.GError as ge:
+            print("HelperClient: Could not start helper", ge.message, file=sys.stderr)
+            self.proc = None
+            return False
+        self.stdin = self.proc.get_stdin_pipe()
+        self.reader = Gio.DataInputStream.new(self.proc.get_stdout_pipe())
+        self.reader.read_line_async(GLib.PRIORITY_DEFAULT, None, self._on_line, self.proc)
+        return True
+
+    def _on_line(self, reader, res, proc):
+        try:
+            line, length = reader.read_line_finish_utf8(res)
+        except GLib.GError:
+            line = None
+        if line is None:
+            self._on_session_end(proc)
+            return
+        self._handle_line(line)
+        if proc is self.proc:
+            reader.read_line_async(GLib.PRIORITY_DEFAULT, None, self._on_line, proc)
+
+    def _handle_line(self, line):
+        try:
+            response = json.loads(line)
+        except ValueError:
+            # plain text from the helper before the session started
+            print("HelperClient:", line, file=sys.stderr)
+            return
+        if not isinstance(response, dict) or response.get("ready"):
+            return
+        entry = self.pending.pop(response.get("id"), None)
+        if not entry:
+            return
+        unitname, done_cb = entry
+        result = "done" if response.get("returncode") == 0 else "failed"
+        done_cb(unitname, result, (response.get("output") or "").strip())
+
+    def _on_session_end(self, proc):
+        # end of output, the helper exited or is about to
+        if proc is not self.proc:
+            return
+        self.proc = None
+        self.stdin = None
+        self.reader = None
+        # anything still waiting was never answered, e.g. authentication was dismissed
+        pending = self.pending
+        self.pending = {}
+        for unitname, done_cb in pending.values():
+            done_cb(unitname, "error", "The helper exited before answering")
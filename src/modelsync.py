@@ -0,0 +1,220 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk
+
+
+class ModelSync:
+    """Keeps the store of a tab in step with lists of units, keyed by unit name.
+        The window's stores are UnitModels from make_store(), without it a
+        Gtk.ListStore is used. A refresh only sets the cells that changed,
+        appends new units and removes vanished ones. First loads and large
+        changes fill a new store while no view shows it, then hand it to
+        attach_cb(store). make_key(unit), if given, builds the text a search
+        looks in, see key()
+    """
+    BULK_MIN_ROWS = 200
+    BULK_CHANGE_RATIO = 0.5
+    # rows filter() re-checks
+    FILTER_ALL = 0
+    FILTER_SHOWN = 1
+    FILTER_HIDDEN = 2
+
+    def __init__(self, coltypes, make_row, attach_cb=None, visible_col=None, make_store=None, make_key=None):
+        self.coltypes = coltypes
+        self.make_row = make_row
+        self.make_key = make_key
+        self.keys = {}
+        self.attach_cb = attach_cb
+        self.make_store = make_store
+        # bool column ModelSync keeps set to the result of the match function,
+        # for Gtk.TreeModelFilter.set_visible_column or a UnitModel
+        self.visible_col = visible_col
+        self.match = None
+        self.shown = set()
+        self.store = None
+        self.rows = {}
+        self.units = {}
+        # property to {value: names}, see index()
+        self.indexes = {}
+        self.new_store()
+
+    def new_store(self):
+        self.store = self.create_store()
+        self.rows = {}
+        return self.store
+
+    def create_store(self):
+        if self.make_store:
+            return self.make_store()
+        store = Gtk.ListStore()
+        store.set_column_types(self.coltypes)
+        return store
+
+    def get_unit(self, name):
+        return self.units.get(name)
+
+    def key(self, unit):
+        """Search text of a unit from make_key, built by the first search that
+            needs it and kept until the unit's row changes"""
+        name = unit['Name']
+        key = self.keys.get(name)
+        if key is None:
+            key = self.keys[name] = self.make_key(unit)
+        return key
+
+    def clear_keys(self):
+        """Drop the search text of every unit, e.g. when make_key would
+            build it from other columns"""
+        self.keys = {}
+
+    def get_iter(self, name):
+        entry = self.rows.get(name)
+        if entry:
+            return entry[0]
+        return None
+
+    def reconcile(self, units):
+        """Apply a complete list of units, returns the number of rows touched"""
+        fresh = {}
+        freshunits = {}
+        for unit in units:
+            name = unit['Name']
+            fresh[name] = self._make_row(unit)
+            freshunits[name] = unit
+
+        removed = [name for name in self.rows if name not in fresh]
+        touched = len(removed)
+        for name, row in fresh.items():
+            entry = self.rows.get(name)
+            if not entry or entry[1] != row:
+                touched += 1
+
+        self.units = freshunits
+        self.indexes = {}
+        if not self.rows or (touched >= self.BULK_MIN_ROWS and touched > len(fresh) * self.BULK_CHANGE_RATIO):
+            self.bulk_load(fresh)
+            return touched
+
+        for name in removed:
+            self._remove_row(name)
+        for name, row in fresh.items():
+            self._set_row(name, row)
+        return touched
+
+    def bulk_load(self, rows):
+        """Fill a new store with the rows dict while no filter or sort model
+            listens to it, then attach it"""
+        store = self.create_store()
+        newrows = {}
+        for name, row in rows.items():
+            newrows[name] = [store.append(row), row]
+        self.store = store
+        self.rows = newrows
+        self.keys = {name: key for name, key in self.keys.items() if name in newrows}
+        if self.visible_col is not None:
+            self.shown = {name for name, row in rows.items() if row[self.visible_col]}
+        if callable(self.attach_cb):
+            self.attach_cb(store)
+
+    def update(self, unit):
+        """Insert or patch the row of a single unit, returns True if anything changed"""
+        name = unit['Name']
+        self.units[name] = unit
+        self.indexes = {}
+        return self._set_row(name, self._make_row(unit))
+
+    def remove(self, name):
+        self.units.pop(name, None)
+        self.indexes = {}
+        return self._remove_row(name)
+
+    def index(self, prop):
+        """Names of the units by their value of prop, built on first use and
+            dropped when the units change. Meant for properties with few values"""
+        index = self.indexes.get(prop)
+        if index is None:
+            index = {}
+            for name, unit in self.units.items():
+                index.setdefault(unit.get(prop), set()).add(name)
+            self.indexes[prop] = index
+        return index
+
+    def filter(self, match, scope=FILTER_ALL, candidates=None):
+        """Show only the rows match(unit, row) is true for, None shows all.
+            A narrower match than the last one only needs to re-check the shown
+            rows, FILTER_SHOWN, and a wider one the hidden rows, FILTER_HIDDEN.
+            Rows not in candidates, if given, are hidden without calling match.
+            Only rows whose visibility changes are written, returns their count"""
+        self.match = match
+        if self.visible_col is None:
+            return 0
+        if scope == self.FILTER_SHOWN:
+            names = list(self.shown)
+        elif scope == self.FILTER_HIDDEN:
+            names = [name for name in self.rows if name not in self.shown]
+        else:
+            names = list(self.rows)
+
+        changed = 0
+        col = self.visible_col
+        for name in names:
+            treeiter, row = self.rows[name]
+            visible = (candidates is None or name in candidates) and self._matches(self.units.get(name), row)
+            if visible == row[col]:
+                continue
+            row[col] = visible
+            self.store.set_value(treeiter, col, visible)
+            if visible:
+                self.shown.add(name)
+            else:
+                self.shown.discard(name)
+            changed += 1
+        return changed
+
+    def _make_row(self, unit):
+        row = self.make_row(unit)
+        name = unit['Name']
+        if name in self.keys:
+            entry = self.rows.get(name)
+            if entry is None or self._values_changed(entry[1], row):
+                del self.keys[name]
+        if self.visible_col is not None:
+            row[self.visible_col] = self._matches(unit, row)
+        return row
+
+    def _values_changed(self, current, row):
+        # anything but the visible flag
+        col = self.visible_col
+        return any(value != row[num] for num, value in enumerate(current) if num != col)
+
+    def _matches(self, unit, row):
+        return self.match is None or bool(self.match(unit, row))
+
+    def _set_row(self, name, row):
+        if self.visible_col is not None:
+            if row[self.visible_col]:
+                self.shown.add(name)
+            else:
+                self.shown.discard(name)
+        entry = self.rows.get(name)
+        if not entry:
+            self.rows[name] = [self.store.append(row), row]
+            return True
+        treeiter, current = entry
+        if current == row:
+            return False
+        columns = [num for num, value in enumerate(row) if current[num] != value]
+        self.store.set(treeiter, columns, [row[num] for num in columns])
+        entry[1] = row
+        return True
+
+    def _remove_row(self, name):
+        self.shown.discard(name)
+        self.keys.pop(name, None)
+        entry = self.rows.pop(name, None)
+        if not entry:
+            return False
+        self.store.remove(entry[0])
+        return True
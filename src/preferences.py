@@ -76,6 +76,8 @@ class PrefDialog:
 class PrefStorage:
 
     SHOW_INACTIVE = 'showinactive'
+    LIVE_UPDATES = 'liveupdates'
+    ACTION_CONCURRENCY = 'action-concurrency'
     WIN_MAXIMIZED = 'winmaximized'
     WIN_POSITION = 'winposition'
     HIDE_SERVICE_COL = 'hide-service-cols'
@@ -84,6 +86,8 @@ class PrefStorage:
 
     SETTINGS_SCHEMA = "ak.systemgear"
     KEY_VTYPES = {SHOW_INACTIVE: "b",
+                  LIVE_UPDATES: "b",
+                  ACTION_CONCURRENCY: "i",
                   WIN_MAXIMIZED: "b",
                   WIN_POSITION: '(iiii)',
                   HIDE_SERVICE_COL: 'as',
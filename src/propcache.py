@@ -0,0 +1,92 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import time
+from collections import OrderedDict
+
+
+class PropCache:
+    """LRU cache for property replies keyed by (object path, interface).
+        The least recently used entry is evicted once maxsize is reached, and
+        an entry older than ttl seconds is dropped when read, for values that
+        change without a signal. Hits and misses are counted so the hit rate
+        can be checked under load
+    """
+    def __init__(self, maxsize=4096, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        # key: (time cached, value)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        # (path, iface), without counting a hit or a miss
+        return key in self.entries
+
+    def get(self, path, iface):
+        key = (path, iface)
+        entry = self.entries.get(key)
+        if entry is not None and self.ttl is not None and self.clock() - entry[0] > self.ttl:
+            del self.entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, path, iface, value):
+        if not path or value is None or self.maxsize <= 0:
+            return
+        key = (path, iface)
+        self.entries[key] = (self.clock(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def merge(self, path, iface, values):
+        """Add values to the cached entry, or cache them as an entry of their own"""
+        if not values:
+            return
+        key = (path, iface)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.put(path, iface, dict(values))
+            return
+        # the entry still expires with its oldest values
+        entry[1].update(values)
+        self.entries.move_to_end(key)
+
+    def update(self, path, iface, changed, invalidated=None):
+        """Patch a cached entry with changed values, the entry is dropped if
+            any property was invalidated without a value"""
+        key = (path, iface)
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        if invalidated:
+            del self.entries[key]
+        else:
+            entry[1].update(changed)
+
+    def invalidate(self, path, iface=None):
+        if iface is not None:
+            self.entries.pop((path, iface), None)
+            return
+        for key in [key for key in self.entries if key[0] == path]:
+            del self.entries[key]
+
+    def invalidate_iface(self, iface):
+        for key in [key for key in self.entries if key[1] == iface]:
+            del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
@@ -0,0 +1,202 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+from gi.repository import GLib
+
+from .columns import UI_COLUMNS, ICON_COLUMNS, detail_props
+from .dbuscaller import DBusCaller
+
+
+FORMATS = ["ndjson", "csv", "table"]
+
+
+class NdjsonWriter:
+    """One JSON object per unit and line"""
+    def __init__(self, stream, columns):
+        self.stream = stream
+        self.columns = columns
+
+    def header(self):
+        pass
+
+    def write(self, values):
+        self.stream.write(json.dumps(dict(zip(self.columns, values))) + "\n")
+
+
+class CsvWriter:
+    def __init__(self, stream, columns):
+        self.stream = stream
+        self.columns = columns
+        self.writer = csv.writer(stream)
+
+    def header(self):
+        self.writer.writerow(self.columns)
+
+    def write(self, values):
+        self.writer.writerow(values)
+
+
+class TableWriter:
+    """Fixed width columns so rows can be written before all units are known,
+        values longer than their column are cut short"""
+    WIDTHS = {"Name": 40, "Description": 40, "Fragment Path": 48, "FragmentPath": 48, "Listen": 32}
+    MIN_WIDTH = 12
+
+    def __init__(self, stream, columns):
+        self.stream = stream
+        self.columns = columns
+        self.widths = [self.width(col) for col in columns]
+
+    @classmethod
+    def width(cls, column):
+        """Characters given to a column"""
+        return max(len(column), cls.WIDTHS.get(column, cls.MIN_WIDTH))
+
+    def header(self):
+        self.write(self.columns)
+
+    def write(self, values):
+        self.stream.write(self.format(values) + "\n")
+
+    def format(self, values):
+        cells = []
+        for value, width in zip(values, self.widths):
+            if len(value) > width:
+                value = value[:width - 1] + "~"
+            cells.append(value.ljust(width))
+        return " ".join(cells).rstrip()
+
+
+WRITERS = {"ndjson": NdjsonWriter, "csv": CsvWriter, "table": TableWriter}
+
+
+class Snapshot:
+    """Streams the units matching the states and patterns to a writer as their
+        details arrive, without keeping them, so memory stays flat on large hosts
+    """
+    def __init__(self, caller, writer, states, patterns, columns, max_inflight=None):
+        self.caller = caller
+        self.writer = writer
+        self.states = states
+        self.patterns = patterns
+        self.columns = columns
+        self.max_inflight = max_inflight
+        self.count = 0
+        self.error = None
+        # set if systemd did not list the units, and the units written without all their details
+        self.list_error = None
+        self.stale = []
+        self.loop = None
+
+    def run(self):
+        self.loop = GLib.MainLoop()
+        self.writer.header()
+        fetch = self.caller.list_details_async(self.states, self.patterns, detail_props(self.columns), self.on_done,
+                                               None, self.max_inflight, self.on_unit)
+        if not self.error and self.loop:
+            self.loop.run()
+        if fetch:
+            self.list_error = fetch.list_error
+            self.stale = sorted(fetch.stale)
+        return self.count
+
+    def on_unit(self, unit, data):
+        if self.error:
+            return
+        try:
+            self.writer.write([unit.getprop_fmt(col) for col in self.columns])
+            self.writer.stream.flush()
+        except BrokenPipeError as e:
+            # reader went away, e.g. piped into head
+            self.error = e
+            self.quit()
+            return
+        self.count += 1
+
+    def on_done(self, units, data):
+        self.quit()
+
+    def quit(self):
+        if self.loop and self.loop.is_running():
+            self.loop.quit()
+        self.loop = None
+
+
+def add_selection_args(parser):
+    """Options choosing the units and columns, shared with the top mode"""
+    parser.add_argument("-t", "--type", choices=list(UI_COLUMNS), default="service",
+                        help="unit type, sets the default pattern and columns (default: service)")
+    parser.add_argument("-s", "--state", action="append",
+                        help="state to list, can be repeated, 'all' for every state (default: active)")
+    parser.add_argument("-p", "--pattern", action="append",
+                        help="unit name pattern, can be repeated (default: *.TYPE)")
+    parser.add_argument("-c", "--columns",
+                        help="comma separated columns, from the window or any property name")
+    parser.add_argument("--inflight", type=int, default=None,
+                        help="maximum property requests in flight at once")
+
+
+def selection_from_args(args):
+    """Returns (states, patterns, columns) for the parsed selection options"""
+    states = args.state or ['active']
+    if 'all' in states:
+        states = []
+    patterns = args.pattern or ["*." + args.type]
+    if args.columns:
+        columns = [col.strip() for col in args.columns.split(',') if col.strip()]
+    else:
+        columns = [col for col in UI_COLUMNS[args.type] if col not in ICON_COLUMNS]
+    return states, patterns, columns
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="servicemonitor --snapshot",
+                                     description="Print systemd units without starting the window",
+                                     epilog="Exits with 1 if systemd did not list the units, "
+                                            "and 2 if some units are missing details")
+    add_selection_args(parser)
+    parser.add_argument("-f", "--format", choices=FORMATS, default="table", help="output format (default: table)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    states, patterns, columns = selection_from_args(args)
+
+    caller = DBusCaller()
+    # every unit is only read once, don't fill the cache with them
+    caller.propcache.maxsize = 0
+    if not caller.init_dbus():
+        print("Error, could not connect to DBus", file=sys.stderr)
+        return 1
+
+    writer = WRITERS[args.format](sys.stdout, columns)
+    snapshot = Snapshot(caller, writer, states, patterns, columns, args.inflight)
+    try:
+        snapshot.run()
+    finally:
+        caller.close_dbus()
+    if snapshot.error:
+        # keep the interpreter from failing again when it flushes stdout on exit
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return 1
+    return exit_status(snapshot)
+
+
+def exit_status(snapshot):
+    """1 if systemd did not list the units, 2 if some were written without
+        all their details, reported on stderr"""
+    if snapshot.list_error:
+        print("Error, systemd did not answer:", snapshot.list_error.message, file=sys.stderr)
+        return 1
+    if snapshot.stale:
+        print(f"Warning, {len(snapshot.stale)} units are missing details:", ", ".join(snapshot.stale),
+              file=sys.stderr)
+        return 2
+    return 0
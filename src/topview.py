@@ -0,0 +1,440 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import argparse
+import curses
+import fnmatch
+import os
+import signal
+import sys
+import time
+
+from gi.repository import GLib
+
+from .columns import column_prop, detail_props
+from .dbuscaller import DBusCaller
+from .snapshot import TableWriter, add_selection_args, selection_from_args
+
+
+class TopTable:
+    """Units of the live view as formatted lines. A unit is formatted once when
+        it changes and the sorted, filtered order is only rebuilt after a change
+    """
+    def __init__(self, columns):
+        self.columns = columns
+        self.props = [column_prop(col) for col in columns]
+        self.formatter = TableWriter(None, columns)
+        self.units = {}
+        self.rows = {}
+        self.lines = {}
+        self.keys = {}
+        self.paths = {}
+        self.sortcol = 0
+        self.reverse = False
+        self.searchterm = ""
+        self.order = []
+        self.order_dirty = True
+
+    def __len__(self):
+        return len(self.units)
+
+    def set_units(self, units):
+        """Apply a complete list of units, returns the number of units changed"""
+        fresh = {unit['Name']: unit for unit in units}
+        changed = 0
+        for name in [name for name in self.units if name not in fresh]:
+            changed += self.remove(name)
+        for unit in fresh.values():
+            changed += self.update(unit)
+        return changed
+
+    def update(self, unit):
+        """Insert or reformat a unit, returns True if its row changed"""
+        name = unit['Name']
+        self.units[name] = unit
+        self.paths[unit['Path']] = name
+        row = [unit.getprop_fmt(col) for col in self.columns]
+        if self.rows.get(name) == row:
+            return False
+        self.rows[name] = row
+        self.lines[name] = self.formatter.format(row)
+        self.keys[name] = "\t".join(row).lower()
+        self.order_dirty = True
+        return True
+
+    def remove(self, name):
+        unit = self.units.pop(name, None)
+        if unit is None:
+            return False
+        self.paths.pop(unit['Path'], None)
+        self.rows.pop(name, None)
+        self.lines.pop(name, None)
+        self.keys.pop(name, None)
+        self.order_dirty = True
+        return True
+
+    def get_by_path(self, path):
+        name = self.paths.get(path)
+        if name is None:
+            return None
+        return self.units.get(name)
+
+    def set_sort(self, column, reverse=False):
+        self.sortcol = column % len(self.columns)
+        self.reverse = reverse
+        self.order_dirty = True
+
+    def set_search(self, term):
+        term = term.lower()
+        if term != self.searchterm:
+            self.searchterm = term
+            self.order_dirty = True
+
+    def header(self):
+        names = list(self.columns)
+        names[self.sortcol] += " v" if self.reverse else " ^"
+        return self.formatter.format(names)
+
+    def sort_key(self, name):
+        # numbers sort by value, everything else by its text
+        value = self.units[name].get(self.props[self.sortcol])
+        if isinstance(value, int) and not isinstance(value, bool):
+            return 0, value, "", name
+        return 1, 0, self.rows[name][self.sortcol].lower(), name
+
+    def visible(self):
+        """Names of the units passing the search, in sort order"""
+        if self.order_dirty:
+            names = self.rows
+            if self.searchterm:
+                names = [name for name in names if self.searchterm in self.keys[name]]
+            self.order = sorted(names, key=self.sort_key, reverse=self.reverse)
+            self.order_dirty = False
+        return self.order
+
+
+class TopView:
+    """Live curses view of the units, updated from the Manager signals and the
+        properties of the units on screen. Signal storms are folded into one
+        refresh, only lines that differ from the screen are written and nothing
+        runs while nothing changes
+    """
+    REFRESH_DELAY_MS = 500
+    # details still missing then are given up, the rows keep their last values
+    DEADLINE_MS = 8000
+    HELP = "q:quit /:search <>:sort r:reverse"
+
+    def __init__(self, caller, screen, unittype, states, patterns, columns, max_inflight=None):
+        self.caller = caller
+        self.screen = screen
+        self.unittype = unittype
+        self.states = states
+        self.patterns = patterns
+        self.detail_columns = detail_props(columns)
+        self.max_inflight = max_inflight
+        self.table = TopTable(columns)
+        self.offset = 0
+        self.drawn = []
+        self.watched = []
+        self.sources = []
+        self.searching = False
+        self.status = "Loading units..."
+        self.pending_refresh = False
+        self.pending_draw = False
+        self.serial = 0
+        # fetches in flight, a full refresh cancels them all
+        self.fetches = []
+        # what systemd didn't answer for, asked again on the next refresh
+        self.retry_all = False
+        self.stale_names = set()
+        self.loop = None
+
+    def run(self):
+        self.loop = GLib.MainLoop()
+        try:
+            curses.curs_set(0)
+        except curses.error:
+            pass
+        self.screen.nodelay(True)
+        self.screen.keypad(True)
+        self.sources = [GLib.io_add_watch(sys.stdin.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self.on_input),
+                        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGWINCH, self.on_resize),
+                        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGINT, self.quit),
+                        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGTERM, self.quit)]
+        self.caller.subscribe_signals(self.on_signal)
+        self.refresh_all()
+        self.draw()
+        try:
+            self.loop.run()
+        finally:
+            for source in self.sources:
+                GLib.source_remove(source)
+            self.sources = []
+            self.caller.unsubscribe_properties()
+            self.caller.unsubscribe_signals()
+
+    def quit(self, *args):
+        if self.loop and self.loop.is_running():
+            self.loop.quit()
+        return False
+
+    def refresh_all(self):
+        for fetch in self.fetches:
+            fetch.cancel()
+        self.serial += 1
+        self.retry_all = False
+        request = {"serial": self.serial}
+        request["fetch"] = self.caller.list_details_async(self.states, self.patterns, self.detail_columns,
+                                                          self.on_units, request, self.max_inflight,
+                                                          deadline_millis=self.DEADLINE_MS)
+        self.fetches = [request["fetch"]]
+
+    def on_units(self, units, request):
+        if request["serial"] != self.serial:
+            return
+        fetch = request["fetch"]
+        if fetch.list_error:
+            # keep the rows shown and list them again on the next refresh
+            self.retry_all = True
+            self.status = f"systemd did not answer, {len(self.table)} rows stale"
+            self.queue_draw()
+            return
+        self.keep_stale_details(units, fetch.stale)
+        changed = self.table.set_units(units)
+        self.set_status(changed, fetch.stale)
+
+    def keep_stale_details(self, units, stale):
+        """Fill the details stale units are missing from their last refresh,
+            and fetch them again with the next one"""
+        for unit in units:
+            old = self.table.units.get(unit['Name']) if unit['Name'] in stale else None
+            if old is None:
+                continue
+            for prop in self.detail_columns:
+                if prop not in unit and prop in old:
+                    unit[prop] = old[prop]
+        self.stale_names.update(stale)
+
+    def set_status(self, changed, stale):
+        self.status = f"{changed} changed at {time.strftime('%H:%M:%S')}"
+        if stale:
+            self.status += f", {len(stale)} stale"
+        self.queue_draw()
+
+    def on_signal(self):
+        # fold a burst of signals into one refresh
+        if self.pending_refresh:
+            return
+        self.pending_refresh = True
+        GLib.timeout_add(self.REFRESH_DELAY_MS, self.on_refresh)
+
+    def on_refresh(self):
+        self.pending_refresh = False
+        dirty_all, dirty_units = self.caller.take_dirty()
+        names = [name for name in dirty_units | self.stale_names if self.matches_patterns(name)]
+        self.stale_names = set()
+        if dirty_all or self.retry_all or len(names) > len(self.table) // 2:
+            self.refresh_all()
+        elif names:
+            # tagged with the serial of the last full refresh, one started later drops the reply
+            request = {"serial": self.serial, "names": names}
+            request["fetch"] = self.caller.unit_list_details_async(names, self.detail_columns, self.on_units_details,
+                                                                   request, self.max_inflight,
+                                                                   deadline_millis=self.DEADLINE_MS)
+            self.fetches = [fetch for fetch in self.fetches if not fetch.finished] + [request["fetch"]]
+        return False
+
+    def on_units_details(self, units, request):
+        if request["serial"] != self.serial:
+            return
+        fetch = request["fetch"]
+        names = request["names"]
+        if fetch.list_error:
+            # none of the names were listed, keep their rows for the next refresh
+            self.stale_names.update(names)
+            self.status = f"systemd did not answer, {len(names)} rows stale"
+            self.queue_draw()
+            return
+        self.keep_stale_details(units, fetch.stale)
+        changed = 0
+        found = set()
+        for unit in units:
+            found.add(unit['Name'])
+            if self.unit_in_view(unit):
+                changed += self.table.update(unit)
+            else:
+                changed += self.table.remove(unit['Name'])
+        for name in names:
+            if name not in found:
+                changed += self.table.remove(name)
+        self.set_status(changed, fetch.stale)
+
+    def on_unit_properties(self, path, iface, changed):
+        unit = self.table.get_by_path(path)
+        if unit is None or not unit.apply_props(changed):
+            return
+        if self.unit_in_view(unit):
+            self.table.update(unit)
+        else:
+            self.table.remove(unit['Name'])
+        self.queue_draw()
+
+    def matches_patterns(self, name):
+        return any(fnmatch.fnmatchcase(name, pattern) for pattern in self.patterns)
+
+    def unit_in_view(self, unit):
+        """Matches the state filter passed to ListUnitsByPatterns"""
+        if unit['Load'] == 'not-found':
+            return False
+        if not self.states:
+            return True
+        return any(state in self.states for state in (unit['Load'], unit['State'], unit['Substate']))
+
+    def watch_units(self, names):
+        if names == self.watched:
+            return
+        self.watched = names
+        self.caller.subscribe_properties([self.table.units[name]['Path'] for name in names], self.on_unit_properties)
+
+    def queue_draw(self):
+        if not self.pending_draw:
+            self.pending_draw = True
+            GLib.idle_add(self.draw)
+
+    def draw(self):
+        self.pending_draw = False
+        height, width = self.screen.getmaxyx()
+        rowcount = max(0, height - 2)
+        names = self.table.visible()
+        self.offset = max(0, min(self.offset, len(names) - rowcount))
+        shown = names[self.offset:self.offset + rowcount]
+
+        lines = [self.table.header()]
+        lines += [self.table.lines[name] for name in shown]
+        lines += [""] * (rowcount - len(shown))
+        lines.append(self.status_line(len(names)))
+
+        for y, line in enumerate(lines[:height]):
+            line = line[:width - 1]
+            if y < len(self.drawn) and self.drawn[y] == line:
+                continue
+            attr = curses.A_REVERSE if y == 0 else curses.A_NORMAL
+            try:
+                self.screen.addstr(y, 0, line, attr)
+                self.screen.clrtoeol()
+            except curses.error:
+                pass
+        self.drawn = [line[:width - 1] for line in lines[:height]]
+        self.screen.refresh()
+        self.watch_units(shown)
+        return False
+
+    def status_line(self, count):
+        if self.searching:
+            return "/" + self.table.searchterm
+        search = f" /{self.table.searchterm}" if self.table.searchterm else ""
+        return f"{count}/{len(self.table)} {self.unittype} units{search}  {self.status}  {self.HELP}"
+
+    def on_input(self, source, condition):
+        while True:
+            try:
+                key = self.screen.get_wch()
+            except curses.error:
+                break
+            self.handle_key(key)
+        return True
+
+    def on_resize(self):
+        size = os.get_terminal_size()
+        curses.resizeterm(size.lines, size.columns)
+        self.redraw()
+        return True
+
+    def redraw(self):
+        self.drawn = []
+        self.screen.clear()
+        self.queue_draw()
+
+    def handle_key(self, key):
+        if self.searching:
+            self.handle_search_key(key)
+            return
+
+        height, width = self.screen.getmaxyx()
+        page = max(1, height - 2)
+        if key in ("q", "Q"):
+            self.quit()
+            return
+        elif key == "/":
+            self.searching = True
+        elif key in ("<", ">"):
+            self.table.set_sort(self.table.sortcol + (1 if key == ">" else -1), self.table.reverse)
+        elif key == "r":
+            self.table.set_sort(self.table.sortcol, not self.table.reverse)
+        elif key in (curses.KEY_UP, "k"):
+            self.offset -= 1
+        elif key in (curses.KEY_DOWN, "j"):
+            self.offset += 1
+        elif key == curses.KEY_PPAGE:
+            self.offset -= page
+        elif key in (curses.KEY_NPAGE, " "):
+            self.offset += page
+        elif key in (curses.KEY_HOME, "g"):
+            self.offset = 0
+        elif key in (curses.KEY_END, "G"):
+            self.offset = len(self.table)
+        elif key == curses.KEY_RESIZE:
+            self.on_resize()
+            return
+        elif key == "\x0c":    # ctrl-l
+            self.redraw()
+            return
+        else:
+            return
+        self.offset = max(0, self.offset)
+        self.queue_draw()
+
+    def handle_search_key(self, key):
+        term = self.table.searchterm
+        if key in ("\n", "\r", curses.KEY_ENTER):
+            self.searching = False
+        elif key == "\x1b":
+            self.searching = False
+            term = ""
+        elif key in (curses.KEY_BACKSPACE, "\x7f", "\b"):
+            term = term[:-1]
+        elif isinstance(key, str) and key.isprintable():
+            term += key
+        else:
+            return
+        self.table.set_search(term)
+        self.offset = 0
+        self.queue_draw()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="servicemonitor --top",
+                                     description="Live view of systemd units in the terminal")
+    add_selection_args(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    states, patterns, columns = selection_from_args(args)
+    if not sys.stdin.isatty() or not sys.stdout.isatty():
+        print("Error, the top mode needs a terminal", file=sys.stderr)
+        return 1
+
+    caller = DBusCaller()
+    if not caller.init_dbus():
+        print("Error, could not connect to DBus", file=sys.stderr)
+        return 1
+
+    # don't wait for a second escape key after Esc
+    os.environ.setdefault("ESCDELAY", "25")
+    try:
+        curses.wrapper(lambda screen: TopView(caller, screen, args.type, states, patterns, columns,
+                                              args.inflight).run())
+    finally:
+        caller.close_dbus()
+    return 0
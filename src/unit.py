@@ -1,76 +1,274 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import datetime
+import sys
+from collections.abc import MutableMapping
 
 
-class Unit(dict):
+class PropLayout:
+    """Key order shared by every unit that got the same keys in the same
+        order, so a unit only keeps a list of its values. Layouts are never
+        changed, adding keys moves a unit to a child layout that is created
+        once and reused by the next unit taking the same step"""
+    __slots__ = ("keys", "index", "children")
+
+    def __init__(self, keys=()):
+        self.keys = keys
+        self.index = {key: num for num, key in enumerate(keys)}
+        self.children = {}
+
+    def extend(self, keys):
+        child = self.children.get(keys)
+        if child is None:
+            child = self.children[keys] = PropLayout(self.keys + keys)
+        return child
+
+
+class Unit(MutableMapping):
+    """A unit's properties, read and written like a dict. The values live in
+        a list ordered by a PropLayout shared with similar units, and the
+        states and other enumerated strings are interned, so thousands of
+        units cost a fraction of as many dicts"""
+    __slots__ = ("_layout", "_values")
+
     suffix_ts = "Timestamp"
     # suffix_tsmono = "TimestampMonotonic"
     suffix_us = "USec"
     suffix_usrt = "USecRealtime"
     suffix_dirmode = "DirectoryMode"
 
+    # D-Bus property names for the keys filled from ListUnits
+    prop_keys = {"ActiveState": "State",
+                 "SubState": "Substate",
+                 "LoadState": "Load",
+                 "Description": "Description"}
+
+    # keys with a handful of possible values, shared instead of copied per unit
+    interned_keys = frozenset(["Load", "State", "Substate", "UnitType", "LoadState", "ActiveState", "SubState",
+                               "UnitFileState", "UnitFilePreset", "Type", "Result", "Restart", "NotifyAccess",
+                               "FreezerState", "Slice"])
+
     negative_notset = "[not set]"
     negative_one_int64 = 0xFFFFFFFFFFFFFFFF  # 18446744073709551615
     negative_one_int32 = 0xFFFFFFFF
 
+    _root_layout = PropLayout()
+    # property name to its formatter, see formatter()
+    _formatters = {}
+    _list_keys = ("Name", "Path", "Description", "Load", "State", "Substate")
+
     def __init__(self, name, path, description="", load="", state="", substate=""):
-        self['Name'] = name
-        self['Path'] = path
-        self['Description'] = description
-        self['Load'] = load
-        self['State'] = state
-        self['Substate'] = substate
-        if '.' in self['Name']:
+        values = [name, path, description, sys.intern(load), sys.intern(state), sys.intern(substate)]
+        keys = self._list_keys
+        if '.' in name:
             n, t = name.split('.', 1)
-            self['UnitType'] = t
-            self[t.capitalize()] = n
+            keys += ("UnitType", t.capitalize())
+            values += [sys.intern(t), n]
+        self._layout = self._root_layout.extend(keys)
+        self._values = values
 
-    def getprop_fmt(self, prop):
-        value = self.get(prop)
-        if value is None and ' ' in prop:
-            otherkey = prop.replace(' ', '')
-            value = self.get(otherkey)
-        elif value is None:
-            return ''
-
-        if isinstance(value, list):
-            if value and (isinstance(value[0], str) or isinstance(value[0], tuple)):
-                value = str(value).lstrip('[').rstrip(']')
-            elif value:
-                value = str(value).lstrip('[').rstrip(']')
-            else:
-                value = ""
-        elif isinstance(value, tuple):
-            value = str(value)
-            if value:
-                value = value.lstrip('(').rstrip(')')
-        elif isinstance(value, int):
-            if value == self.negative_one_int64 or value == self.negative_one_int32:
-                value = self.negative_notset
-            elif prop.endswith(self.suffix_ts) and value > 1000000:
-                dt = datetime.datetime.fromtimestamp(int(value / (1000 * 1000)))
-                value = str(dt)
-            elif prop.endswith(self.suffix_us):
-                # format microseconds as us, ms, s or higher. drop the decimal if it's 0
-                if value < 1000:
-                    value = f"{value:.0f}us" if value % 1 == 0 else f"{value:.1f}us"
-                elif value < 1000000:  # 1s
-                    value = value/1000
-                    value = f"{value:.0f}ms" if value % 1 == 0 else f"{value:.1f}ms"
-                elif value < 60000000:
-                    value = value / 1000000
-                    value = f"{value:.0f}s" if value % 1 == 0 else f"{value:.1f}s"
-                elif value < 31536000000000:    # 1 year (31536000) in us
-                    value = str(datetime.timedelta(microseconds=value))
-                else:   # more than 1 year, format as a date
-                    value = str(datetime.datetime.fromtimestamp(value / (1000 * 1000)))
-            elif prop.endswith(self.suffix_usrt) and value > 1000000:
-                value = str(datetime.datetime.fromtimestamp(value / (1000 * 1000)))
-            elif prop.endswith(self.suffix_dirmode):
-                value = f"{value:04o}"
+    def __getitem__(self, key):
+        return self._values[self._layout.index[key]]
+
+    def __setitem__(self, key, value):
+        if key in self.interned_keys and type(value) is str:
+            value = sys.intern(value)
+        num = self._layout.index.get(key)
+        if num is None:
+            self._layout = self._layout.extend((key,))
+            self._values.append(value)
+        else:
+            self._values[num] = value
+
+    def __delitem__(self, key):
+        num = self._layout.index[key]
+        keys = self._layout.keys
+        self._layout = self._root_layout.extend(keys[:num] + keys[num + 1:])
+        del self._values[num]
+
+    def __iter__(self):
+        return iter(self._layout.keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._layout.index
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def get(self, key, default=None):
+        num = self._layout.index.get(key)
+        if num is None:
+            return default
+        return self._values[num]
+
+    def update(self, other=(), **kwargs):
+        """Adds the new keys in one layout step, a full GetAll reply would
+            otherwise leave a layout behind for every property"""
+        items = other.items() if hasattr(other, "items") else other
+        index = self._layout.index
+        newkeys = {}
+        for key, value in items:
+            if key in index:
+                self[key] = value
+                continue
+            if key in self.interned_keys and type(value) is str:
+                value = sys.intern(value)
+            if key in newkeys:
+                self._values[newkeys[key]] = value
             else:
+                newkeys[key] = len(self._values)
+                self._values.append(value)
+        if newkeys:
+            self._layout = self._layout.extend(tuple(newkeys))
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def apply_props(self, props):
+        """Merge changed D-Bus properties, keeping only keys the unit already has.
+            Returns True if any value changed"""
+        changed = False
+        for prop, value in props.items():
+            key = self.prop_keys.get(prop, prop)
+            if key in self and self[key] != value:
+                self[key] = value
+                changed = True
+        return changed
+
+    def getprop_fmt(self, prop):
+        num = self._layout.index.get(prop)
+        value = None if num is None else self._values[num]
+        if value is None:
+            if ' ' not in prop:
+                return ''
+            value = self.get(prop.replace(' ', ''))
+            if value is None:
+                return "None"
+        fmt = self._formatters.get(prop)
+        if fmt is None:
+            fmt = self.formatter(prop)
+        return fmt(value)
+
+    @classmethod
+    def format_column(cls, units, prop):
+        """getprop_fmt of one property for many units, the formatter and the
+            key without spaces are looked up once"""
+        fmt = cls.formatter(prop)
+        otherkey = prop.replace(' ', '') if ' ' in prop else None
+        values = []
+        for unit in units:
+            value = unit.get(prop)
+            if value is None:
+                if otherkey is None:
+                    values.append('')
+                    continue
+                value = unit.get(otherkey)
+                if value is None:
+                    values.append("None")
+                    continue
+            values.append(fmt(value))
+        return values
+
+    @classmethod
+    def format_value(cls, prop, value):
+        """getprop_fmt of a value already looked up, without spaces in the key"""
+        if value is None:
+            return "None" if ' ' in prop else ''
+        fmt = cls._formatters.get(prop)
+        if fmt is None:
+            fmt = cls.formatter(prop)
+        return fmt(value)
+
+    @classmethod
+    def formatter(cls, prop):
+        """The function formatting values of prop, picked once per property name"""
+        fmt = cls._formatters.get(prop)
+        if fmt is None:
+            fmt = cls._formatters[prop] = cls._make_formatter(prop)
+        return fmt
+
+    @classmethod
+    def _make_formatter(cls, prop):
+        if prop.endswith(cls.suffix_ts):
+            format_int = _format_timestamp
+        elif prop.endswith(cls.suffix_us):
+            format_int = _format_usec
+        elif prop.endswith(cls.suffix_usrt):
+            format_int = _format_usec_realtime
+        elif prop.endswith(cls.suffix_dirmode):
+            format_int = _format_dirmode
+        else:
+            format_int = str
+        # dates and durations repeat a lot between units and refreshes
+        memo_int = _memoize(format_int) if format_int is not str and format_int is not _format_dirmode else format_int
+        notset = (cls.negative_one_int64, cls.negative_one_int32)
+
+        def format_value(value):
+            kind = type(value)
+            if kind is str:
+                return value
+            if kind is int:
+                return cls.negative_notset if value in notset else memo_int(value)
+            if isinstance(value, list):
+                return str(value).lstrip('[').rstrip(']') if value else ""
+            if isinstance(value, tuple):
                 value = str(value)
-        elif not isinstance(value, str):
-            value = str(value)
-        return value
+                return value.lstrip('(').rstrip(')') if value else value
+            if isinstance(value, int):
+                # bool and other int subclasses, not memoized as True == 1
+                return cls.negative_notset if value in notset else format_int(value)
+            if not isinstance(value, str):
+                return str(value)
+            return value
+        return format_value
+
+
+_FORMAT_MEMO_SIZE = 4096
+
+
+def _memoize(format_int):
+    memo = {}
+
+    def cached(value):
+        text = memo.get(value)
+        if text is None:
+            if len(memo) >= _FORMAT_MEMO_SIZE:
+                memo.clear()
+            text = memo[value] = format_int(value)
+        return text
+    return cached
+
+
+def _format_timestamp(value):
+    if value > 1000000:
+        return str(datetime.datetime.fromtimestamp(int(value / (1000 * 1000))))
+    return str(value)
+
+
+def _format_usec(value):
+    # format microseconds as us, ms, s or higher. drop the decimal if it's 0
+    if value < 1000:
+        value = f"{value:.0f}us" if value % 1 == 0 else f"{value:.1f}us"
+    elif value < 1000000:  # 1s
+        value = value/1000
+        value = f"{value:.0f}ms" if value % 1 == 0 else f"{value:.1f}ms"
+    elif value < 60000000:
+        value = value / 1000000
+        value = f"{value:.0f}s" if value % 1 == 0 else f"{value:.1f}s"
+    elif value < 31536000000000:    # 1 year (31536000) in us
+        value = str(datetime.timedelta(microseconds=value))
+    else:   # more than 1 year, format as a date
+        value = str(datetime.datetime.fromtimestamp(value / (1000 * 1000)))
+    return value
+
+
+def _format_usec_realtime(value):
+    if value > 1000000:
+        return str(datetime.datetime.fromtimestamp(value / (1000 * 1000)))
+    return str(value)
+
+
+def _format_dirmode(value):
+    return f"{value:04o}"
@@ -1,9 +1,11 @@
 #!/usr/bin/python3
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import json
+import os
+import select
 import subprocess
 import sys
-import os
 
 
 class UnitHelper:
@@ -17,6 +19,10 @@ class UnitHelper:
     """
     _sysctl_bin = "systemctl"
     _sysctl_version = "--version"
+    _cli_actions = ['enable', 'disable']
+    _unit_actions = ['enable', 'disable', 'mask', 'unmask', 'reset-failed']
+    _manager_actions = ['daemon-reload']
+    _unit_suffixes = ('.service', '.timer', '.socket')
 
     def checksysctl(self):
         args = [self._sysctl_bin, self._sysctl_version]
@@ -43,22 +49,96 @@ class UnitHelper:
         output += serr.decode("utf-8")
         return retcode, output
 
+    def validate_request(self, unitname, action, allowed):
+        """Returns an error message, or None if the request is allowed"""
+        if action not in allowed:
+            return f"Error, invalid state argument '{action}'"
+        if action in self._manager_actions:
+            return None
+        if not isinstance(unitname, str) or not unitname.endswith(self._unit_suffixes):
+            return f"Error, invalid unit type in argument '{unitname}'"
+        # systemctl would take e.g. --root=/x.service as an option
+        if unitname.startswith('-') or '/' in unitname:
+            return f"Error, invalid unit name in argument '{unitname}'"
+        return None
+
     def call_elevated_sysctl(self, unitname, action):
+        if action in self._manager_actions:
+            return self._run_sysctl([self._sysctl_bin, action])
         if not unitname or not action:
             return False, "Error with unit name or action"
-        argslist = [self._sysctl_bin, action, unitname]
+        argslist = [self._sysctl_bin, action, "--", unitname]
         retcode, output = self._run_sysctl(argslist)
         return retcode, output
 
 
+class HelperSession:
+    """ Long-lived helper mode, authenticated once by pkexec.
+        Reads one JSON request per line, {"id": 1, "action": "enable", "unit": "x.service"},
+        and writes one JSON result per line with the same id, the systemctl
+        return code and output. Exits on end of input or after idle_timeout
+        seconds without a request.
+    """
+    IDLE_TIMEOUT = 120
+
+    def __init__(self, helper, infd, outstream, idle_timeout=IDLE_TIMEOUT):
+        self.helper = helper
+        self.infd = infd
+        self.outstream = outstream
+        self.idle_timeout = idle_timeout
+        self.allowed = helper._unit_actions + helper._manager_actions
+
+    def run(self):
+        self.write({"ready": True, "actions": self.allowed})
+        pending = b""
+        while True:
+            ready, *k = select.select([self.infd], [], [], self.idle_timeout)
+            if not ready:
+                return 0
+            data = os.read(self.infd, 65536)
+            if not data:
+                return 0
+            pending += data
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    self.write(self.handle(line))
+
+    def handle(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            request = None
+        if not isinstance(request, dict):
+            return {"id": None, "returncode": 1, "output": "Error, invalid request"}
+
+        reqid = request.get("id")
+        action = request.get("action")
+        unitname = request.get("unit")
+        response = {"id": reqid, "action": action, "unit": unitname}
+        error = self.helper.validate_request(unitname, action, self.allowed)
+        if error:
+            response.update(returncode=1, output=error)
+            return response
+        ret, output = self.helper.call_elevated_sysctl(unitname, action)
+        response.update(returncode=ret, output=output)
+        return response
+
+    def write(self, response):
+        self.outstream.write(json.dumps(response) + "\n")
+        self.outstream.flush()
+
+
 def main():
-    print("System Gear Unit File helper")
+    session = len(sys.argv) >= 2 and sys.argv[1] == "--session"
+    # in session mode stdout carries the results
+    print("System Gear Unit File helper", file=sys.stderr if session else sys.stdout)
     running_super = os.getuid() == 0
 
     if not running_super:
         print(f"Error, not running as privileged user")
         return 1
-    if len(sys.argv) != 3:
+    if (session and len(sys.argv) > 3) or (not session and len(sys.argv) != 3):
         print(f"Error, invalid input arguments, expecting 2")
         return 1
 
@@ -67,12 +147,20 @@ def main():
         print(f"Error, could not locate systemctl binary")
         return 1
 
+    if session:
+        timeout = HelperSession.IDLE_TIMEOUT
+        if len(sys.argv) == 3:
+            try:
+                timeout = max(1, int(sys.argv[2]))
+            except ValueError:
+                print(f"Error, invalid idle timeout '{sys.argv[2]}'")
+                return 1
+        return HelperSession(h, sys.stdin.fileno(), sys.stdout, timeout).run()
+
     cmd, unitname, state = sys.argv
-    if state not in ['enable', 'disable']:
-        print(f"Error, invalid state argument '{state}'")
-        return 1
-    if not unitname.endswith('.service') and not unitname.endswith('.timer') and not unitname.endswith('.socket'):
-        print(f"Error, invalid unit type in argument '{unitname}'")
+    error = h.validate_request(unitname, state, h._cli_actions)
+    if error:
+        print(error)
         return 1
 
     print(f"Request to change {unitname} to {state}")
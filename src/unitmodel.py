@@ -0,0 +1,290 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from collections import OrderedDict
+
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk, GLib, GObject
+
+
+class UnitModel(GObject.Object, Gtk.TreeModel, Gtk.TreeSortable):
+    """Flat tree model for ModelSync, a stand-in for Gtk.ListStore that keeps
+        the raw property values of a row and formats a cell only when the tree
+        view draws it, with formatters[column](value). Formatted cells are kept
+        for the rows drawn last, columns that are not shown are never asked for.
+        The model filters on visible_col and sorts on the raw values itself,
+        so no TreeModelFilter or TreeModelSort sits between it and the view.
+        Changes are applied to the shown order at the next idle, in one pass
+    """
+    CACHE_ROWS = 256
+    # above this many inserted and deleted rows, the view is refilled instead
+    # of patched row by row
+    PATCH_MAX_ROWS = 64
+
+    def __init__(self, coltypes, formatters, visible_col=None, name_col=0):
+        super().__init__()
+        self.coltypes = coltypes
+        self.formatters = list(formatters) + [None] * (len(coltypes) - len(formatters))
+        self.visible_col = visible_col
+        self.name_col = name_col
+        self.rows = {}
+        self.names = {}
+        self.next_id = 1
+        # ids of the rows the view knows, in sort order
+        self.order = []
+        self.positions = {}
+        self.removed = set()
+        self.cells = OrderedDict()
+        self.sortcol = name_col
+        self.sortorder = Gtk.SortType.ASCENDING
+        self.flush_source = 0
+
+    # ListStore calls used by ModelSync
+
+    def set_column_types(self, coltypes):
+        self.coltypes = coltypes
+
+    def append(self, row):
+        rowid = self.next_id
+        self.next_id += 1
+        self.rows[rowid] = list(row)
+        self.names[row[self.name_col]] = rowid
+        if self._shown(rowid):
+            self._queue_flush()
+        return rowid
+
+    def set(self, rowid, columns, values):
+        row = self.rows[rowid]
+        reorder = False
+        for column, value in zip(columns, values):
+            row[column] = value
+            if column == self.sortcol or column == self.visible_col:
+                reorder = True
+        self.cells.pop(rowid, None)
+        if reorder:
+            self._queue_flush()
+        else:
+            position = self._position(rowid)
+            if position is not None:
+                self.row_changed(Gtk.TreePath.new_from_indices([position]), self._iter(rowid))
+
+    def set_value(self, rowid, column, value):
+        self.set(rowid, [column], [value])
+
+    def remove(self, rowid):
+        # the view may still ask for the row until the next flush
+        self.removed.add(rowid)
+        self.cells.pop(rowid, None)
+        name = self.rows[rowid][self.name_col]
+        if self.names.get(name) == rowid:
+            del self.names[name]
+        self._queue_flush()
+
+    def clear(self):
+        for rowid in list(self.rows):
+            if rowid not in self.removed:
+                self.remove(rowid)
+
+    # lookups for the window
+
+    def path_of(self, name):
+        """Path of the row of a unit, None if it isn't shown"""
+        position = self._position(self.names.get(name))
+        if position is None:
+            return None
+        return Gtk.TreePath.new_from_indices([position])
+
+    def cell(self, rowid, column):
+        fmt = self.formatters[column]
+        row = self.rows[rowid]
+        if fmt is None:
+            return row[column]
+        cells = self.cells.get(rowid)
+        if cells is None:
+            cells = self.cells[rowid] = {}
+            if len(self.cells) > self.CACHE_ROWS:
+                self.cells.popitem(last=False)
+        else:
+            self.cells.move_to_end(rowid)
+        text = cells.get(column)
+        if text is None:
+            text = cells[column] = fmt(row[column])
+        return text
+
+    # applying changes to the view
+
+    def flush(self, notify=True):
+        """Bring the shown order up to date, notify=False for a model no view
+            shows yet"""
+        if self.flush_source:
+            GLib.source_remove(self.flush_source)
+            self.flush_source = 0
+        for rowid in self.removed:
+            del self.rows[rowid]
+        self.removed = set()
+        order = sorted((rowid for rowid in self.rows if self._shown(rowid)), key=self.sort_key,
+                       reverse=self.sortorder == Gtk.SortType.DESCENDING)
+        if not notify:
+            self._set_order(order)
+            return False
+
+        oldorder = self.order
+        wanted = set(order)
+        deleted = [pos for pos, rowid in enumerate(oldorder) if rowid not in wanted]
+        inserted = len(order) - (len(oldorder) - len(deleted))
+        if len(deleted) + inserted > self.PATCH_MAX_ROWS:
+            self._refill(order)
+            return False
+
+        working = list(oldorder)
+        for pos in reversed(deleted):
+            del working[pos]
+            self._set_order(working)
+            self.row_deleted(Gtk.TreePath.new_from_indices([pos]))
+        kept = set(working)
+        sortedkept = [rowid for rowid in order if rowid in kept]
+        if sortedkept != working:
+            oldpositions = {rowid: pos for pos, rowid in enumerate(working)}
+            self._set_order(sortedkept)
+            self.rows_reordered(Gtk.TreePath(), None, [oldpositions[rowid] for rowid in sortedkept])
+        working = list(sortedkept)
+        for pos, rowid in enumerate(order):
+            if rowid in kept:
+                continue
+            working.insert(pos, rowid)
+            self._set_order(working)
+            self.row_inserted(Gtk.TreePath.new_from_indices([pos]), self._iter(rowid))
+        self._set_order(order)
+        return False
+
+    def _refill(self, order):
+        # deleting from the end and appending leave every other position as it is
+        self._position(None)
+        working = self.order
+        while working:
+            del self.positions[working.pop()]
+            self.row_deleted(Gtk.TreePath.new_from_indices([len(working)]))
+        for rowid in order:
+            self.positions[rowid] = len(working)
+            working.append(rowid)
+            self.row_inserted(Gtk.TreePath.new_from_indices([len(working) - 1]), self._iter(rowid))
+
+    def sort_key(self, rowid):
+        # numbers by value, text without case, anything else by its text
+        row = self.rows[rowid]
+        value = row[self.sortcol]
+        if isinstance(value, int) and not isinstance(value, bool):
+            return 0, value, "", row[self.name_col]
+        if isinstance(value, str):
+            return 1, 0, value.lower(), row[self.name_col]
+        if value is None:
+            return 3, 0, "", row[self.name_col]
+        return 2, 0, self.cell(rowid, self.sortcol).lower(), row[self.name_col]
+
+    def _shown(self, rowid):
+        return self.visible_col is None or bool(self.rows[rowid][self.visible_col])
+
+    def _queue_flush(self):
+        if not self.flush_source:
+            # before the view redraws
+            self.flush_source = GLib.idle_add(self.flush, priority=GLib.PRIORITY_HIGH_IDLE)
+
+    def _set_order(self, order):
+        self.order = order
+        self.positions = None
+
+    def _position(self, rowid):
+        if self.positions is None:
+            self.positions = {rowid: pos for pos, rowid in enumerate(self.order)}
+        return self.positions.get(rowid)
+
+    def _iter(self, rowid):
+        treeiter = Gtk.TreeIter()
+        treeiter.stamp = id(self) & 0x7FFFFFFF
+        treeiter.user_data = rowid
+        return treeiter
+
+    # Gtk.TreeModel
+
+    def do_get_flags(self):
+        return Gtk.TreeModelFlags.LIST_ONLY
+
+    def do_get_n_columns(self):
+        return len(self.coltypes)
+
+    def do_get_column_type(self, column):
+        return self.coltypes[column]
+
+    def do_get_iter(self, path):
+        indices = path.get_indices()
+        if len(indices) == 1 and 0 <= indices[0] < len(self.order):
+            return True, self._iter(self.order[indices[0]])
+        return False, None
+
+    def do_get_path(self, treeiter):
+        position = self._position(treeiter.user_data)
+        if position is None:
+            return Gtk.TreePath()
+        return Gtk.TreePath.new_from_indices([position])
+
+    def do_get_value(self, treeiter, column):
+        return self.cell(treeiter.user_data, column)
+
+    def do_iter_next(self, treeiter):
+        position = self._position(treeiter.user_data)
+        if position is None or position + 1 >= len(self.order):
+            return False
+        treeiter.user_data = self.order[position + 1]
+        return True
+
+    def do_iter_previous(self, treeiter):
+        position = self._position(treeiter.user_data)
+        if not position:
+            return False
+        treeiter.user_data = self.order[position - 1]
+        return True
+
+    def do_iter_children(self, parent):
+        if parent is None and self.order:
+            return True, self._iter(self.order[0])
+        return False, None
+
+    def do_iter_has_child(self, treeiter):
+        return False
+
+    def do_iter_n_children(self, treeiter):
+        if treeiter is None:
+            return len(self.order)
+        return 0
+
+    def do_iter_nth_child(self, parent, num):
+        if parent is None and 0 <= num < len(self.order):
+            return True, self._iter(self.order[num])
+        return False, None
+
+    def do_iter_parent(self, child):
+        return False, None
+
+    # Gtk.TreeSortable, clicking a column header sorts on its sort_column_id
+
+    def do_get_sort_column_id(self):
+        return True, self.sortcol, self.sortorder
+
+    def do_set_sort_column_id(self, column, order):
+        if column < 0:
+            column = self.name_col
+        if (column, order) == (self.sortcol, self.sortorder):
+            return
+        self.sortcol = column
+        self.sortorder = order
+        self.sort_column_changed()
+        self._queue_flush()
+
+    def do_set_sort_func(self, column, sort_func, *data):
+        pass
+
+    def do_set_default_sort_func(self, sort_func, *data):
+        pass
+
+    def do_has_default_sort_func(self):
+        return False
@@ -0,0 +1,215 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Field qualified search over the raw unit properties, e.g.
+
+    state:failed type:oneshot path:/etc/* next<1h
+
+Terms are joined with and, a leading - negates a term. field:value and
+field=value compare without case, with * ? [] globs, and match any item of
+a list property. <, <=, > and >= compare numbers, time spans like 1h30m
+against USec properties, and against the distance from now for points in
+time like next and last. Words without a field search the row text as before.
+"""
+
+import fnmatch
+import operator
+import re
+import time
+
+
+# short names for the properties, any property can also be used by its name
+FIELDS = {"name": "Name",
+          "desc": "Description",
+          "description": "Description",
+          "load": "Load",
+          "state": "State",
+          "active": "State",
+          "sub": "Substate",
+          "substate": "Substate",
+          "file": "UnitFileState",
+          "enabled": "UnitFileState",
+          "type": "Type",
+          "path": "FragmentPath",
+          "pid": "MainPID",
+          "result": "Result",
+          "unit": "Unit",
+          "triggers": "Triggers",
+          "listen": "Listen",
+          "accepted": "NAccept",
+          "connections": "NConnections",
+          "calendar": "TimersCalendar",
+          "next": "NextElapseUSecRealtime",
+          "last": "LastTriggerUSec"}
+
+# properties with few distinct values, worth an index of the units per value
+INDEXED_FIELDS = frozenset(["Load", "State", "Substate", "UnitFileState", "Type", "Result"])
+
+# USec properties that are points in wall clock time rather than durations
+TIME_POINTS = frozenset(["LastTriggerUSec"])
+
+SPAN_UNITS = {"us": 1, "ms": 1000, "s": 1000000, "sec": 1000000, "m": 60000000, "min": 60000000,
+              "h": 3600000000, "d": 86400000000, "w": 604800000000}
+
+COMPARISONS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+# -1 as uint64, systemd's value for unset numbers and times
+UNSET = 0xFFFFFFFFFFFFFFFF
+
+_term_re = re.compile(r"^(-?)([A-Za-z][A-Za-z0-9]*)(:|<=|>=|<|>|=)(.*)$")
+_span_re = re.compile(r"(\d+(?:\.\d+)?)([a-z]*)")
+
+
+class QueryError(ValueError):
+    pass
+
+
+def parse_span(text):
+    """Time span like 90s, 1h30m or 2d in microseconds, a bare number is seconds"""
+    text = text.strip().lower()
+    total = 0
+    pos = 0
+    for match in _span_re.finditer(text):
+        if match.start() != pos:
+            break
+        unit = match.group(2) or "s"
+        if unit not in SPAN_UNITS:
+            raise QueryError(f"unknown time unit in {text!r}")
+        total += float(match.group(1)) * SPAN_UNITS[unit]
+        pos = match.end()
+    if not text or pos != len(text):
+        raise QueryError(f"not a time span: {text!r}")
+    return int(total)
+
+
+def field_prop(field):
+    """Property of a field name, None if it is neither a short name nor a property name"""
+    prop = FIELDS.get(field.lower())
+    if prop is None and field[0].isupper():
+        prop = field
+    return prop
+
+
+def is_time_point(prop):
+    return prop.endswith("Timestamp") or prop.endswith("USecRealtime") or prop in TIME_POINTS
+
+
+class Term:
+    """One condition of a query. prop is None for words matched against the row text"""
+    __slots__ = ("prop", "op", "value", "negate", "test")
+
+    def __init__(self, prop, op, value, negate=False, now_us=0):
+        self.prop = prop
+        self.op = op
+        self.value = value
+        self.negate = negate
+        if prop is None:
+            word = value.lower()
+            self.test = lambda text: word in text
+        elif op in COMPARISONS:
+            self.test = _compare_test(prop, COMPARISONS[op], value, now_us)
+        else:
+            self.test = _equal_test(value)
+
+    def matches(self, unit, text):
+        if self.prop is None:
+            found = self.test(text)
+        else:
+            found = self.test(unit.get(self.prop))
+        return found != self.negate
+
+
+def _equal_test(pattern):
+    lowered = pattern.lower()
+    glob = any(char in pattern for char in "*?[")
+    try:
+        number = int(pattern)
+    except ValueError:
+        number = None
+
+    def test(raw):
+        if isinstance(raw, str):
+            if glob:
+                return fnmatch.fnmatchcase(raw.lower(), lowered)
+            return raw.lower() == lowered
+        if isinstance(raw, bool):
+            return lowered in (("yes", "true", "1") if raw else ("no", "false", "0"))
+        if isinstance(raw, int):
+            return raw == number
+        if isinstance(raw, (list, tuple)):
+            return any(test(item) for item in raw)
+        return False
+    return test
+
+
+def _compare_test(prop, compare, value, now_us):
+    if is_time_point(prop):
+        limit = parse_span(value)
+
+        def test(raw):
+            # distance from now, in the past or the future
+            if not isinstance(raw, int) or raw in (0, UNSET):
+                return False
+            return compare(abs(raw - now_us), limit)
+        return test
+
+    if prop.endswith("USec"):
+        limit = parse_span(value)
+    else:
+        try:
+            limit = int(value)
+        except ValueError:
+            limit = None
+
+    def test(raw):
+        if isinstance(raw, bool):
+            return False
+        if isinstance(raw, int):
+            return limit is not None and raw != UNSET and compare(raw, limit)
+        if isinstance(raw, str):
+            return compare(raw.lower(), value.lower())
+        return False
+    return test
+
+
+class UnitQuery:
+    """A search text compiled once into terms, call matches(unit, text) per
+        unit with the unit's lowercase row text for the words without a field"""
+    def __init__(self, text, now=None):
+        self.text = text
+        now_us = int((time.time() if now is None else now) * 1000000)
+        self.terms = []
+        for word in text.split():
+            match = _term_re.match(word)
+            prop = field_prop(match.group(2)) if match else None
+            if prop is None:
+                self.terms.append(Term(None, None, word))
+                continue
+            negate, field, op, value = match.groups()
+            if not value:
+                raise QueryError(f"no value for {field}")
+            self.terms.append(Term(prop, op, value, bool(negate), now_us))
+
+    @property
+    def is_plain(self):
+        """True if the text has no fields, only words to find in the row text"""
+        return all(term.prop is None for term in self.terms)
+
+    def matches(self, unit, text):
+        for term in self.terms:
+            if not term.matches(unit, text):
+                return False
+        return True
+
+    def candidates(self, index):
+        """Names of the units that can match, from index(prop), a dict of the
+            units' names by their value of prop, for the indexed fields the
+            query requires. None when no term can use an index"""
+        names = None
+        for term in self.terms:
+            if term.negate or term.prop not in INDEXED_FIELDS or term.op in COMPARISONS:
+                continue
+            found = set()
+            for value, valuenames in index(term.prop).items():
+                if term.test(value):
+                    found |= valuenames
+            names = found if names is None else names & found
+        return names
@@ -0,0 +1,502 @@
+#!/usr/bin/python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Stand-in for the systemd Manager on a private bus, for tests and load.
+
+Serves synthetic units through the parts of org.freedesktop.systemd1 that
+DBusCaller uses: ListUnitsByPatterns, ListUnitsByNames, ListUnitFilesByPatterns,
+GetUnit, Properties GetAll and Get, unit Start, Stop, Restart and ResetFailed,
+unit file enable and disable, Reload and the Manager signals. Every reply can
+be delayed to mimic a busy systemd.
+
+    fakesystemd.py --services 1000 -- python3 tests/test_dbuscaller.py
+
+starts a private dbus-daemon, serves the units on it and runs the command
+with SERVICEMONITOR_BUS_ADDRESS pointing at it. Without a command the
+address is printed and the units are served until interrupted, with
+--address they are served on an existing bus.
+"""
+
+import argparse
+import fnmatch
+import os
+import subprocess
+import sys
+import time
+
+from gi.repository import Gio, GLib
+
+
+BUS_NAME = "org.freedesktop.systemd1"
+MGR_PATH = "/org/freedesktop/systemd1"
+UNIT_PATH_PREFIX = MGR_PATH + "/unit/"
+JOB_PATH_PREFIX = MGR_PATH + "/job/"
+IFACE_MGR = "org.freedesktop.systemd1.Manager"
+IFACE_UNIT = "org.freedesktop.systemd1.Unit"
+IFACE_PROPS = "org.freedesktop.DBus.Properties"
+IFACE_TYPES = {"service": "org.freedesktop.systemd1.Service",
+               "timer": "org.freedesktop.systemd1.Timer",
+               "socket": "org.freedesktop.systemd1.Socket"}
+BUS_ADDRESS_ENV = "SERVICEMONITOR_BUS_ADDRESS"
+
+ERROR_NO_UNIT = "org.freedesktop.systemd1.NoSuchUnit"
+ERROR_UNKNOWN_METHOD = "org.freedesktop.DBus.Error.UnknownMethod"
+ERROR_UNKNOWN_OBJECT = "org.freedesktop.DBus.Error.UnknownObject"
+ERROR_UNKNOWN_INTERFACE = "org.freedesktop.DBus.Error.UnknownInterface"
+ERROR_UNKNOWN_PROPERTY = "org.freedesktop.DBus.Error.UnknownProperty"
+
+# D-Bus signatures of the properties served for each interface
+UNIT_SIGNATURES = {
+    "Id": "s", "Names": "as", "Description": "s", "LoadState": "s", "ActiveState": "s", "SubState": "s",
+    "FreezerState": "s", "UnitFileState": "s", "UnitFilePreset": "s", "FragmentPath": "s", "SourcePath": "s",
+    "Following": "s", "Requires": "as", "Wants": "as", "Before": "as", "After": "as", "Triggers": "as",
+    "TriggeredBy": "as", "StateChangeTimestamp": "t", "ActiveEnterTimestamp": "t", "ActiveExitTimestamp": "t",
+    "InactiveEnterTimestamp": "t", "InactiveExitTimestamp": "t", "CanStart": "b", "CanStop": "b",
+    "CanReload": "b", "Job": "(uo)", "Transient": "b", "Perpetual": "b", "InvocationID": "ay",
+}
+TYPE_SIGNATURES = {
+    "service": {
+        "Type": "s", "Restart": "s", "PIDFile": "s", "NotifyAccess": "s", "RestartUSec": "t",
+        "TimeoutStartUSec": "t", "TimeoutStopUSec": "t", "WatchdogUSec": "t", "ExecStart": "a(sasbttttuii)",
+        "MainPID": "u", "ControlPID": "u", "Slice": "s", "ControlGroup": "s", "MemoryCurrent": "t",
+        "CPUUsageNSec": "t", "TasksCurrent": "t", "NRestarts": "u", "Result": "s", "User": "s", "Group": "s",
+        "RuntimeDirectoryMode": "u", "StatusText": "s",
+    },
+    "timer": {
+        "Unit": "s", "TimersMonotonic": "a(stt)", "TimersCalendar": "a(sst)", "OnClockChange": "b",
+        "OnTimezoneChange": "b", "NextElapseUSecRealtime": "t", "NextElapseUSecMonotonic": "t",
+        "LastTriggerUSec": "t", "LastTriggerUSecMonotonic": "t", "Result": "s", "AccuracyUSec": "t",
+        "RandomizedDelayUSec": "t", "Persistent": "b", "WakeSystem": "b", "RemainAfterElapse": "b",
+    },
+    "socket": {
+        "Listen": "a(ss)", "FileDescriptorName": "s", "Accept": "b", "Backlog": "u", "NAccept": "u",
+        "NConnections": "u", "NRefused": "u", "Result": "s", "Slice": "s", "ControlGroup": "s",
+        "SocketMode": "u", "DirectoryMode": "u", "MaxConnections": "u", "TriggerLimitBurst": "u",
+    },
+}
+
+# ActiveState and SubState of a running and a stopped unit of each type
+RUNNING_STATES = {"service": ("active", "running"), "timer": ("active", "waiting"),
+                  "socket": ("active", "listening")}
+STOPPED_STATES = {"service": ("inactive", "dead"), "timer": ("inactive", "dead"), "socket": ("inactive", "dead")}
+
+
+def unit_object_path(unitname):
+    """Escaped like sd_bus_path_encode, kept apart from DBusCaller on purpose"""
+    escaped = []
+    for num, c in enumerate(unitname):
+        if c.isascii() and (c.isalpha() or (c.isdigit() and num > 0)):
+            escaped.append(c)
+        else:
+            escaped.extend(f"_{b:02x}" for b in c.encode("utf-8"))
+    return UNIT_PATH_PREFIX + "".join(escaped)
+
+
+class FakeUnit:
+    def __init__(self, name, description, state, substate, filestate="enabled", now_usec=0):
+        self.name = name
+        self.unittype = name.rsplit('.', 1)[1]
+        self.path = unit_object_path(name)
+        stem = name.rsplit('.', 1)[0]
+        self.replies = {}
+        self.props = {
+            "Id": name, "Names": [name], "Description": description, "LoadState": "loaded",
+            "ActiveState": state, "SubState": substate, "FreezerState": "running", "UnitFileState": filestate,
+            "UnitFilePreset": "enabled", "FragmentPath": f"/usr/lib/systemd/system/{name}", "SourcePath": "",
+            "Following": "", "Requires": ["sysinit.target"], "Wants": [], "Before": ["multi-user.target"],
+            "After": ["basic.target"], "Triggers": [], "TriggeredBy": [], "StateChangeTimestamp": now_usec,
+            "ActiveEnterTimestamp": now_usec, "ActiveExitTimestamp": 0, "InactiveEnterTimestamp": 0,
+            "InactiveExitTimestamp": now_usec, "CanStart": True, "CanStop": True, "CanReload": False,
+            "Job": (0, "/"), "Transient": False, "Perpetual": False, "InvocationID": [],
+        }
+        running = state == "active"
+        pid = (sum(name.encode()) * 7) % 30000 + 100 if running else 0
+        if self.unittype == "service":
+            self.typeprops = {
+                "Type": "simple", "Restart": "on-failure", "PIDFile": "", "NotifyAccess": "none",
+                "RestartUSec": 100000, "TimeoutStartUSec": 90000000, "TimeoutStopUSec": 90000000,
+                "WatchdogUSec": 0, "ExecStart": [(f"/usr/bin/{stem}", [f"/usr/bin/{stem}", "--fake"], False,
+                                                  now_usec, 0, 0, 0, pid, 0, 0)],
+                "MainPID": pid, "ControlPID": 0, "Slice": "system.slice",
+                "ControlGroup": f"/system.slice/{name}" if running else "",
+                "MemoryCurrent": 2 ** 20 * (pid % 64) if running else 2 ** 64 - 1, "CPUUsageNSec": pid * 1000,
+                "TasksCurrent": 1 if running else 2 ** 64 - 1, "NRestarts": 0,
+                "Result": "exit-code" if state == "failed" else "success", "User": "", "Group": "",
+                "RuntimeDirectoryMode": 0o755, "StatusText": "",
+            }
+        elif self.unittype == "timer":
+            self.props["Triggers"] = [stem + ".service"]
+            self.typeprops = {
+                "Unit": stem + ".service", "TimersMonotonic": [], "TimersCalendar": [("OnCalendar", "daily", 0)],
+                "OnClockChange": False, "OnTimezoneChange": False,
+                "NextElapseUSecRealtime": now_usec + 3600 * 10 ** 6 if running else 0,
+                "NextElapseUSecMonotonic": 0, "LastTriggerUSec": now_usec - 82800 * 10 ** 6,
+                "LastTriggerUSecMonotonic": 0, "Result": "success", "AccuracyUSec": 60000000,
+                "RandomizedDelayUSec": 0, "Persistent": True, "WakeSystem": False, "RemainAfterElapse": True,
+            }
+        elif self.unittype == "socket":
+            self.props["Triggers"] = [stem + ".service"]
+            self.typeprops = {
+                "Listen": [("Stream", f"/run/{stem}.sock")], "FileDescriptorName": stem, "Accept": False,
+                "Backlog": 4096, "NAccept": pid % 50, "NConnections": 0, "NRefused": 0, "Result": "success",
+                "Slice": "system.slice", "ControlGroup": "", "SocketMode": 0o666, "DirectoryMode": 0o755,
+                "MaxConnections": 64, "TriggerLimitBurst": 200,
+            }
+        else:
+            self.typeprops = {}
+
+    def list_entry(self):
+        """Entry of a ListUnits reply, (ssssssouso)"""
+        job = self.props["Job"]
+        return (self.name, self.props["Description"], self.props["LoadState"], self.props["ActiveState"],
+                self.props["SubState"], self.props["Following"], self.path, job[0], "", job[1])
+
+    def getall_reply(self, iface):
+        """GetAll reply for an interface, built once until a property changes"""
+        reply = self.replies.get(iface)
+        if reply is None:
+            props, signatures = self.iface_props(iface)
+            if props is None:
+                return None
+            reply = GLib.Variant("(a{sv})", ({key: GLib.Variant(signatures[key], value)
+                                              for key, value in props.items()},))
+            self.replies[iface] = reply
+        return reply
+
+    def iface_props(self, iface):
+        if iface == IFACE_UNIT:
+            return self.props, UNIT_SIGNATURES
+        if iface == IFACE_TYPES.get(self.unittype):
+            return self.typeprops, TYPE_SIGNATURES[self.unittype]
+        return None, None
+
+    def set_state(self, state, substate):
+        self.props["ActiveState"] = state
+        self.props["SubState"] = substate
+        self.props["StateChangeTimestamp"] = int(time.time() * 10 ** 6)
+        self.replies.clear()
+
+
+def make_units(services=0, timers=0, sockets=0):
+    """Synthetic units with a spread of states, plus the cups units the
+        DBusCaller tests look for"""
+    now = int(time.time() * 10 ** 6)
+    units = [FakeUnit("cups.service", "CUPS Scheduler", "active", "running", now_usec=now),
+             FakeUnit("cups.socket", "CUPS Scheduler", "active", "running", now_usec=now),
+             FakeUnit("cups.path", "CUPS Scheduler", "active", "running", now_usec=now)]
+    for unittype, count in (("service", services), ("timer", timers), ("socket", sockets)):
+        for num in range(count):
+            # mostly running, some stopped and a few failed
+            if num % 10 == 9:
+                state, substate = "failed", "failed"
+            elif num % 4 == 3:
+                state, substate = STOPPED_STATES[unittype]
+            else:
+                state, substate = RUNNING_STATES[unittype]
+            filestate = "disabled" if num % 5 == 4 else "enabled"
+            units.append(FakeUnit(f"fake-{unittype}-{num:05d}.{unittype}", f"Fake {unittype} {num}",
+                                  state, substate, filestate, now))
+    return units
+
+
+class FakeSystemd:
+    """Answers systemd Manager and unit calls on a bus connection. Calls are
+        taken off the connection by a message filter, so any number of unit
+        objects is served without registering them one by one"""
+    JOB_RUN_MILLIS = 20
+
+    def __init__(self, connection, units, latency_ms=0):
+        self.connection = connection
+        self.units = {unit.name: unit for unit in units}
+        self.paths = {unit.path: unit for unit in units}
+        self.latency_ms = latency_ms
+        self.lastjob = 0
+        self.calls = 0
+        self.filterid = None
+
+    def start(self):
+        self.filterid = self.connection.add_filter(self.on_message, None)
+        reply = self.connection.call_sync("org.freedesktop.DBus", "/org/freedesktop/DBus", "org.freedesktop.DBus",
+                                          "RequestName", GLib.Variant("(su)", (BUS_NAME, 4)), None,
+                                          Gio.DBusCallFlags.NONE, -1, None)
+        # 1 is primary owner
+        return reply[0] == 1
+
+    def stop(self):
+        if self.filterid is not None:
+            self.connection.remove_filter(self.filterid)
+            self.filterid = None
+
+    def on_message(self, connection, message, incoming, data):
+        # runs in the GDBus worker thread, answer from the main loop
+        if not incoming or message.get_message_type() != Gio.DBusMessageType.METHOD_CALL:
+            return message
+        if self.latency_ms:
+            GLib.timeout_add(self.latency_ms, self.dispatch, message)
+        else:
+            GLib.idle_add(self.dispatch, message)
+        return None
+
+    def dispatch(self, message):
+        self.calls += 1
+        iface = message.get_interface()
+        method = message.get_member()
+        path = message.get_path()
+        body = message.get_body()
+        args = body.unpack() if body is not None else ()
+        try:
+            if path == MGR_PATH and iface == IFACE_MGR:
+                reply = self.call_manager(method, args)
+            elif iface == IFACE_PROPS:
+                reply = self.call_properties(path, method, args)
+            elif iface == IFACE_UNIT:
+                reply = self.call_unit(path, method, args)
+            elif iface == "org.freedesktop.DBus.Peer" and method == "Ping":
+                reply = None
+            else:
+                raise FakeError(ERROR_UNKNOWN_METHOD, f"Unknown method {iface}.{method}")
+        except FakeError as fe:
+            self.send(message.new_method_error_literal(fe.name, fe.message))
+            return False
+        response = message.new_method_reply()
+        if reply is not None:
+            response.set_body(reply)
+        self.send(response)
+        return False
+
+    def send(self, message):
+        try:
+            self.connection.send_message(message, Gio.DBusSendMessageFlags.NONE)
+        except GLib.GError as ge:
+            print("fakesystemd: could not send reply", ge.message, file=sys.stderr)
+
+    def emit(self, path, iface, signal, params):
+        self.connection.emit_signal(None, path, iface, signal, params)
+
+    def call_manager(self, method, args):
+        if method == "ListUnitsByPatterns":
+            states, patterns = args
+            units = [unit.list_entry() for unit in self.units.values() if self.matches(unit, states, patterns)]
+            return GLib.Variant("(a(ssssssouso))", (units,))
+        elif method == "ListUnitsByNames":
+            entries = []
+            for name in args[0]:
+                unit = self.units.get(name)
+                if unit:
+                    entries.append(unit.list_entry())
+                else:
+                    entries.append((name, "", "not-found", "inactive", "dead", "", unit_object_path(name), 0, "",
+                                    "/"))
+            return GLib.Variant("(a(ssssssouso))", (entries,))
+        elif method == "ListUnitFilesByPatterns":
+            states, patterns = args
+            files = [(unit.props["FragmentPath"], unit.props["UnitFileState"]) for unit in self.units.values()
+                     if unit.props["FragmentPath"] and (not states or unit.props["UnitFileState"] in states)
+                     and self.matches(unit, [], patterns)]
+            return GLib.Variant("(a(ss))", (files,))
+        elif method in ("GetUnit", "LoadUnit"):
+            unit = self.get_unit(args[0])
+            return GLib.Variant("(o)", (unit.path,))
+        elif method in ("Subscribe", "Unsubscribe"):
+            return None
+        elif method == "Reload":
+            self.emit(MGR_PATH, IFACE_MGR, "Reloading", GLib.Variant("(b)", (True,)))
+            self.emit(MGR_PATH, IFACE_MGR, "Reloading", GLib.Variant("(b)", (False,)))
+            return None
+        elif method == "EnableUnitFiles":
+            changes = self.set_file_state(args[0], "enabled")
+            return GLib.Variant("(ba(sss))", (False, changes))
+        elif method == "DisableUnitFiles":
+            changes = self.set_file_state(args[0], "disabled")
+            return GLib.Variant("(a(sss))", (changes,))
+        raise FakeError(ERROR_UNKNOWN_METHOD, f"Unknown method {method}")
+
+    def call_properties(self, path, method, args):
+        unit = self.paths.get(path)
+        if unit is None:
+            raise FakeError(ERROR_UNKNOWN_OBJECT, f"Unknown object '{path}'")
+        props, signatures = unit.iface_props(args[0])
+        if props is None:
+            raise FakeError(ERROR_UNKNOWN_INTERFACE, f"Unknown interface '{args[0]}'")
+        if method == "GetAll":
+            return unit.getall_reply(args[0])
+        elif method == "Get":
+            if args[1] not in props:
+                raise FakeError(ERROR_UNKNOWN_PROPERTY, f"Unknown property '{args[1]}'")
+            return GLib.Variant("(v)", (GLib.Variant(signatures[args[1]], props[args[1]]),))
+        raise FakeError(ERROR_UNKNOWN_METHOD, f"Unknown method {method}")
+
+    def call_unit(self, path, method, args):
+        unit = self.paths.get(path)
+        if unit is None:
+            raise FakeError(ERROR_UNKNOWN_OBJECT, f"Unknown object '{path}'")
+        if method in ("Start", "Stop", "Restart"):
+            self.lastjob += 1
+            jobpath = f"{JOB_PATH_PREFIX}{self.lastjob}"
+            GLib.timeout_add(self.JOB_RUN_MILLIS, self.run_job, unit, method, self.lastjob, jobpath)
+            return GLib.Variant("(o)", (jobpath,))
+        elif method == "ResetFailed":
+            if unit.props["ActiveState"] == "failed":
+                self.change_state(unit, *STOPPED_STATES.get(unit.unittype, ("inactive", "dead")))
+            return None
+        raise FakeError(ERROR_UNKNOWN_METHOD, f"Unknown method {method}")
+
+    def run_job(self, unit, method, jobid, jobpath):
+        if method == "Stop":
+            state = STOPPED_STATES.get(unit.unittype, ("inactive", "dead"))
+        else:
+            state = RUNNING_STATES.get(unit.unittype, ("active", "running"))
+        self.change_state(unit, *state)
+        self.emit(MGR_PATH, IFACE_MGR, "JobRemoved", GLib.Variant("(uoss)", (jobid, jobpath, unit.name, "done")))
+        return False
+
+    def change_state(self, unit, state, substate):
+        unit.set_state(state, substate)
+        changed = {"ActiveState": GLib.Variant("s", state), "SubState": GLib.Variant("s", substate)}
+        self.emit(unit.path, IFACE_PROPS, "PropertiesChanged",
+                  GLib.Variant("(sa{sv}as)", (IFACE_UNIT, changed, [])))
+
+    def set_file_state(self, names, filestate):
+        changes = []
+        for name in names:
+            unit = self.get_unit(name)
+            unit.props["UnitFileState"] = filestate
+            unit.replies.clear()
+            link = f"/etc/systemd/system/multi-user.target.wants/{name}"
+            if filestate == "enabled":
+                changes.append(("symlink", link, unit.props["FragmentPath"]))
+            else:
+                changes.append(("unlink", link, ""))
+        self.emit(MGR_PATH, IFACE_MGR, "UnitFilesChanged", None)
+        return changes
+
+    def get_unit(self, name):
+        unit = self.units.get(name)
+        if unit is None:
+            raise FakeError(ERROR_NO_UNIT, f"Unit {name} not loaded.")
+        return unit
+
+    # public so tests can change units behind the caller's back
+    def add_unit(self, unit):
+        self.units[unit.name] = unit
+        self.paths[unit.path] = unit
+        self.emit(MGR_PATH, IFACE_MGR, "UnitNew", GLib.Variant("(so)", (unit.name, unit.path)))
+
+    def remove_unit(self, name):
+        unit = self.units.pop(name)
+        del self.paths[unit.path]
+        self.emit(MGR_PATH, IFACE_MGR, "UnitRemoved", GLib.Variant("(so)", (unit.name, unit.path)))
+
+    @staticmethod
+    def matches(unit, states, patterns):
+        if states and not any(state in states for state in (unit.props["LoadState"], unit.props["ActiveState"],
+                                                             unit.props["SubState"])):
+            return False
+        if patterns and not any(fnmatch.fnmatchcase(unit.name, pattern) for pattern in patterns):
+            return False
+        return True
+
+
+class FakeError(Exception):
+    def __init__(self, name, message):
+        super().__init__(message)
+        self.name = name
+        self.message = message
+
+
+class FakeSystemdProcess:
+    """Runs the stand-in in a child process on its own private bus, for
+        callers that block on the bus, like the synchronous DBusCaller calls.
+        Use as a context manager, it gives the bus address"""
+    def __init__(self, services=0, timers=0, sockets=0, latency_ms=0):
+        self.args = ["--services", str(services), "--timers", str(timers), "--sockets", str(sockets),
+                     "--latency", str(latency_ms)]
+        self.testbus = None
+        self.proc = None
+
+    def __enter__(self):
+        self.testbus = Gio.TestDBus.new(Gio.TestDBusFlags.NONE)
+        self.testbus.up()
+        address = self.testbus.get_bus_address()
+        self.proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--address", address] + self.args,
+                                     stdout=subprocess.PIPE, text=True)
+        # the address is printed once the name is owned
+        if not self.proc.stdout.readline().startswith(BUS_ADDRESS_ENV):
+            self.__exit__(None, None, None)
+            raise RuntimeError("fakesystemd did not start")
+        return address
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.proc:
+            self.proc.terminate()
+            self.proc.wait()
+            self.proc.stdout.close()
+            self.proc = None
+        if self.testbus:
+            self.testbus.down()
+            self.testbus = None
+        return False
+
+
+def serve(address, units, latency_ms, command=None):
+    """Serve the units on the bus at address until interrupted, or until
+        command exits if one is given. Returns the exit code"""
+    flags = Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION
+    connection = Gio.DBusConnection.new_for_address_sync(address, flags, None, None)
+    fake = FakeSystemd(connection, units, latency_ms)
+    if not fake.start():
+        print("fakesystemd: could not own", BUS_NAME, file=sys.stderr)
+        return 1
+
+    loop = GLib.MainLoop()
+    result = {"code": 0}
+    if command:
+        env = dict(os.environ)
+        env[BUS_ADDRESS_ENV] = address
+        child = subprocess.Popen(command, env=env)
+
+        def on_child_exit(pid, status):
+            # GLib reaps the child, take its status from here
+            result["code"] = os.waitstatus_to_exitcode(status)
+            loop.quit()
+
+        GLib.child_watch_add(GLib.PRIORITY_DEFAULT, child.pid, on_child_exit)
+    else:
+        print(f"{BUS_ADDRESS_ENV}={address}", flush=True)
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, 2, loop.quit)
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, 15, loop.quit)
+    loop.run()
+    fake.stop()
+    connection.close_sync(None)
+    return result["code"]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Stand-in systemd Manager on a private bus")
+    parser.add_argument("--services", type=int, default=50, help="number of synthetic services (default: 50)")
+    parser.add_argument("--timers", type=int, default=10, help="number of synthetic timers (default: 10)")
+    parser.add_argument("--sockets", type=int, default=10, help="number of synthetic sockets (default: 10)")
+    parser.add_argument("--latency", type=int, default=0, help="delay every reply by this many ms")
+    parser.add_argument("--address", help="serve on this bus instead of starting a private one")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="run this command against the fake, after --")
+    args = parser.parse_args(argv)
+    if args.command and args.command[0] == "--":
+        args.command = args.command[1:]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    units = make_units(args.services, args.timers, args.sockets)
+    if args.address:
+        return serve(args.address, units, args.latency, args.command)
+
+    testbus = Gio.TestDBus.new(Gio.TestDBusFlags.NONE)
+    testbus.up()
+    try:
+        return serve(testbus.get_bus_address(), units, args.latency, args.command)
+    finally:
+        testbus.down()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+from src.bulkaction import BulkScheduler
+
+
+class BulkSchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.started = []
+        self.pending = []
+        self.maxrunning = 0
+        self.completed = None
+
+    def run_later(self, name, action, finish):
+        self.started.append(name)
+        self.pending.append((name, finish))
+        self.maxrunning = max(self.maxrunning, len(self.pending))
+
+    def run_now(self, name, action, finish):
+        self.started.append(name)
+        finish(name, "failed" if name.startswith("bad") else "done", action)
+
+    def on_done(self, scheduler):
+        self.completed = scheduler
+
+    def test_bounded_concurrency(self):
+        names = [f"unit{i}.service" for i in range(10)]
+        scheduler = BulkScheduler("Restart", self.run_later, self.on_done, max_running=3)
+        scheduler.start(names)
+        self.assertEqual(len(self.pending), 3)
+        while self.pending:
+            name, finish = self.pending.pop(0)
+            finish(name, "done", "")
+        self.assertEqual(self.maxrunning, 3)
+        self.assertEqual(self.started, names)
+        self.assertIs(self.completed, scheduler)
+        self.assertEqual(len(scheduler.succeeded()), 10)
+        self.assertEqual(scheduler.failed(), {})
+        self.assertGreaterEqual(scheduler.elapsed(), 0)
+
+    def test_synchronous_results(self):
+        unitdone = []
+        names = ["good1.service", "bad1.service", "good2.service", "good1.service"]
+        scheduler = BulkScheduler("Start", self.run_now, self.on_done,
+                                  lambda s, name: unitdone.append(name), max_running=1)
+        scheduler.start(names)
+        self.assertIs(self.completed, scheduler)
+        self.assertEqual(unitdone, ["good1.service", "bad1.service", "good2.service"])
+        self.assertEqual(sorted(scheduler.succeeded()), ["good1.service", "good2.service"])
+        self.assertEqual(scheduler.failed(), {"bad1.service": ("failed", "Start")})
+
+    def test_empty(self):
+        scheduler = BulkScheduler("Stop", self.run_later, self.on_done)
+        scheduler.start([])
+        self.assertIs(self.completed, scheduler)
+        self.assertEqual(scheduler.results, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
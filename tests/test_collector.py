@@ -0,0 +1,220 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from gi.repository import GLib
+
+from src.collector import (Collector, CollectorClient, RingOverrun, SnapshotRing, decode_record, encode_record,
+                           record_unit, unit_record)
+from src.dbuscaller import DBusCaller
+from src.unit import Unit
+
+
+def make_ring(capacity):
+    """A reader and a writer on the same ring file"""
+    fd, path = tempfile.mkstemp(suffix=".ring")
+    try:
+        reader = SnapshotRing(fd, capacity, create=True)
+    finally:
+        os.close(fd)
+    writer = SnapshotRing.open(path)
+    os.unlink(path)
+    return reader, writer
+
+
+class SnapshotRingTestCase(unittest.TestCase):
+
+    def test_write_read(self):
+        reader, writer = make_ring(256)
+        self.assertEqual(reader.read(), [])
+        payloads = [bytes([num]) * (num * 7 % 90 + 1) for num in range(40)]
+        received = []
+        for payload in payloads:
+            if not writer.write(payload):
+                # full until the reader catches up
+                received += reader.read()
+                self.assertTrue(writer.write(payload))
+        received += reader.read()
+        self.assertEqual(received, payloads)
+        self.assertGreater(writer.position, writer.capacity)
+        with self.assertRaises(ValueError):
+            writer.write(b"x" * 130)
+
+    def test_overrun(self):
+        reader, writer = make_ring(128)
+        writer.write(b"a" * 60)
+        # a writer that ignores the reader's position laps it
+        writer.HEAD.pack_into(writer.map, writer.TAIL_OFFSET, writer.position)
+        writer.write(b"b" * 60)
+        writer.HEAD.pack_into(writer.map, writer.TAIL_OFFSET, writer.position)
+        writer.write(b"c" * 60)
+        with self.assertRaises(RingOverrun):
+            reader.read()
+        self.assertEqual(reader.read(), [])
+        writer.write(b"d")
+        self.assertEqual(reader.read(), [b"d"])
+
+    def test_records(self):
+        unit = Unit("cups.socket", "/org/freedesktop/systemd1/unit/cups_2esocket", "CUPS", "loaded", "active",
+                    "running")
+        unit.update({"Listen": [("Stream", "/run/cups/cups.sock")], "NAccept": 3, "Triggers": ["cups.service"]})
+        record = unit_record(unit, ["Listen", "NAccept", "Triggers", "Result"])
+        version, unittype, kind, data = decode_record(encode_record(7, "socket", "units", [record]))
+        self.assertEqual((version, unittype, kind), (7, "socket", "units"))
+        copy = record_unit(data[0])
+        self.assertEqual(dict(copy), dict(unit))
+        self.assertIsInstance(copy["Listen"][0], tuple)
+        self.assertNotIn("Result", copy)
+
+
+class LocalClient(CollectorClient):
+    """Hands the commands straight to a collector in this process"""
+    def __init__(self, collector, ring, update_cb):
+        super().__init__([], update_cb)
+        self.collector = collector
+        self.ring = ring
+
+    def send(self, command):
+        self.collector.handle(json.dumps(command).encode())
+        return True
+
+
+class Announcements(io.StringIO):
+    """Drains the client on every line the collector writes"""
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+        self.client = None
+
+    def write(self, text):
+        if self.client and "head" in json.loads(text):
+            GLib.idle_add(self.client.drain)
+        return super().write(text)
+
+
+class CollectorTestCase(unittest.TestCase):
+
+    dc = DBusCaller()
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dc.init_dbus()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dc.close_dbus()
+
+    def setUp(self):
+        self.loop = GLib.MainLoop()
+        self.updates = []
+        # too small for a full snapshot, so it goes through in turns
+        reader, writer = make_ring(4096)
+        self.out = Announcements(self.loop)
+        self.collector = Collector(self.dc, writer, None, self.out)
+        self.client = LocalClient(self.collector, reader, self.on_update)
+        self.out.client = self.client
+
+    def on_update(self, unittype, update):
+        self.updates.append((unittype, update))
+        self.loop.quit()
+
+    def test_snapshot_then_deltas(self):
+        expected = {unit['Name']: unit for unit in self.dc.list_details(['active'], ['*.service'], ['Type'])}
+        self.client.watch("service", ['active'], ['*.service'], ['Type'])
+        self.loop.run()
+        unittype, update = self.updates[-1]
+        self.assertEqual(unittype, "service")
+        self.assertTrue(update["full"])
+        self.assertEqual({unit['Name'] for unit in update["units"]}, set(expected))
+        for unit in update["units"]:
+            self.assertEqual(unit['Type'], expected[unit['Name']]['Type'])
+        self.assertEqual(self.collector.backlog, [])
+
+        # nothing changed, nothing to apply
+        self.client.watch("service", ['active'], ['*.service'], ['Type'])
+        self.loop.run()
+        unittype, update = self.updates[-1]
+        self.assertFalse(update["full"])
+        self.assertEqual(update["units"], [])
+
+        # a unit that changed comes alone
+        tab = self.collector.tabs["service"]
+        name = next(iter(tab["records"]))
+        record = tab["records"][name]
+        tab["records"][name] = record[:6] + ({"Type": "forking"},)
+        self.client.refresh("service", [name])
+        self.loop.run()
+        unittype, update = self.updates[-1]
+        self.assertEqual([unit['Name'] for unit in update["units"]], [name])
+        self.assertEqual(update["units"][0]['Type'], expected[name]['Type'])
+
+    def test_resync(self):
+        self.client.watch("service", ['active'], ['*.service'], ['Type'])
+        self.loop.run()
+        count = len(self.updates[-1][1]["units"])
+        self.client._resync()
+        self.loop.run()
+        unittype, update = self.updates[-1]
+        self.assertTrue(update["full"])
+        self.assertEqual(len(update["units"]), count)
+
+    def test_partial_refresh(self):
+        self.client.watch("service", ['active'], ['*.service'], ['Type'])
+        self.loop.run()
+        tab = self.collector.tabs["service"]
+        name = next(iter(tab["records"]))
+        self.collector.refresh_units(tab, [name])
+        partial = tab["partials"][-1]
+        serial = tab["serial"]
+        # a full refresh cancels it, and a reply that comes anyway is dropped
+        self.collector.refresh(tab)
+        self.assertTrue(partial.cancelled)
+        version = self.collector.version
+        self.collector.on_units_details([], (tab, {"serial": serial, "names": [name], "fetch": partial}))
+        self.assertEqual(self.collector.version, version)
+        self.loop.run()
+
+        # without an answer the records are kept and asked for again
+        self.collector.refresh_units(tab, [name])
+        partial = tab["partials"][-1]
+        partial.cancel()
+        partial.list_error = GLib.Error("timed out")
+        self.collector.on_units_details([], (tab, {"serial": tab["serial"], "names": [name], "fetch": partial}))
+        self.assertIn(name, tab["records"])
+        self.assertEqual(tab["stale_names"], {name})
+        self.loop.run()
+        unittype, update = self.updates[-1]
+        self.assertEqual(update["error"], "timed out")
+        self.assertEqual(update["stale"], [name])
+
+    def test_gap_with_backlog(self):
+        self.client.watch("service", ['active'], ['*.service'], ['Type'])
+        self.loop.run()
+        count = len(self.updates[-1][1]["units"])
+        # fill the ring and the backlog while the window doesn't read
+        self.out.client = None
+        self.collector.resync("service")
+        self.collector.resync("service")
+        self.assertTrue(self.collector.backlog)
+        self.out.client = self.client
+        # then lose a record
+        self.client.version -= 1
+        self.updates = []
+        self.client.drain()
+        context = self.loop.get_context()
+        for num in range(1000):
+            if not self.collector.backlog and not context.pending():
+                break
+            context.iteration(False)
+        self.assertEqual(self.collector.backlog, [])
+        fulls = [update for unittype, update in self.updates if update["full"]]
+        self.assertTrue(fulls)
+        self.assertEqual(len(fulls[-1]["units"]), count)
+
+
+if __name__ == '__main__':
+    unittest.main()
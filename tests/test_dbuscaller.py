@@ -3,8 +3,10 @@
 import time
 import unittest
 
+from gi.repository import GLib
+
 from src.unit import Unit
-from src.dbuscaller import DBusCaller
+from src.dbuscaller import DBusCaller, PropsView
 
 
 class DBusCallerStateTestCase(unittest.TestCase):
@@ -74,6 +76,50 @@ class DBusCallerStateTestCase(unittest.TestCase):
         self.assertRegex(self.dc.getunitpath('cups.service'), "/.*/cups_2eservice")
         self.assertIsNone(self.dc.getunitpath('badvalue.service'))
 
+    def test_unit_object_path(self):
+        self.assertEqual(DBusCaller.unit_object_path("cups.service"), "/org/freedesktop/systemd1/unit/cups_2eservice")
+        self.assertEqual(DBusCaller.unit_object_path("getty@tty1.service"),
+                         "/org/freedesktop/systemd1/unit/getty_40tty1_2eservice")
+        self.assertEqual(DBusCaller.unit_object_path("1.service"), "/org/freedesktop/systemd1/unit/_31_2eservice")
+        self.assertEqual(DBusCaller.unit_object_path("cups.service"), self.dc.getunitpath("cups.service"))
+
+    def test_prop_cache(self):
+        self.dc.clear_cache()
+        path = self.dc.getunitpath('cups.service')
+        before = self.dc.cache_stats()
+        first = self.dc.getprops(path, 'service')
+        second = self.dc.getprops(path, 'service')
+        after = self.dc.cache_stats()
+        self.assertEqual(first, second)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+        self.dc.invalidate_for_signal("JobRemoved", (1, "/org/freedesktop/systemd1/job/1", "cups.service", "done"))
+        self.dc.getprops(path, 'service')
+        self.assertEqual(self.dc.cache_stats()['misses'] - after['misses'], 1)
+
+        self.dc.invalidate_for_signal("Reloading", (True,))
+        self.assertEqual(self.dc.cache_stats()['size'], 0)
+
+    def test_props_view(self):
+        self.dc.clear_cache()
+        path = self.dc.getunitpath('cups.service')
+        view = self.dc.getprops_view(path, 'service')
+        self.assertIsInstance(view, PropsView)
+        self.assertEqual(view.values, {})
+        props = self.dc.getprops(path, 'service')
+        self.assertEqual(len(view), len(props))
+        self.assertEqual(set(view), set(props))
+        self.assertIn("Type", view)
+        self.assertNotIn("NoSuchProperty", view)
+        self.assertEqual(view["Type"], props["Type"])
+        self.assertEqual(list(view.values), ["Type"])
+        self.assertIsNone(view.get("NoSuchProperty"))
+
+        view.update({"Type": "oneshot"})
+        self.assertEqual(view["Type"], "oneshot")
+        self.assertEqual(self.dc.getprops(path, 'service')["Type"], "oneshot")
+
     def test_unitprops(self):
         badresults = self.dc.getprops(None)
         self.assertIsInstance(badresults, dict)
@@ -121,6 +167,127 @@ class DBusCallerStateTestCase(unittest.TestCase):
         for key in service_details:
             self.assertIn(key, svcwithdetails)
 
+    def test_list_details_async(self):
+        service_details = ['UnitFileState', 'Type', 'FragmentPath', 'MainPID']
+        syncresult = self.dc.list_details(None, ['*.service'], service_details)
+
+        loop = GLib.MainLoop()
+        received = {}
+
+        def on_done(units, data):
+            received['units'] = units
+            received['data'] = data
+            loop.quit()
+
+        fetch = self.dc.list_details_async(None, ['*.service'], service_details, on_done, "userdata", 4)
+        self.assertIsNotNone(fetch)
+        loop.run()
+        self.assertEqual(received['data'], "userdata")
+        self.assertEqual(len(received['units']), len(syncresult))
+        self.assertLessEqual(fetch.inflight, 0)
+        for unit in received['units']:
+            self.assertIsInstance(unit, Unit)
+            for key in service_details:
+                self.assertIn(key, unit)
+
+    def test_fetch_plan(self):
+        iface_service = self.dc.iface_for_type("service")
+        plan = self.dc.fetch_plan("service", ['UnitFileState', 'Type', 'FragmentPath', 'MainPID'])
+        self.assertEqual(len(plan), 2)
+        self.assertTrue(all(getall for iface, props, getall in plan))
+        self.assertEqual(self.dc.fetch_plan("service", ['FragmentPath']),
+                         [(self.dc.iface_unit, ['FragmentPath'], False)])
+        self.assertEqual(self.dc.fetch_plan("service", ['Type']), [(iface_service, ['Type'], False)])
+        self.assertEqual(self.dc.fetch_plan("service", []), [])
+
+        # one Get per unit when a single column is shown
+        self.dc.clear_cache()
+        calls = self.dc.calls
+        units = self.dc.list_details(None, ['*.service'], ['FragmentPath'])
+        self.assertGreater(len(units), 1)
+        self.assertLessEqual(self.dc.calls - calls, len(units) + 1)
+        self.dc.clear_cache()
+        full = {unit['Name']: unit for unit in self.dc.list_details(None, ['*.service'], ['Type', 'FragmentPath'])}
+
+        loop = GLib.MainLoop()
+        received = {}
+
+        def on_done(units, data):
+            received['units'] = units
+            loop.quit()
+
+        self.dc.clear_cache()
+        self.dc.list_details_async(None, ['*.service'], ['FragmentPath'], on_done)
+        loop.run()
+        for unit in received['units']:
+            self.assertEqual(unit['FragmentPath'], full[unit['Name']]['FragmentPath'])
+            self.assertNotIn('Type', unit)
+
+    def test_unit_file_states(self):
+        filestates = self.dc.list_unit_files(['*.service'])
+        self.assertEqual(filestates['cups.service'], "enabled")
+        self.assertNotIn('cups.socket', filestates)
+
+        # one list call for the file states instead of a call per unit
+        self.dc.clear_cache()
+        calls = self.dc.calls
+        units = self.dc.list_details(None, ['*.service'], ['UnitFileState'])
+        self.assertEqual(self.dc.calls - calls, 2)
+        for unit in units:
+            self.assertEqual(unit['UnitFileState'], filestates[unit['Name']])
+
+        loop = GLib.MainLoop()
+        received = {}
+
+        def on_done(units, data):
+            received['units'] = units
+            loop.quit()
+
+        self.dc.unit_list_details_async(['cups.service', 'cups.socket'], ['UnitFileState', 'FragmentPath'], on_done)
+        loop.run()
+        self.assertEqual(len(received['units']), 2)
+        for unit in received['units']:
+            self.assertEqual(unit['UnitFileState'], "enabled")
+            self.assertIn('FragmentPath', unit)
+
+    def test_cancel_fetch(self):
+        loop = GLib.MainLoop()
+        received = []
+        fetch = self.dc.list_details_async(None, ['*.service'], ['Type'], lambda units, data: received.append(units))
+        fetch.cancel()
+        GLib.timeout_add(200, loop.quit)
+        loop.run()
+        self.assertEqual(received, [])
+        self.assertTrue(fetch.cancellable.is_cancelled())
+
+        # a deadline before the units are listed gives up the list
+        fetch = self.dc.list_details_async(None, ['*.service'], ['Type'], lambda units, data: loop.quit())
+        fetch._on_deadline()
+        loop.run()
+        self.assertIsNotNone(fetch.list_error)
+        self.assertEqual(fetch.units, [])
+
+    def test_fetch_deadline(self):
+        loop = GLib.MainLoop()
+        received = {}
+
+        def on_unit(unit, data):
+            received[unit['Name']] = unit
+            # give up on the rest once the first unit is in
+            if len(received) == 1:
+                fetch._on_deadline()
+
+        self.dc.clear_cache()
+        fetch = self.dc.list_details_async(None, ['*.service'], ['Type', 'MainPID', 'Slice'],
+                                           lambda units, data: loop.quit(), max_inflight=1, unit_cb=on_unit,
+                                           deadline_millis=60000)
+        loop.run()
+        self.assertGreater(len(received), 1)
+        self.assertEqual(len(fetch.stale), len(received) - 1)
+        for name, unit in received.items():
+            self.assertEqual('Type' in unit, name not in fetch.stale)
+        self.assertEqual(fetch.deadline_source, 0)
+
     def test_unit_details(self):
         badresult = self.dc.unit_details(None)
         self.assertIsNone(badresult)
@@ -157,6 +324,63 @@ class DBusCallerStateTestCase(unittest.TestCase):
 
         self.assertTrue(self.dc.unsubscribe_signals())
 
+    def test_uncached_counters(self):
+        path = self.dc.getunitpath("cups.socket")
+        iface = self.dc.iface_for_type("socket")
+        self.assertTrue(self.dc.fetch_props(path, iface, ["NAccept"], False))
+        self.assertTrue(self.dc.fetch_props(path, iface, ["Listen"], False))
+        # counters change without a signal, they are never answered from the cache
+        self.assertIsNone(self.dc.cached_props(path, iface, ["NAccept"]))
+        self.assertIsNotNone(self.dc.cached_props(path, iface, ["Listen"]))
+        before = self.dc.calls
+        self.assertIn("NAccept", self.dc.getprops(path, "socket", cached=False))
+        self.assertEqual(self.dc.calls - before, 1)
+
+    def test_subscribe_properties(self):
+        # unit property signals are only asked for while a tab watches units
+        self.assertTrue(self.dc.subscribe_signals(None))
+        self.assertIsNone(self.dc.propsubs)
+        path = self.dc.getunitpath("cups.service")
+        self.assertTrue(self.dc.subscribe_properties([path], None))
+        self.assertTrue(self.dc.propsubs)
+        self.assertEqual(self.dc.watched_paths, {path})
+        self.assertTrue(self.dc.unsubscribe_properties())
+        self.assertIsNone(self.dc.propsubs)
+        self.assertTrue(self.dc.unsubscribe_signals())
+
+    def test_dirty_units(self):
+        self.assertTrue(self.dc.subscribe_signals(self.signal_callback))
+        self.dc.take_dirty()
+        self.signalreceived = False
+
+        self.dc.process_signal("JobRemoved", (10, "/org/freedesktop/systemd1/job/10", "home.mount", "done"))
+        self.dc.process_signal("UnitNew", ("session-2.scope", "/org/freedesktop/systemd1/unit/session_2d2_2escope"))
+        self.assertFalse(self.signalreceived)
+        self.assertEqual(self.dc.take_dirty(), (False, set()))
+
+        self.dc.process_signal("JobRemoved", (11, "/org/freedesktop/systemd1/job/11", "cups.service", "done"))
+        self.dc.process_signal("UnitRemoved", ("cups.socket", "/org/freedesktop/systemd1/unit/cups_2esocket"))
+        self.dc.process_signal("JobRemoved", (12, "/org/freedesktop/systemd1/job/12", "cups.service", "done"))
+        self.assertTrue(self.signalreceived)
+        self.assertEqual(self.dc.take_dirty(), (False, {"cups.service", "cups.socket"}))
+        self.assertEqual(self.dc.take_dirty(), (False, set()))
+
+        self.dc.process_signal("UnitFilesChanged", ())
+        dirty_all, names = self.dc.take_dirty()
+        self.assertTrue(dirty_all)
+
+        units = self.dc.list_units_by_names(["cups.service", "cups.socket"])
+        self.assertEqual(len(units), 2)
+        self.assertIsInstance(units[0], Unit)
+        self.assertTrue(self.dc.unsubscribe_signals())
+
+        # only following jobs, nothing takes dirty units so none are kept
+        self.assertTrue(self.dc.subscribe_signals(None, jobs_only=True))
+        self.dc.process_signal("JobRemoved", (13, "/org/freedesktop/systemd1/job/13", "cups.service", "done"))
+        self.dc.mark_dirty("cups.socket")
+        self.assertEqual(self.dc.take_dirty(), (False, set()))
+        self.assertTrue(self.dc.unsubscribe_signals())
+
     def signal_callback(self):
         self.signalreceived = True
 
@@ -166,6 +390,18 @@ class DBusCallerStateTestCase(unittest.TestCase):
         self.assertFalse(self.dc.unit_method("cups.service", "Kill"))
         self.assertFalse(self.dc.unit_method("cups.service", "RestartUnit"))
 
+    def test_unit_method_async(self):
+        self.assertFalse(self.dc.unit_method_async(None, None, None))
+        self.assertFalse(self.dc.unit_method_async("cups.service", None, None))
+        self.assertFalse(self.dc.unit_method_async("cups.service", "Kill", None))
+        self.assertFalse(self.dc.finish_job("/org/freedesktop/systemd1/job/0", "done"))
+        self.assertEqual(self.dc.pending_jobs(), 0)
+
+    def test_unit_files_method_async(self):
+        self.assertFalse(self.dc.unit_files_method_async([], "enable", None))
+        self.assertFalse(self.dc.unit_files_method_async(["cups.service"], "mask", None))
+        self.assertFalse(self.dc.unit_files_method_async(["cups.service"], "EnableUnitFiles", None))
+
     def manual_unit_method(self):
         """May be dangerous to run, so renaming to manual so it doesn't run with 'make test'"""
         self.assertTrue(self.dc.unit_method("cups.service", "Restart"))
@@ -0,0 +1,138 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from src.modelsync import ModelSync
+from src.unit import Unit
+
+
+class ModelSyncTestCase(unittest.TestCase):
+
+    attached = None
+
+    def make_row(self, unit):
+        return [unit.getprop_fmt("Name"), unit.getprop_fmt("State"), unit.getprop_fmt("Substate")]
+
+    def attach(self, store):
+        self.attached = store
+
+    def make_units(self, count, substate="running"):
+        return [Unit(f"unit{i}.service", f"/unit/unit{i}", "", "loaded", "active", substate) for i in range(count)]
+
+    def test_first_load_is_bulk(self):
+        sync = ModelSync([str, str, str], self.make_row, self.attach)
+        touched = sync.reconcile(self.make_units(10))
+        self.assertEqual(touched, 10)
+        self.assertIs(self.attached, sync.store)
+        self.assertEqual(len(sync.store), 10)
+
+    def test_incremental_update(self):
+        sync = ModelSync([str, str, str], self.make_row, self.attach)
+        sync.reconcile(self.make_units(ModelSync.BULK_MIN_ROWS * 2))
+        firststore = sync.store
+
+        units = self.make_units(ModelSync.BULK_MIN_ROWS * 2)
+        units[3]['Substate'] = "failed"
+        del units[5]
+        units.append(Unit("extra.service", "/unit/extra", "", "loaded", "active", "running"))
+        touched = sync.reconcile(units)
+        self.assertEqual(touched, 3)
+        self.assertIs(sync.store, firststore)
+        self.assertEqual(len(sync.store), len(units))
+        self.assertEqual(sync.store[sync.get_iter("unit3.service")][2], "failed")
+        self.assertIsNone(sync.get_iter("unit5.service"))
+        self.assertIsNotNone(sync.get_iter("extra.service"))
+
+        self.assertEqual(sync.reconcile(units), 0)
+
+    def test_single_unit(self):
+        sync = ModelSync([str, str, str], self.make_row, self.attach)
+        sync.reconcile(self.make_units(3))
+        unit = Unit("unit1.service", "/unit/unit1", "", "loaded", "active", "dead")
+        self.assertTrue(sync.update(unit))
+        self.assertFalse(sync.update(unit))
+        self.assertIs(sync.get_unit("unit1.service"), unit)
+        self.assertTrue(sync.remove("unit1.service"))
+        self.assertFalse(sync.remove("unit1.service"))
+        self.assertEqual(len(sync.store), 2)
+
+    def test_search_keys(self):
+        built = []
+
+        def make_key(unit):
+            built.append(unit['Name'])
+            return f"{unit['Name']} {unit['Substate']}"
+        sync = ModelSync([str, str, str], self.make_row, self.attach, make_key=make_key)
+        units = self.make_units(3)
+        sync.reconcile(units)
+        # nothing is formatted before a search needs it
+        self.assertEqual(built, [])
+        self.assertEqual(sync.key(units[1]), "unit1.service running")
+        self.assertEqual(sync.key(units[1]), "unit1.service running")
+        self.assertEqual(built, ["unit1.service"])
+
+        # a changed row builds its key again, an unchanged one keeps it
+        built.clear()
+        units = self.make_units(3)
+        units[1]['Substate'] = "dead"
+        sync.reconcile(units)
+        sync.update(units[0])
+        self.assertEqual(sync.key(units[1]), "unit1.service dead")
+        self.assertEqual(built, ["unit1.service"])
+        sync.remove("unit1.service")
+        self.assertNotIn("unit1.service", sync.keys)
+        sync.key(units[0])
+        sync.clear_keys()
+        self.assertEqual(sync.keys, {})
+
+    def test_filter(self):
+        def make_row(unit):
+            return self.make_row(unit) + [True]
+        sync = ModelSync([str, str, str, bool], make_row, self.attach, 3)
+        units = self.make_units(12)
+        sync.reconcile(units)
+        self.assertEqual(len(sync.shown), 12)
+
+        self.assertEqual(sync.filter(lambda unit, row: "1" in row[0]), 9)
+        self.assertEqual(sync.shown, {"unit1.service", "unit10.service", "unit11.service"})
+        self.assertFalse(sync.store[sync.get_iter("unit2.service")][3])
+        # narrowing only looks at the shown rows
+        checked = []
+
+        def narrower(unit, row):
+            checked.append(unit['Name'])
+            return "11" in row[0]
+        self.assertEqual(sync.filter(narrower, ModelSync.FILTER_SHOWN), 2)
+        self.assertEqual(sorted(checked), ["unit1.service", "unit10.service", "unit11.service"])
+
+        # new and updated rows follow the current match
+        sync.update(Unit("unit110.service", "/unit/unit110", "", "loaded", "active", "running"))
+        sync.update(Unit("unit12.service", "/unit/unit12", "", "loaded", "active", "running"))
+        self.assertEqual(sync.shown, {"unit11.service", "unit110.service"})
+        sync.remove("unit11.service")
+        self.assertEqual(sync.shown, {"unit110.service"})
+
+        self.assertEqual(sync.filter(None, ModelSync.FILTER_HIDDEN), 12)
+        self.assertEqual(len(sync.shown), len(sync.rows))
+        self.assertEqual(sync.reconcile(list(sync.units.values())), 0)
+
+    def test_filter_candidates(self):
+        def make_row(unit):
+            return self.make_row(unit) + [True]
+        sync = ModelSync([str, str, str, bool], make_row, self.attach, 3)
+        sync.reconcile(self.make_units(6) + [Unit("x.service", "/unit/x", "", "loaded", "active", "exited")])
+        self.assertEqual(sync.index("Substate")["exited"], {"x.service"})
+        checked = []
+
+        def match(unit, row):
+            checked.append(unit['Name'])
+            return True
+        self.assertEqual(sync.filter(match, ModelSync.FILTER_ALL, {"x.service", "unit0.service"}), 5)
+        self.assertEqual(sorted(checked), ["unit0.service", "x.service"])
+        # the index follows the units
+        sync.update(Unit("unit1.service", "/unit/unit1", "", "loaded", "active", "exited"))
+        self.assertEqual(sync.index("Substate")["exited"], {"x.service", "unit1.service"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+from src.propcache import PropCache
+
+
+class PropCacheTestCase(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = PropCache(10)
+        self.assertIsNone(cache.get("/unit/a", "Unit"))
+        cache.put("/unit/a", "Unit", {"Id": "a"})
+        self.assertEqual(cache.get("/unit/a", "Unit"), {"Id": "a"})
+        self.assertIsNone(cache.get("/unit/a", "Service"))
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 2, "size": 1})
+
+    def test_lru_eviction(self):
+        cache = PropCache(2)
+        cache.put("/unit/a", "Unit", {"Id": "a"})
+        cache.put("/unit/b", "Unit", {"Id": "b"})
+        cache.get("/unit/a", "Unit")
+        cache.put("/unit/c", "Unit", {"Id": "c"})
+        self.assertEqual(len(cache), 2)
+        self.assertIsNotNone(cache.get("/unit/a", "Unit"))
+        self.assertIsNone(cache.get("/unit/b", "Unit"))
+        self.assertIsNotNone(cache.get("/unit/c", "Unit"))
+
+    def test_invalidate(self):
+        cache = PropCache()
+        cache.put("/unit/a", "Unit", {"Id": "a"})
+        cache.put("/unit/a", "Service", {"Type": "simple"})
+        cache.put("/unit/b", "Unit", {"Id": "b"})
+        cache.invalidate("/unit/a", "Service")
+        self.assertIsNone(cache.get("/unit/a", "Service"))
+        self.assertIsNotNone(cache.get("/unit/a", "Unit"))
+        cache.invalidate("/unit/a")
+        self.assertIsNone(cache.get("/unit/a", "Unit"))
+        cache.invalidate_iface("Unit")
+        self.assertEqual(len(cache), 0)
+
+    def test_update(self):
+        cache = PropCache()
+        cache.put("/unit/a", "Unit", {"ActiveState": "active", "SubState": "running"})
+        cache.update("/unit/a", "Unit", {"SubState": "exited"})
+        self.assertEqual(cache.get("/unit/a", "Unit")["SubState"], "exited")
+        cache.update("/unit/a", "Unit", {}, ["ActiveState"])
+        self.assertIsNone(cache.get("/unit/a", "Unit"))
+        cache.update("/unit/b", "Unit", {"SubState": "exited"})
+        self.assertEqual(len(cache), 0)
+
+    def test_merge(self):
+        cache = PropCache()
+        cache.merge("/unit/a", "Unit", {})
+        self.assertEqual(len(cache), 0)
+        cache.merge("/unit/a", "Unit", {"FragmentPath": "/etc/a"})
+        cache.merge("/unit/a", "Unit", {"UnitFileState": "enabled"})
+        self.assertEqual(cache.get("/unit/a", "Unit"), {"FragmentPath": "/etc/a", "UnitFileState": "enabled"})
+
+    def test_ttl(self):
+        now = [100.0]
+        cache = PropCache(ttl=30, clock=lambda: now[0])
+        cache.put("/unit/a", "Socket", {"NConnections": 1})
+        now[0] += 20
+        cache.merge("/unit/a", "Socket", {"NAccept": 4})
+        self.assertEqual(cache.get("/unit/a", "Socket"), {"NConnections": 1, "NAccept": 4})
+        now[0] += 20
+        self.assertIsNone(cache.get("/unit/a", "Socket"))
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import io
+import json
+import unittest
+
+from gi.repository import GLib
+
+from src.snapshot import NdjsonWriter, CsvWriter, TableWriter, Snapshot, exit_status, parse_args
+from src.unit import Unit
+
+
+class DoneFetch:
+    def __init__(self, stale=(), list_error=None):
+        self.stale = set(stale)
+        self.list_error = list_error
+
+
+class StreamingCaller:
+    """Stands in for DBusCaller, hands over each unit straight away"""
+    def __init__(self, units, fetch=None):
+        self.units = units
+        self.fetch = fetch or DoneFetch()
+        self.request = None
+
+    def list_details_async(self, states, patterns, detail_columns, done_cb, userdata, max_inflight, unit_cb):
+        self.request = (states, patterns, detail_columns)
+        for unit in self.units:
+            unit_cb(unit, userdata)
+        done_cb([], userdata)
+        return self.fetch
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    columns = ["Name", "State", "Main PID"]
+
+    def make_units(self):
+        units = [Unit("a.service", "/unit/a", "A", "loaded", "active", "running"),
+                 Unit("b.service", "/unit/b", "B, with comma", "loaded", "failed", "failed")]
+        units[0]["MainPID"] = 42
+        units[1]["MainPID"] = 0
+        return units
+
+    def run_snapshot(self, writerclass):
+        stream = io.StringIO()
+        caller = StreamingCaller(self.make_units())
+        snapshot = Snapshot(caller, writerclass(stream, self.columns), ['active'], ['*.service'], self.columns)
+        self.assertEqual(snapshot.run(), 2)
+        self.assertEqual(caller.request, (['active'], ['*.service'], ['MainPID']))
+        return stream.getvalue().splitlines()
+
+    def test_ndjson(self):
+        lines = self.run_snapshot(NdjsonWriter)
+        self.assertEqual(json.loads(lines[0]), {"Name": "a.service", "State": "active", "Main PID": "42"})
+        self.assertEqual(len(lines), 2)
+
+    def test_csv(self):
+        lines = self.run_snapshot(CsvWriter)
+        self.assertEqual(lines[0], "Name,State,Main PID")
+        self.assertEqual(lines[2], "b.service,failed,0")
+
+    def test_no_answer(self):
+        caller = StreamingCaller([], DoneFetch(list_error=GLib.Error("timed out")))
+        snapshot = Snapshot(caller, NdjsonWriter(io.StringIO(), self.columns), [], ['*.service'], self.columns)
+        self.assertEqual(snapshot.run(), 0)
+        self.assertEqual(snapshot.list_error.message, "timed out")
+        self.assertEqual(exit_status(snapshot), 1)
+
+        caller = StreamingCaller(self.make_units(), DoneFetch(stale=["b.service"]))
+        snapshot = Snapshot(caller, NdjsonWriter(io.StringIO(), self.columns), [], ['*.service'], self.columns)
+        self.assertEqual(snapshot.run(), 2)
+        self.assertEqual(snapshot.stale, ["b.service"])
+        self.assertEqual(exit_status(snapshot), 2)
+
+        snapshot = Snapshot(StreamingCaller([]), NdjsonWriter(io.StringIO(), self.columns), [], ['*.service'],
+                            self.columns)
+        snapshot.run()
+        self.assertEqual(exit_status(snapshot), 0)
+
+    def test_table(self):
+        lines = self.run_snapshot(TableWriter)
+        self.assertTrue(lines[0].startswith("Name"))
+        self.assertEqual(lines[1].split(), ["a.service", "active", "42"])
+        writer = TableWriter(io.StringIO(), ["State"])
+        writer.write(["x" * 40])
+        self.assertEqual(writer.stream.getvalue(), "x" * 11 + "~\n")
+
+    def test_args(self):
+        args = parse_args(["-t", "timer", "-s", "all", "-f", "ndjson"])
+        self.assertEqual(args.type, "timer")
+        self.assertEqual(args.state, ["all"])
+        self.assertEqual(args.format, "ndjson")
+
+
+if __name__ == '__main__':
+    unittest.main()
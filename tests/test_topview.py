@@ -0,0 +1,167 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from gi.repository import GLib
+
+from src.topview import TopTable, TopView
+from src.unit import Unit
+
+
+class TopTableTestCase(unittest.TestCase):
+
+    def make_unit(self, name, state, pid):
+        unit = Unit(name, "/unit/" + name.replace('.', '_'), name.upper(), "loaded", state, "running")
+        unit["MainPID"] = pid
+        return unit
+
+    def make_table(self):
+        table = TopTable(["Name", "State", "Main PID"])
+        table.set_units([self.make_unit("b.service", "active", 10),
+                         self.make_unit("a.service", "failed", 9),
+                         self.make_unit("c.service", "active", 100)])
+        return table
+
+    def test_sort(self):
+        table = self.make_table()
+        self.assertEqual(table.visible(), ["a.service", "b.service", "c.service"])
+        table.set_sort(2)
+        self.assertEqual(table.visible(), ["a.service", "b.service", "c.service"])
+        table.set_sort(2, reverse=True)
+        self.assertEqual(table.visible(), ["c.service", "b.service", "a.service"])
+        table.set_sort(3)
+        self.assertEqual(table.sortcol, 0)
+        self.assertTrue(table.header().startswith("Name ^"))
+
+    def test_search(self):
+        table = self.make_table()
+        table.set_search("FAIL")
+        self.assertEqual(table.visible(), ["a.service"])
+        table.set_search("")
+        self.assertEqual(len(table.visible()), 3)
+
+    def test_update(self):
+        table = self.make_table()
+        order = table.visible()
+        self.assertEqual(table.set_units([self.make_unit("b.service", "active", 10),
+                                          self.make_unit("a.service", "failed", 9),
+                                          self.make_unit("c.service", "active", 100)]), 0)
+        self.assertIs(table.visible(), order)
+
+        unit = table.get_by_path("/unit/a_service")
+        self.assertTrue(unit.apply_props({"ActiveState": "active"}))
+        self.assertTrue(table.update(unit))
+        self.assertEqual(table.lines["a.service"].split(), ["a.service", "active", "9"])
+
+        self.assertEqual(table.set_units([unit]), 2)
+        self.assertEqual(table.visible(), ["a.service"])
+        self.assertIsNone(table.get_by_path("/unit/b_service"))
+
+
+
+class FakeFetch:
+    finished = False
+    list_error = None
+
+    def __init__(self, done_cb, userdata):
+        self.done_cb = done_cb
+        self.userdata = userdata
+        self.stale = set()
+
+    def cancel(self):
+        self.finished = True
+
+    def reply(self, units, stale=(), list_error=None):
+        self.finished = True
+        self.stale = set(stale)
+        self.list_error = list_error
+        self.done_cb(units, self.userdata)
+
+
+class FakeCaller:
+    """Hands out the fetches a TopView starts instead of calling systemd"""
+    def __init__(self):
+        self.fetches = []
+        self.dirty = (False, set())
+
+    def list_details_async(self, states, patterns, columns, done_cb, userdata=None, max_inflight=None,
+                           deadline_millis=None):
+        self.fetches.append(FakeFetch(done_cb, userdata))
+        return self.fetches[-1]
+
+    def unit_list_details_async(self, names, columns, done_cb, userdata=None, max_inflight=None,
+                                deadline_millis=None):
+        return self.list_details_async([], names, columns, done_cb, userdata, max_inflight)
+
+    def take_dirty(self):
+        return self.dirty
+
+
+class TopViewTestCase(unittest.TestCase):
+
+    def make_unit(self, name, substate):
+        return Unit(name, "/unit/" + name.replace('.', '_'), "", "loaded", "active", substate)
+
+    def make_view(self, caller):
+        view = TopView(caller, None, "service", [], ["*.service"], ["Name", "Substate", "Main PID"])
+        view.queue_draw = lambda: None
+        view.refresh_all()
+        units = [self.make_unit(f"{name}.service", "running") for name in "abcdef"]
+        for num, unit in enumerate(units):
+            unit["MainPID"] = num + 10
+        caller.fetches[-1].reply(units)
+        return view
+
+    def test_no_answer(self):
+        caller = FakeCaller()
+        view = self.make_view(caller)
+        error = GLib.Error("timed out")
+        # a failed list keeps every row and lists them all again next time
+        view.refresh_all()
+        caller.fetches[-1].reply([], list_error=error)
+        self.assertEqual(len(view.table), 6)
+        self.assertIn("6 rows stale", view.status)
+        view.on_refresh()
+        self.assertEqual(len(caller.fetches), 3)
+
+        units = [self.make_unit(f"{name}.service", "running") for name in "abcdef"]
+        caller.fetches[-1].reply(units, stale=["b.service"])
+        self.assertEqual(view.table.units["b.service"]["MainPID"], 11)
+        self.assertIn("1 stale", view.status)
+
+        # the stale unit and the units of a failed partial refresh are fetched again
+        caller.dirty = (False, {"a.service"})
+        view.on_refresh()
+        self.assertEqual(sorted(caller.fetches[-1].userdata["names"]), ["a.service", "b.service"])
+        caller.fetches[-1].reply([], list_error=error)
+        self.assertEqual(len(view.table), 6)
+        caller.dirty = (False, set())
+        view.on_refresh()
+        self.assertEqual(sorted(caller.fetches[-1].userdata["names"]), ["a.service", "b.service"])
+
+    def test_stale_partial_refresh(self):
+        caller = FakeCaller()
+        view = TopView(caller, None, "service", [], ["*.service"], ["Name", "Substate"])
+        view.queue_draw = lambda: None
+        view.refresh_all()
+        caller.fetches[-1].reply([self.make_unit(f"{name}.service", "running") for name in "abc"])
+
+        caller.dirty = (False, {"a.service"})
+        view.on_refresh()
+        partial = caller.fetches[-1]
+        view.refresh_all()
+        self.assertTrue(partial.finished)
+        caller.fetches[-1].reply([self.make_unit("a.service", "exited")])
+        # a late reply of the partial refresh doesn't overwrite the newer rows
+        partial.reply([self.make_unit("a.service", "running"), self.make_unit("b.service", "running")])
+        self.assertEqual(list(view.table.units), ["a.service"])
+        self.assertEqual(view.table.units["a.service"]['Substate'], "exited")
+
+        caller.dirty = (False, {"a.service"})
+        view.on_refresh()
+        caller.fetches[-1].reply([self.make_unit("a.service", "dead")])
+        self.assertEqual(view.table.units["a.service"]['Substate'], "dead")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -35,6 +35,82 @@ class UnitTestCase(unittest.TestCase):
         self.assertEqual(u.getprop_fmt("Multi Word Param"), '5')
         print("Last one...........")
 
+    def test_apply_props(self):
+        u = Unit("test4.service", "/unit/test4_2eservice", "Test Service", "loaded", "active", "running")
+        u["MainPID"] = 100
+        self.assertFalse(u.apply_props({"SubState": "running", "ExecMainPID": 100}))
+        self.assertNotIn("ExecMainPID", u)
+        self.assertTrue(u.apply_props({"ActiveState": "failed", "SubState": "failed", "MainPID": 0}))
+        self.assertEqual(u["State"], "failed")
+        self.assertEqual(u["Substate"], "failed")
+        self.assertEqual(u.getprop_fmt("Main PID"), "0")
+
+    def test_mapping(self):
+        u = Unit("test5.service", "/unit/test5_2eservice", "Test Service", "loaded", "active", "running")
+        keys = ["Name", "Path", "Description", "Load", "State", "Substate", "UnitType", "Service"]
+        self.assertEqual(list(u), keys)
+        self.assertEqual(len(u), len(keys))
+        u["MainPID"] = 10
+        u.update({"Type": "simple", "MainPID": 11, "FragmentPath": "/lib/test5.service"})
+        self.assertEqual(list(u), keys + ["MainPID", "Type", "FragmentPath"])
+        self.assertEqual(u["MainPID"], 11)
+        self.assertEqual(dict(u)["Type"], "simple")
+        del u["Type"]
+        self.assertNotIn("Type", u)
+        self.assertIsNone(u.get("Type"))
+        self.assertEqual(u.getprop_fmt("Fragment Path"), "/lib/test5.service")
+        with self.assertRaises(KeyError):
+            u["Type"]
+
+    def test_shared_layout(self):
+        first = Unit("a.service", "/unit/a", "A", "loaded", "active", "running")
+        second = Unit("b.service", "/unit/b", "B", "loaded", "".join(["act", "ive"]), "running")
+        for u in first, second:
+            u["UnitFileState"] = "".join(["en", "abled"])
+            u["MainPID"] = 1
+        self.assertIs(first._layout, second._layout)
+        self.assertIs(first["State"], second["State"])
+        self.assertIs(first["UnitFileState"], second["UnitFileState"])
+        second["Extra"] = 1
+        self.assertIsNot(first._layout, second._layout)
+        self.assertNotIn("Extra", first)
+
+    def test_formatters(self):
+        u = Unit("test6.timer", "/unit/test6_2etimer")
+        u.update({"AccuracyUSec": 500, "RestartUSec": 1500, "TimeoutUSec": 2000000, "WatchdogUSec": 100000000,
+                  "MainPID": 0xFFFFFFFF, "DirectoryMode": 0o755, "Listen": [("Stream", "/run/a")],
+                  "Triggers": ["a.service", "b.service"], "Job": (0, "/"), "Persistent": True, "Empty": []})
+        self.assertEqual(u.getprop_fmt("AccuracyUSec"), "500us")
+        self.assertEqual(u.getprop_fmt("RestartUSec"), "1.5ms")
+        self.assertEqual(u.getprop_fmt("TimeoutUSec"), "2s")
+        self.assertEqual(u.getprop_fmt("WatchdogUSec"), "0:01:40")
+        self.assertEqual(u.getprop_fmt("Main PID"), "[not set]")
+        self.assertEqual(u.getprop_fmt("DirectoryMode"), "0755")
+        self.assertEqual(u.getprop_fmt("Listen"), "('Stream', '/run/a')")
+        self.assertEqual(u.getprop_fmt("Triggers"), "'a.service', 'b.service'")
+        self.assertEqual(u.getprop_fmt("Job"), "0, '/'")
+        self.assertEqual(u.getprop_fmt("Persistent"), "True")
+        self.assertEqual(u.getprop_fmt("Empty"), "")
+        # a missing multi word property reads as None, a single word one as empty
+        self.assertEqual(u.getprop_fmt("Not There"), "None")
+        self.assertEqual(u.getprop_fmt("NotThere"), "")
+        self.assertIs(Unit.formatter("RestartUSec"), Unit.formatter("RestartUSec"))
+
+    def test_format_column(self):
+        units = [Unit(f"test{num}.service", "") for num in range(3)]
+        for num, u in enumerate(units):
+            u["TimeoutStartUSec"] = num * 1000
+            u["ActiveEnterTimestamp"] = 1700000000000000
+        units[2]["Main PID"] = 7
+        for prop in ["Name", "TimeoutStartUSec", "Active Enter Timestamp", "Main PID", "Unknown", "Un Known"]:
+            self.assertEqual(Unit.format_column(units, prop), [u.getprop_fmt(prop) for u in units])
+
+    def test_format_value(self):
+        u = Unit("test.service", "")
+        u.update({"TimeoutStartUSec": 1500, "ActiveEnterTimestamp": 1700000000000000, "MainPID": 7})
+        for prop in ["Name", "TimeoutStartUSec", "Active Enter Timestamp", "Main PID", "Unknown", "Un Known"]:
+            self.assertEqual(Unit.format_value(prop, u.get(prop.replace(' ', ''))), u.getprop_fmt(prop))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,74 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import io
+import json
+import os
+import unittest
+
+from src.unithelper import UnitHelper, HelperSession
+
+
+class DryRunHelper(UnitHelper):
+    """Records the systemctl calls instead of running them"""
+    def __init__(self):
+        self.calls = []
+
+    def call_elevated_sysctl(self, unitname, action):
+        self.calls.append((action, unitname))
+        return 0, f"{action} {unitname}"
+
+
+class UnitHelperTestCase(unittest.TestCase):
+
+    def test_validate_request(self):
+        h = UnitHelper()
+        self.assertIsNone(h.validate_request("cups.service", "enable", h._cli_actions))
+        self.assertIsNotNone(h.validate_request("cups.service", "mask", h._cli_actions))
+        self.assertIsNotNone(h.validate_request("home.mount", "enable", h._cli_actions))
+        self.assertIsNotNone(h.validate_request(None, "enable", h._cli_actions))
+        self.assertIsNone(h.validate_request("cups.socket", "mask", h._unit_actions))
+        self.assertIsNone(h.validate_request(None, "daemon-reload", h._manager_actions))
+        self.assertIsNotNone(h.validate_request("--root=/x.service", "mask", h._unit_actions))
+        self.assertIsNotNone(h.validate_request("-H host.service", "enable", h._cli_actions))
+        self.assertIsNotNone(h.validate_request("../x.service", "unmask", h._unit_actions))
+
+    def test_session_handle(self):
+        h = DryRunHelper()
+        session = HelperSession(h, None, io.StringIO())
+        response = session.handle(b'{"id": 3, "action": "unmask", "unit": "cups.service"}')
+        self.assertEqual(response["id"], 3)
+        self.assertEqual(response["returncode"], 0)
+        self.assertEqual(h.calls, [("unmask", "cups.service")])
+
+        self.assertEqual(session.handle(b'not json')["returncode"], 1)
+        self.assertEqual(session.handle(b'[1, 2]')["returncode"], 1)
+        self.assertEqual(session.handle(b'{"id": 4, "action": "stop", "unit": "cups.service"}')["returncode"], 1)
+        self.assertEqual(session.handle(b'{"id": 5, "action": "enable", "unit": "/etc/passwd"}')["returncode"], 1)
+        self.assertEqual(len(h.calls), 1)
+
+    def test_session_stream(self):
+        h = DryRunHelper()
+        readfd, writefd = os.pipe()
+        requests = [{"id": 1, "action": "enable", "unit": "a.timer"},
+                    {"id": 2, "action": "daemon-reload"}]
+        os.write(writefd, "".join(json.dumps(r) + "\n" for r in requests).encode())
+        os.close(writefd)
+        out = io.StringIO()
+        self.assertEqual(HelperSession(h, readfd, out, 5).run(), 0)
+        os.close(readfd)
+
+        ready, *responses = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertTrue(ready["ready"])
+        self.assertEqual([r["id"] for r in responses], [1, 2])
+        self.assertEqual(h.calls, [("enable", "a.timer"), ("daemon-reload", None)])
+
+    def test_session_idle_timeout(self):
+        readfd, writefd = os.pipe()
+        out = io.StringIO()
+        self.assertEqual(HelperSession(DryRunHelper(), readfd, out, 0.1).run(), 0)
+        os.close(readfd)
+        os.close(writefd)
+
+
+if __name__ == '__main__':
+    unittest.main()
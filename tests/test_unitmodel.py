@@ -0,0 +1,104 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from gi.repository import Gtk
+
+from src.modelsync import ModelSync
+from src.unit import Unit
+from src.unitmodel import UnitModel
+
+
+class UnitModelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.formatted = []
+        self.coltypes = [str, str, str, bool]
+        self.sync = ModelSync(self.coltypes, self.make_row, self.attach, 3, self.make_model)
+        self.mirror = []
+
+    def make_model(self):
+        return UnitModel(self.coltypes, [None, self.format_state, None], 3)
+
+    def format_state(self, value):
+        self.formatted.append(value)
+        return value.upper()
+
+    def make_row(self, unit):
+        return [unit['Name'], unit['State'], unit.get("MainPID"), True]
+
+    def attach(self, model):
+        # what a tree view would do with a new model
+        model.flush(notify=False)
+        self.mirror = self.shown(model)
+        model.connect("row-inserted", lambda model, path, treeiter:
+                      self.mirror.insert(path.get_indices()[0], model.do_get_value(treeiter, 0)))
+        model.connect("row-deleted", lambda model, path: self.mirror.pop(path.get_indices()[0]))
+        model.connect("rows-reordered", lambda model, path, treeiter, order: self.reread(model))
+
+    def reread(self, model):
+        self.mirror = self.shown(model)
+
+    @staticmethod
+    def shown(model):
+        rows = []
+        for num in range(model.do_iter_n_children(None)):
+            found, treeiter = model.do_iter_nth_child(None, num)
+            rows.append(model.do_get_value(treeiter, 0))
+        return rows
+
+    def make_units(self, count):
+        units = []
+        for num in range(count):
+            unit = Unit(f"unit{num:02}.service", f"/unit/unit{num}", "", "loaded", "active", "running")
+            unit["MainPID"] = 100 - num
+            units.append(unit)
+        return units
+
+    def test_lazy_cells(self):
+        self.sync.reconcile(self.make_units(300))
+        model = self.sync.store
+        self.assertEqual(self.formatted, [])
+        found, treeiter = model.do_get_iter(Gtk.TreePath.new_from_indices([5]))
+        self.assertEqual(model.do_get_value(treeiter, 1), "ACTIVE")
+        self.assertEqual(model.do_get_value(treeiter, 1), "ACTIVE")
+        self.assertEqual(self.formatted, ["active"])
+        self.assertEqual(model.do_get_value(treeiter, 0), "unit05.service")
+
+    def test_changes(self):
+        units = self.make_units(10)
+        self.sync.reconcile(units)
+        model = self.sync.store
+        self.assertEqual(self.mirror, [unit['Name'] for unit in units])
+
+        del units[3]
+        units.append(Unit("extra.service", "/unit/extra", "", "loaded", "active", "running"))
+        self.sync.reconcile(units)
+        model.flush()
+        self.assertEqual(self.mirror, self.shown(model))
+        self.assertEqual(self.mirror[0], "extra.service")
+        self.assertNotIn("unit03.service", self.mirror)
+
+        # hidden rows leave the view, sorting on the raw numbers
+        self.sync.filter(lambda unit, row: unit['Name'] != "unit05.service")
+        model.set_sort_column_id(2, Gtk.SortType.ASCENDING)
+        model.flush()
+        self.assertEqual(self.mirror, self.shown(model))
+        self.assertEqual(self.mirror[:3], ["unit09.service", "unit08.service", "unit07.service"])
+        self.assertEqual(self.mirror[-1], "extra.service")
+        self.assertNotIn("unit05.service", self.mirror)
+        self.assertEqual(model.path_of("unit08.service").get_indices(), [1])
+        self.assertIsNone(model.path_of("unit05.service"))
+
+        # a change of many rows refills the view
+        model.PATCH_MAX_ROWS = 4
+        self.sync.filter(lambda unit, row: False)
+        model.flush()
+        self.assertEqual(self.mirror, [])
+        self.sync.filter(None)
+        model.flush()
+        self.assertEqual(len(self.mirror), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
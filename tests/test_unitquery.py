@@ -0,0 +1,76 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from src.unit import Unit
+from src.unitquery import UnitQuery, QueryError, parse_span
+
+NOW = 1700000000
+
+
+class UnitQueryTestCase(unittest.TestCase):
+
+    def make_service(self, name, state, substate, type_, path, pid=0):
+        unit = Unit(name, "/unit/" + name, "Test " + name, "loaded", state, substate)
+        unit.update({"UnitFileState": "enabled", "Type": type_, "FragmentPath": path, "MainPID": pid})
+        return unit
+
+    def make_timer(self, name, next_in):
+        unit = Unit(name, "/unit/" + name, "", "loaded", "active", "waiting")
+        unit.update({"NextElapseUSecRealtime": (NOW + next_in) * 1000000 if next_in else 0,
+                     "Triggers": [name.replace(".timer", ".service")]})
+        return unit
+
+    def units(self):
+        return [self.make_service("a.service", "failed", "failed", "oneshot", "/etc/systemd/system/a.service"),
+                self.make_service("b.service", "failed", "failed", "simple", "/etc/systemd/system/b.service"),
+                self.make_service("c.service", "failed", "failed", "oneshot", "/usr/lib/systemd/system/c.service"),
+                self.make_service("d.service", "active", "running", "oneshot", "/etc/systemd/system/d.service", 42)]
+
+    def names(self, text, units):
+        query = UnitQuery(text, now=NOW)
+        return [unit['Name'] for unit in units if query.matches(unit, unit['Name'])]
+
+    def test_fields(self):
+        units = self.units()
+        self.assertEqual(self.names("state:failed type:oneshot path:/etc/*", units), ["a.service"])
+        self.assertEqual(self.names("STATE:Failed -type:oneshot", units), ["b.service"])
+        self.assertEqual(self.names("sub:run* pid>0", units), ["d.service"])
+        self.assertEqual(self.names("MainPID=42", units), ["d.service"])
+        self.assertEqual(self.names("state:failed c.", units), ["c.service"])
+        self.assertEqual(self.names("Unknown:x", units), [])
+
+    def test_plain(self):
+        self.assertTrue(UnitQuery("ssh").is_plain)
+        self.assertTrue(UnitQuery("foo:bar").is_plain)
+        self.assertFalse(UnitQuery("state:failed").is_plain)
+        self.assertTrue(UnitQuery("").matches(Unit("x", ""), "x"))
+        self.assertRaises(QueryError, UnitQuery, "state:")
+        self.assertRaises(QueryError, UnitQuery, "next<1x")
+
+    def test_time(self):
+        self.assertEqual(parse_span("90"), 90000000)
+        self.assertEqual(parse_span("1h30m"), 5400000000)
+        self.assertEqual(parse_span("500ms"), 500000)
+        units = [self.make_timer("soon.timer", 600), self.make_timer("late.timer", 7200),
+                 self.make_timer("never.timer", 0)]
+        self.assertEqual(self.names("next<1h", units), ["soon.timer"])
+        self.assertEqual(self.names("next>=1h", units), ["late.timer"])
+        self.assertEqual(self.names("triggers:late.*", units), ["late.timer"])
+
+    def test_candidates(self):
+        units = {unit['Name']: unit for unit in self.units()}
+
+        def index(prop):
+            values = {}
+            for name, unit in units.items():
+                values.setdefault(unit.get(prop), set()).add(name)
+            return values
+        self.assertEqual(UnitQuery("state:failed type:oneshot").candidates(index), {"a.service", "c.service"})
+        self.assertEqual(UnitQuery("sub:f* path:/etc/*").candidates(index), {"a.service", "b.service", "c.service"})
+        # negated and unindexed terms don't narrow the candidates
+        self.assertIsNone(UnitQuery("-state:failed path:/etc/*").candidates(index))
+
+
+if __name__ == '__main__':
+    unittest.main()